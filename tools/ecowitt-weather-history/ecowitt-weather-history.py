@@ -52,9 +52,11 @@
 from urllib3 import Retry
 import time
 import json
+import threading
 import traceback
 from datetime import datetime, timedelta, date
-from collections import namedtuple
+from collections import namedtuple, deque
+from concurrent.futures import ThreadPoolExecutor
 try:
     from dateutil.parser import isoparse
     from dateutil import tz
@@ -124,6 +126,8 @@
         ECOUNITS = config.get('Ecowitt', 'UNITS', fallback='M')
         ECOMAC = config.get('Ecowitt', 'MAC')
         TIMEOUT = config.getint('Ecowitt', 'TIMEOUT', fallback=10)
+        ECOWORKERS = max(1, config.getint('Ecowitt', 'WORKERS', fallback=4))
+        ECORATE = config.getfloat('Ecowitt', 'RATE', fallback=1.0)
 
         # Get InfluxDB Settings
         IHOST = config.get('InfluxDB', 'HOST')
@@ -162,6 +166,8 @@
                 ECOUNITS = ecoconf.get('Ecowitt', 'UNITS', fallback=None)
                 ECOMAC = ecoconf.get('Ecowitt', 'MAC', fallback=None)
                 TIMEOUT = ecoconf.getint('Ecowitt', 'TIMEOUT', fallback=10)
+                ECOWORKERS = 4
+                ECORATE = 1.0
 
                 # Get InfluxDB Settings
                 IHOST = ecoconf.get('InfluxDB', 'HOST', fallback=None)
@@ -363,6 +369,15 @@
     if TIMEOUT != 10:
         config['Ecowitt']['TIMEOUT'] = str(TIMEOUT)
 
+    if not configloaded:
+        ECOWORKERS = 4
+        ECORATE = 1.0
+    else:
+        if ECOWORKERS != 4:
+            config['Ecowitt']['WORKERS'] = str(ECOWORKERS)
+        if ECORATE != 1.0:
+            config['Ecowitt']['RATE'] = str(ECORATE)
+
     config['InfluxDB'] = {}
     config['InfluxDB']['HOST'] = IHOST
     config['InfluxDB']['PORT'] = str(IPORT)
@@ -399,10 +414,50 @@
 elif ECOUNITS == 'imperial':
     ecoapi = ecoapi + "&temp_unitid=2&pressure_unitid=4&wind_speed_unitid=9rainfall_unitid=13&solar_irradiance_unitid=16"
 
+# History data resolution tiers: (data available for past days, request time span in days, resolution in minutes)
+# (the Ecowitt API returns data at the resolution of the tier when the request time span is within the limit)
+Tier = namedtuple('Tier', ['days', 'span', 'minutes'])
+TIERS = (
+    Tier(90, 1, 5),
+    Tier(365, 7, 30),
+    Tier(730, 30, 240),
+    Tier(None, 365, 1440),
+)
+FIRSTDAY = date(2019, 1, 1)
+Window = namedtuple('Window', ['tier', 'start', 'end'])
+
+# Data point fields: (sensor group, sensor name, field key, value type) in Line Protocol field order
+FIELDMAP = (
+    ("outdoor", "temperature", "temperature", 'float'),
+    ("outdoor", "feels_like", "feels_like", 'float'),
+    ("outdoor", "app_temp", "app_temp", 'float'),
+    ("outdoor", "dew_point", "dew_point", 'float'),
+    ("outdoor", "humidity", "humidity", 'int'),
+    ("indoor", "temperature", "inside_temp", 'float'),
+    ("indoor", "humidity", "inside_humidity", 'int'),
+    ("solar_and_uvi", "solar", "solar", 'float'),
+    ("solar_and_uvi", "uvi", "uvi", 'int'),
+    ("rainfall", "hourly", "rain_1h", 'float'),
+    ("rainfall", "daily", "rain_24h", 'float'),
+    ("wind", "wind_speed", "wind_speed", 'float'),
+    ("wind", "wind_gust", "wind_gust", 'float'),
+    ("wind", "wind_direction", "wind_deg", 'int'),
+    ("pressure", "absolute", "absolute", 'float'),
+    ("co2_aqi_combo", "co2", "co2", 'float'),
+    ("pm25_aqi_combo", "pm25", "pm25", 'float'),
+    ("pm10_aqi_combo", "pm10", "pm10", 'float'),
+)
+FORMATTERS = {
+    'int': lambda v: f"{int(v)}i",
+    'float': lambda v: str(float(v)),
+}
+MISSING = ("", "-", "--")
 
 weatherdata = []
 weathergaps = None
 finished = False
+ratelock = threading.Lock()
+nextcall = 0
 
 # Helper Functions
 def check_datetime(dt, name, newtz):
@@ -435,171 +490,236 @@ def check_datetime(dt, name, newtz):
         )
     return dt
 
-def lpr(value):
+def lpcolumn(values, key, valtype):
     """
-    Return Line Protocol formatted string for InfluxDB field values based on the data type
+    Return column of Line Protocol formatted key/value pair strings by timestamp for sensor 'values' list
+    (missing values, e.g. "" or "-" when a sensor was offline, are left out of the column)
     """
-    if type(value) is int:
-        rv = f"{value}i"
-    elif type(value) is str:
-        rv = value.replace('"', '\\"')
-        rv = f'"{rv}"'
-    else:
-        rv = str(value)
-    return rv
-
-def lprmap(data, group, key, value, valtype=None, searchfor=None):
+    fmt = FORMATTERS[valtype]
+    column = {}
+    formatted = {}
+    for ts, v in values.items():
+        # Sensor readings repeat often (e.g. rain "0.0"), so each distinct value is only formatted once
+        field = formatted.get(v)
+        if field is None:
+            field = ""
+            if v is not None and v not in MISSING:
+                try:
+                    field = f"{key}={fmt(v)}"
+                except (TypeError, ValueError):
+                    # Not a valid number
+                    pass
+            formatted[v] = field
+        if field:
+            column[ts] = field
+    return column
+
+def halt_get_weather():
     """
-    Return mapped Line Protocol formatted key/value pair string, if value found in data
+    Show program halted prompt, allowing user to resume, write current data, or abort
     """
-    if searchfor == None:
-        searchfor=key
-    try:
-        newval = data[group][searchfor]["list"]
-        if valtype == 'float':
-            v = float(newval[value])
-        elif valtype == 'int':
-            v = int(newval[value])
-        elif valtype == 'str':
-            v = str(newval[value])
+    global finished
+
+    print()
+    while True:
+        try:
+            response = input("Program halted - R)esume, Q)uit (write data), or A)bort: [R/Q/A] ").strip().lower()
+        except KeyboardInterrupt:
+            print()
         else:
-            v = newval[value]
-        return f",{key}={lpr(v)}"
-    except:
-        return ""
+            if response == "r":
+                return
+            elif response == "q":
+                finished = True
+                return
+            elif response == "a":
+                sys.exit()
+
+def throttle():
+    """
+    Wait until the next Ecowitt API request is allowed by the requests per second RATE limit
+    """
+    global nextcall
 
-def getdays(startime):
+    if ECORATE <= 0:
+        return
+    with ratelock:
+        now = time.monotonic()
+        wait = nextcall - now
+        nextcall = max(now, nextcall) + 1 / ECORATE
+    if wait > 0:
+        time.sleep(wait)
+
+def tier_periods(start, end):
     """
-    * 5 minutes resolution data within the past 90days, each data request time span should not be longer than a complete day；
-    * 30 minutes resolution data within the past 365days, each data request time span should not be longer than a complete week；
-    * 240 minutes resolution data within the past 730days, each data request time span should not be longer than a complete month；
-    * 24hours resolution data since 2019.1.1, each data request time span should not be longer than a complete year;
+    Split start/end date/time range into the periods of each resolution tier:
+        * 5 minutes resolution data within the past 90 days
+        * 30 minutes resolution data within the past 365 days
+        * 240 minutes resolution data within the past 730 days
+        * 24 hours resolution data since 2019-01-01
 
+    Returns list of (tier, start, end) periods in time order
     """
-    if startime > currtime - timedelta(days=-90):
-        numdays = 1
-    elif startime > currtime - timedelta(days=-365) and startime <= currtime - timedelta(days=-90):
-        numdays = 7
-    elif startime > currtime - timedelta(days=-730) and startime <= currtime - timedelta(days=-365):
-        numdays = 30
-    else:
-        numdays = 365
-    return numdays
+    periods = []
+    newer = end
+    for i, tier in enumerate(TIERS):
+        if tier.days is not None:
+            older = max(start, currtime - timedelta(days=tier.days))
+        else:
+            older = start
+        if older < newer:
+            periods.append((i, older, newer))
+        if older <= start:
+            break
+        # Next tier ends where this one starts (or at the range end if that is older)
+        newer = min(newer, older)
+    return periods[::-1]
 
 # Ecowitt API Functions
+def plan_windows(start, end):
+    """
+    Split start/end date/time range into request windows of each resolution tier (see tier_periods()):
+        * 1 day per request within the past 90 days
+        * 7 days per request within the past 365 days
+        * 30 days per request within the past 730 days
+        * 365 days per request since 2019-01-01
+
+    Returns list of windows (tier, first date, last date) from the highest resolution tier, in time order
+    within each tier
+    """
+    windows = []
+    for i, older, newer in tier_periods(start, end):
+        # Request whole days (in InfluxDB timezone) within the tier period
+        day = max(older.astimezone(influxtz).date(), FIRSTDAY)
+        last = newer.astimezone(influxtz).date()
+        while day <= last:
+            windows.append(Window(i, day, min(day + timedelta(days=TIERS[i].span - 1), last)))
+            day += timedelta(days=TIERS[i].span)
+    return sorted(windows, key=lambda w: (w.tier, w.start))
+
+def get_window(window):
+    """
+    Request weather history data for window from Ecowitt API (waits for the RATE limit)
+
+    Returns response
+    """
+    throttle()
+    url = f"{ecoapi}&start_date={window.start}%2000:00:00&end_date={window.end}%2023:59:59"
+    return session.get(url, timeout=TIMEOUT)
+
+def decode_history(data):
+    """
+    Decode Ecowitt API history response 'data' into Line Protocol formatted field key/value pairs
+        * each sensor 'list' in FIELDMAP is decoded once into a column by timestamp
+        * data points are then created for each outdoor temperature timestamp in a single pass
+
+    Returns dict of field strings by epoch timestamp
+    """
+    columns = []
+    for group, searchfor, key, valtype in FIELDMAP:
+        values = (data.get(group) or {}).get(searchfor)
+        if values and values.get("list"):
+            columns.append(lpcolumn(values["list"], key, valtype))
+
+    points = {}
+    for ts in data["outdoor"]["temperature"]["list"]:
+        fields = ",".join([column[ts] for column in columns if ts in column])
+        if fields:
+            points[int(ts)] = fields
+    return points
+
+def merge_history(points, covered, start, end):
+    """
+    Merge decoded window 'points' into 'weatherdata' for start/end date/time, skipping the time ranges
+    'covered' by windows already merged (windows are merged from the highest resolution tier, so data
+    points from a higher resolution tier replace lower resolution data points for the time they cover)
+
+    Adds the time range of the window points to 'covered'
+    """
+    first = int(start.timestamp())
+    last = int(end.timestamp())
+    lo, hi = min(points), max(points)
+    # Time ranges of this window already covered by higher resolution data
+    higher = [(l, h) for l, h in covered if l <= hi and h >= lo]
+    covered.append((lo, hi))
+    for ts in sorted(points):
+        if first <= ts <= last and not any(l <= ts <= h for l, h in higher):
+            point = f"{IFIELD},source=timemachine {points[ts]} {ts}"
+            weatherdata.append(point)
+            if args.debug:
+                print(f"Datapnt: {point}")
+
 def get_weather_history(start, end):
     """
     Retrieve weather history data between start and end date/time
+        * the range is split into request windows of each resolution tier up front (see plan_windows())
+        * requests are sent concurrently (up to WORKERS at a time, and WORKERS * 2 queued) within the
+          requests per second RATE limit, and responses are processed from the highest resolution tier
+        * data points are written to InfluxDB when each tier is complete (or every 10000 data points), so
+          windows already processed are kept if the program is stopped
 
     Adds data points to 'weatherdata' in InfluxDB Line Protocol format with tag source='timemachine'
     """
-    global finished
-
     print(f"Retrieving data for gap: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(end - start)}s)")
 
-    # Retrieve weather history data for each day from start to end period
-    halted = False
-    curr = start
-    interval = timedelta(days=getdays(curr))
+    windows = plan_windows(start, end)
+    covered = []
+    tier = None
+    i = 0
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=ECOWORKERS)
+    try:
+        while True:
+            try:
+                # Queue requests ahead of the window being processed
+                while not finished and i < len(windows) and len(pending) < ECOWORKERS * 2:
+                    pending.append((windows[i], executor.submit(get_window, windows[i])))
+                    i += 1
 
-    while curr <= end:
-        print(f"* Loading data for time: [{curr.astimezone(influxtz)}]")
-        try:
-            dtstart = curr.date()
-            dtend = dtstart
-            dtend += interval
-            url = f"{ecoapi}&start_date={dtstart}%2000:00:00&end_date={dtend}%2023:59:59"
-            response = session.get(url, timeout=TIMEOUT)
-            if response.status_code == 200:
-                raw = response.json()
-                if args.debug:
-                    print(f"Request: {url}")
-                    print(f"Replied: {raw}")
-                # Create data point field key/value pairs in Line Protocol format
-                fields = ""
-                if "data" in raw and len(raw["data"]) > 0 and "outdoor" in raw["data"] and len(raw["data"]["outdoor"]) > 0:
-                    data = raw["data"]
-                    timestamps = list(data["outdoor"]["temperature"]["list"].keys())
-                    print(f"** Found {len(timestamps)} results")
-                    for i in timestamps:
-                        # outdoor
-                        fields += lprmap(data,"outdoor",'temperature', i, 'float')
-                        fields += lprmap(data,"outdoor",'feels_like', i, 'float')
-                        fields += lprmap(data,"outdoor",'app_temp', i, 'float')
-                        fields += lprmap(data,"outdoor",'dew_point', i, 'float')
-                        fields += lprmap(data,"outdoor",'humidity', i, 'int')
-                        # indoor
-                        if "indoor" in data and len(data["indoor"]) > 0:
-                            fields += lprmap(data, "indoor", 'inside_temp', i, 'float', 'temperature')
-                            fields += lprmap(data, "indoor", 'inside_humidity', i, 'int', 'humidity')
-                        # solar_and_uvi
-                        if "solar_and_uvi" in data and len(data["solar_and_uvi"]) > 0:
-                            fields += lprmap(data,"solar_and_uvi",'solar', i, 'float')
-                            fields += lprmap(data,"solar_and_uvi",'uvi', i, 'int')
-                        # rainfall
-                        if "rainfall" in data and len(data["rainfall"]) > 0:
-                            fields += lprmap(data,"rainfall",'rain_1h', i, 'float', 'hourly')
-                            fields += lprmap(data,"rainfall",'rain_24h', i, 'float', 'daily')
-                        # wind
-                        if "wind" in data and len(data["wind"]) > 0:
-                            fields += lprmap(data,"wind",'wind_speed', i, 'float')
-                            fields += lprmap(data,"wind",'wind_gust', i, 'float')
-                            fields += lprmap(data,"wind",'wind_deg', i, 'int', 'wind_direction')
-                        # pressure
-                        if "pressure" in data and len(data["pressure"]) > 0:
-                            fields += lprmap(data,"pressure",'absolute', i, 'float')
-                        # co2_aqi_combo
-                        if "co2_aqi_combo" in data and len(data["co2_aqi_combo"]) > 0:
-                            fields += lprmap(data,"co2_aqi_combo",'co2', i, 'float')
-                        # pm25_aqi_combo
-                        if "pm25_aqi_combo" in data and len(data["pm25_aqi_combo"]) > 0:
-                            fields += lprmap(data,"pm25_aqi_combo",'pm25', i, 'float')
-                        # pm10_aqi_combo
-                        if "pm10_aqi_combo" in data and len(data["pm10_aqi_combo"]) > 0:
-                            fields += lprmap(data,"pm10_aqi_combo",'pm10', i, 'float')
-                        # Save data point values
-                        point = f"{IFIELD},source=timemachine {fields[1:]} {int(i)}"
-                        weatherdata.append(point)
-                        if args.debug:
-                            print(f"Datapnt: {point}")
+                if finished or not pending:
+                    break
+
+                window, future = pending[0]
+                if weatherdata and (window.tier != tier or len(weatherdata) >= 10000):
+                    # Write data points of the completed tier (or batch) before processing the next window
                     write_influx()
                     weatherdata.clear()
-                else:
-                    # No valid data - increment time to next interval and continue
-                    if args.debug:
-                        print(f"No Data Found for request: {url}")
-                        print(f"Replied: {raw}")
-                    curr += interval
-                    interval = timedelta(days=getdays(curr))
-
-                    continue
-            else:
-                sys.exit(f"\nERROR: Bad response from Ecowitt API for {url} - {response.reason}: {response.text}")
-        except KeyboardInterrupt:
-            print()
-            while True:
+                print(f"* Loading data for time: [{window.start}] - [{window.end}] ({TIERS[window.tier].minutes} minutes resolution)")
                 try:
-                    response = input("Program halted - R)esume, Q)uit (write data), or A)bort: [R/Q/A] ").strip().lower()
+                    response = future.result()
                 except KeyboardInterrupt:
-                    print()
-                else:
-                    if response == "r":
-                        halted = True
-                        break
-                    elif response == "q":
-                        finished = True
-                        return
-                    elif response == "a":
-                        sys.exit()
-        except Exception as err:
-            traceback.print_exc()
-            sys.exit(f"\nERROR: Failed to retrieve history data - {err}")
-
-        if not halted:
-            # Increment time to next interval
-            curr += interval
-        else:
-            halted = False
+                    raise
+                except Exception as err:
+                    traceback.print_exc()
+                    sys.exit(f"\nERROR: Failed to retrieve history data - {err}")
+                pending.popleft()
+                tier = window.tier
+
+                if response.status_code != 200:
+                    sys.exit(f"\nERROR: Bad response from Ecowitt API for {response.url} - {response.reason}: {response.text}")
+                raw = response.json()
+                if args.debug:
+                    print(f"Request: {response.url}")
+                    print(f"Replied: {raw}")
+                if "data" in raw and len(raw["data"]) > 0 and "outdoor" in raw["data"] and len(raw["data"]["outdoor"]) > 0:
+                    points = decode_history(raw["data"])
+                    print(f"** Found {len(points)} results")
+                    if points:
+                        merge_history(points, covered, start, end)
+                elif args.debug:
+                    # No valid data - continue with next window
+                    print(f"No Data Found for request: {response.url}")
+            except KeyboardInterrupt:
+                halt_get_weather()
+    finally:
+        # Cancel queued requests (e.g. if aborted)
+        for window, future in pending:
+            future.cancel()
+        executor.shutdown()
+
+    if weatherdata:
+        write_influx()
+        weatherdata.clear()
 
 # InfluxDB Functions
 def search_influx(start, end):
@@ -607,89 +727,65 @@ def search_influx(start, end):
     Search InfluxDB for missing data points between start and end date/time
 
     Returns a list of start/end datetime ranges
-    Gap detection is based on these rules:
+    Gap detection uses the resolution of each tier for its period (see tier_periods()):
     * if the time period is within the last 90 days, it looks for gaps of 5 minutes;
     * if the time period is between 90 days and 365 days, it looks for gaps of 30 minutes;
     * if the time period is between 365 days and 730 days, it looks for gaps of 240 minutes;
     * if the time period is between 730 days and 2019-01-01, it looks for gaps of 1,440 minutes;
+
+    Data points are counted by InfluxDB in intervals of the tier resolution (GROUP BY time), and
+    consecutive intervals with no data points are a data gap
     """
     print(f"Searching InfluxDB for data gaps")
 
-    # Create query and set gap detection threshold
-    query = f"SELECT temperature FROM autogen.{IFIELD} WHERE time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
-    if start > currtime - timedelta(days=-90):
-        maxgapminutes = 5
-    elif start > currtime - timedelta(days=-365) and start <= currtime - timedelta(days=-90):
-        maxgapminutes = 30
-    elif start > currtime - timedelta(days=-730) and start <= currtime - timedelta(days=-365):
-        maxgapminutes = 240
-    else:
-        maxgapminutes = 1440
-
-    maxgap = timedelta(minutes=maxgapminutes)
+    # Find empty intervals of each tier period as (start, end, maximum gap) ranges
+    empty = []
+    for i, older, newer in tier_periods(start, end):
+        maxgap = timedelta(minutes=TIERS[i].minutes)
+        query = (f"SELECT count(temperature) FROM autogen.{IFIELD} WHERE time >= '{older.isoformat()}' AND time <= '{newer.isoformat()}' "
+                 f"GROUP BY time({TIERS[i].minutes}m) fill(0)")
 
-    try:
-        # Execute query
-        result = client.query(query)
-    except Exception as err:
-        sys.exit(f"ERROR: Failed to execute InfluxDB query: {query}; {err}")
-
-    if args.debug:
-        print(result)
+        try:
+            # Execute query
+            result = client.query(query, epoch='s')
+        except Exception as err:
+            sys.exit(f"ERROR: Failed to execute InfluxDB query: {query}; {err}")
+
+        if args.debug:
+            print(result)
+
+        counts = list(result.get_points())
+        interval = maxgap
+        if not counts:
+            # No points found - entire tier period is empty
+            counts = [{'time': int(older.timestamp()), 'count': 0}]
+            interval = newer - older
+
+        for point in counts:
+            if point['count']:
+                continue
+            intervalstart = datetime.fromtimestamp(point['time'], tz=utctz)
+            gapstart = max(intervalstart, older)
+            gapend = min(intervalstart + interval, newer)
+            if empty and gapstart <= empty[-1][1]:
+                # Continues previous empty interval (including from the previous tier period)
+                empty[-1] = (empty[-1][0], gapend, min(empty[-1][2], maxgap))
+            else:
+                empty.append((gapstart, gapend, maxgap))
 
     datagap = []
-    startpoint = start
-    startfound = False
-
-    if result:
-        # Measure time difference between each data point
-        for point in result.get_points():
-            timestamp = isoparse(point['time']).astimezone(utctz)
-
-            if timestamp == start:
-                startfound = True
-
-            # Check if time since previous point exceeds maximum gap
-            duration = timestamp - startpoint
-            if duration > maxgap + timedelta(seconds=10):
-                endpoint = timestamp
-                print(f"* Found data gap: [{startpoint.astimezone(influxtz)}] - [{endpoint.astimezone(influxtz)}] ({str(duration)}s)")
-
-                # Ensure period falls between existing data points
-                if (startfound and startpoint == start) or startpoint > start:
-                    startpoint += maxgap
-
-                # Add missing data period to list
-                period = {}
-                period['start'] = startpoint
-                period['end'] = endpoint - timedelta(seconds=1)
-                datagap.append(period)
-
-            # Move start point time to current point
-            startpoint = timestamp
-        else:
-            # Check last data point to end date/time
-            duration = end - startpoint
-            if duration > maxgap + timedelta(seconds=10):
-                endpoint = end
-                print(f"* Found data gap: [{startpoint.astimezone(influxtz)}] - [{endpoint.astimezone(influxtz)}] ({str(duration)}s)")
-
-                # Add missing data period to list
-                period = {}
-                period['start'] = startpoint + maxgap
-                period['end'] = endpoint
-                datagap.append(period)
-    else:
-        # No points found - entire start/end range is a data gap
-        duration = end - start
-        if duration > maxgap + timedelta(seconds=10):
-            print(f"* Found data gap: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(duration)}s)")
-
-            # Add missing data period to list
-            period = {}
-            period['start'] = start
-            period['end'] = end
-            datagap.append(period)
+    for gapstart, gapend, maxgap in empty:
+        # Ignore partial intervals at the start/end of the range
+        duration = gapend - gapstart
+        if duration < maxgap:
+            continue
+        print(f"* Found data gap: [{gapstart.astimezone(influxtz)}] - [{gapend.astimezone(influxtz)}] ({str(duration)}s)")
+
+        # Add missing data period to list
+        period = {}
+        period['start'] = gapstart
+        period['end'] = gapend if gapend >= end else gapend - timedelta(seconds=1)
+        datagap.append(period)
 
     return datagap
 
@@ -767,7 +863,7 @@ def write_influx():
 
 # Create session object for http connection re-use
 session = requests.Session()
-adapter = requests.adapters.HTTPAdapter(max_retries=Retry(total=5, status_forcelist=(500, 502, 503, 504), backoff_factor=1))
+adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, ECOWORKERS), max_retries=Retry(total=5, status_forcelist=(500, 502, 503, 504), backoff_factor=1))
 session.mount('https://', adapter)
 if TIMEOUT < 1:
     TIMEOUT = None
@@ -48,10 +48,17 @@
 """
 import sys
 import os
+import asyncio
 import signal
 import argparse
 import configparser
 import time
+import json
+import gzip
+import queue
+import threading
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
 try:
@@ -69,7 +76,7 @@
 except:
     sys.exit("ERROR: Missing python influxdb module. Run 'pip install influxdb'.")
 
-BUILD = "0.1.10"
+BUILD = "0.2.0"
 VERBOSE = True
 SCRIPTPATH = Path(sys.argv[0]).resolve().parent
 SCRIPTNAME = os.path.basename(sys.argv[0]).split('.')[0]
@@ -92,6 +99,12 @@
 group.add_argument('--force', action="store_true", help='force import for date/time range (skip search for data gaps)')
 group.add_argument('--remove', action="store_true", help='remove imported data from InfluxDB for date/time range')
 group.add_argument('--daemon', action="store_true", help='run as a daemon service (continually poll for history data)')
+group.add_argument('--no-cache', action="store_true", help='ignore cached daily history and retrieve from Tesla cloud again')
+group.add_argument('--benchmark', action="store_true", help='run power history transform benchmark with synthetic data, or import benchmark with --replay (no API calls)')
+group.add_argument('--record', metavar='DIR', help='record site details and history responses from Tesla cloud to folder (for --replay)')
+group.add_argument('--replay', metavar='DIR', help='use history recorded with --record instead of Tesla cloud (no login)')
+group.add_argument('--latency', type=float, default=0, help='simulated Tesla cloud latency per replayed request in seconds (default: 0)')
+group.add_argument('--rate', type=float, help='max Tesla cloud requests per second, 0 for no limit (overrides RATE in config, default for --benchmark with --replay: 0)')
 group.add_argument('--setup', action="store_true", help=argparse.SUPPRESS)
 group.add_argument('--timezone', help=argparse.SUPPRESS)
 group.add_argument('--version', action="store_true", help=argparse.SUPPRESS)
@@ -171,10 +184,18 @@ def sig_exit(signum, frame):
         parser.error("arguments --start and --end cannot be used with --today or --yesterday")
     if (args.start and not args.end) or (args.end and not args.start):
         parser.error("both arguments --start and --end are required")
-    if not (args.login or args.setup) and not ((args.start and args.end) or (args.today or args.yesterday)):
+    if not (args.login or args.setup or (args.benchmark and not args.replay)) and not ((args.start and args.end) or (args.today or args.yesterday)):
         parser.error("missing arguments: --start/end or --today/yesterday")
     if args.dry_run and (args.login or args.setup or args.remove or args.daemon):
         parser.error("--dry-run cannot be used with --login, --setup, --remove, or --daemon")
+    if args.record and (args.replay or args.benchmark):
+        parser.error("--record cannot be used with --replay or --benchmark")
+    if args.replay and (args.login or args.setup or args.dry_run):
+        parser.error("--replay cannot be used with --login, --setup, or --dry-run")
+    if args.latency < 0:
+        parser.error(f"argument --latency: invalid value: '{args.latency}'")
+    if args.rate is not None and args.rate < 0:
+        parser.error(f"argument --rate: invalid value: '{args.rate}'")
     if args.reserve is not None and (args.reserve < 0 or args.reserve > 100):
         parser.error(f"argument --reserve: invalid value: '{args.reserve}'")
 
@@ -211,9 +232,15 @@ def sig_exit(signum, frame):
         TUSER = config.get('Tesla', 'USER')
         TAUTH = os.getenv('TESLA_AUTH', config.get('Tesla', 'AUTH'))
         TDELAY = config.getint('Tesla', 'DELAY', fallback=1)
+        TWORKERS = max(1, config.getint('Tesla', 'WORKERS', fallback=4))
+        TRATE = config.getfloat('Tesla', 'RATE', fallback=2 / max(TDELAY, 1))
+        TRETRIES = max(0, config.getint('Tesla', 'RETRIES', fallback=3))
+        TCACHE = config.get('Tesla', 'CACHE', fallback='cache').strip()
 
         if not Path(TAUTH).is_absolute():
             TAUTH = str(SCRIPTPATH / TAUTH)
+        if TCACHE != "" and not Path(TCACHE).is_absolute():
+            TCACHE = str(Path(CONFIGFILE).parent / TCACHE)
 
         # Get InfluxDB Settings
         IHOST = os.getenv('INFLUX_HOST', config.get('InfluxDB', 'HOST'))
@@ -222,6 +249,7 @@ def sig_exit(signum, frame):
         IPASS = config.get('InfluxDB', 'PASS', fallback='')
         IDB = config.get('InfluxDB', 'DB')
         ITZ = config.get('InfluxDB', 'TZ')
+        IMAXRANGE = max(1, config.getint('InfluxDB', 'MAXRANGE', fallback=31))
 
         # Get settings when running as a daemon
         if args.daemon:
@@ -233,11 +261,21 @@ def sig_exit(signum, frame):
             DEBUG = config.get('daemon', 'DEBUG', fallback='no')
             TEST = config.get('daemon', 'TEST', fallback='no')
             RESERVE = config.getint('daemon', 'RESERVE', fallback=None)
+            BACKUPWAIT = config.getint('daemon', 'BACKUPWAIT', fallback=WAIT)
+            RESERVEWAIT = config.getint('daemon', 'RESERVEWAIT', fallback=WAIT)
+            TIMEOUT = config.getint('daemon', 'TIMEOUT', fallback=300)
+            HEALTHPORT = config.getint('daemon', 'HEALTHPORT', fallback=0)
 
             if WAIT < 5:
                 WAIT = 5
-            if HIST <= WAIT:
-                HIST = WAIT + 5
+            if BACKUPWAIT < 5:
+                BACKUPWAIT = 5
+            if RESERVEWAIT < 5:
+                RESERVEWAIT = 5
+            if HIST <= max(WAIT, BACKUPWAIT, RESERVEWAIT):
+                HIST = max(WAIT, BACKUPWAIT, RESERVEWAIT) + 5
+            if TIMEOUT < 30:
+                TIMEOUT = 30
             if RETRY < 1:
                 RETRY = 1
             if SITE is not None:
@@ -354,9 +392,15 @@ def sig_exit(signum, frame):
 
     # Set other config defaults
     TDELAY = 1
+    TWORKERS = 4
+    TRATE = 2
+    TRETRIES = 3
+    TCACHE = str(Path(CONFIGFILE).parent / "cache")
+    IMAXRANGE = 31
     WAIT = 5
     HIST = 60
     RETRY = 30
+    TIMEOUT = 300
 
     # Save config values to file
     config.optionxform = str
@@ -366,6 +410,12 @@ def sig_exit(signum, frame):
     config['Tesla']['AUTH'] = TAUTH
     config['Tesla']['# Delay between API requests (seconds)'] = None
     config['Tesla']['DELAY'] = str(TDELAY)
+    config['Tesla']['# Concurrent daily history requests, max requests per second and retries per day'] = None
+    config['Tesla']['WORKERS'] = str(TWORKERS)
+    config['Tesla']['RATE'] = str(TRATE)
+    config['Tesla']['RETRIES'] = str(TRETRIES)
+    config['Tesla']['# Cache folder for completed days of history (leave blank to disable)'] = None
+    config['Tesla']['CACHE'] = "cache"
     config['InfluxDB'] = {}
     config['InfluxDB']['# InfluxDB server settings'] = None
     config['InfluxDB']['HOST'] = IHOST
@@ -376,14 +426,23 @@ def sig_exit(signum, frame):
     config['InfluxDB']['# Database name and timezone'] = None
     config['InfluxDB']['DB'] = IDB
     config['InfluxDB']['TZ'] = ITZ
+    config['InfluxDB']['# Maximum days per analysis data update query'] = None
+    config['InfluxDB']['MAXRANGE'] = str(IMAXRANGE)
     config['daemon'] = {}
     config['daemon']['; Config options when running as a daemon (i.e. docker container)'] = None
     config['daemon']['# Minutes to wait between poll requests'] = None
     config['daemon']['WAIT'] = str(WAIT)
     config['daemon']['# Minutes of history to retrieve for each poll request'] = None
     config['daemon']['HIST'] = str(HIST)
-    config['daemon']['# Seconds to wait before retry on errors'] = None
+    config['daemon']['# Seconds to wait before retry on errors (doubled for each further error, up to the wait time)'] = None
     config['daemon']['RETRY'] = str(RETRY)
+    config['daemon']['# Minutes to wait between backup event and reserve percent requests (default is WAIT)'] = None
+    config['daemon']['# BACKUPWAIT = 15'] = None
+    config['daemon']['# RESERVEWAIT = 15'] = None
+    config['daemon']['# Seconds before a poll request is reported as failed (e.g. Tesla cloud not responding)'] = None
+    config['daemon']['TIMEOUT'] = str(TIMEOUT)
+    config['daemon']['# Health check port (returns poll status as JSON, uncomment to enable)'] = None
+    config['daemon']['# HEALTHPORT = 8690'] = None
     config['daemon']['# Enable log output for each poll request'] = None
     config['daemon']['LOG'] = "no"
     config['daemon']['# Enable debug output (print raw responses from Tesla cloud)'] = None
@@ -406,6 +465,13 @@ def sig_exit(signum, frame):
         # Set auth file from environment variable if defined
         TAUTH = os.getenv('TESLA_AUTH', TAUTH)
 
+if args.rate is not None:
+    # Override configured Tesla cloud request rate
+    TRATE = args.rate
+elif args.benchmark and args.replay:
+    # Recorded history is served locally, so the import benchmark is not rate limited unless --rate is given
+    TRATE = 0
+
 # Global Variables
 powerdata = []
 backupdata = []
@@ -422,11 +488,31 @@ def sig_exit(signum, frame):
 dayloaded = None
 eventsloaded = False
 reserveloaded = False
-fetcherr = False
-queryerr = False
-writeerr = False
+streamerr = False
 influxtz = tz.gettz(ITZ)
 utctz = tz.tzutc()
+ratelimit = None
+cachedir = None
+writequeue = None
+writer = None
+checkpoint = None
+pointcount = {'power': 0, 'grid': 0, 'reserve': 0}
+CHECKPOINTFILE = str(Path(CONFIGFILE).parent / f"{SCRIPTNAME}.checkpoint")
+RETENTION = {'power': None, 'grid': 'grid', 'reserve': 'pod'}
+influxlock = threading.Lock()
+daemonkinds = {}
+lastpoints = {'grid': [], 'reserve': []}
+
+class ErrorState(threading.local):
+    """
+    Retrieve, query and write error state (per thread, as each daemon data kind runs in its own thread)
+        * set to the error when a request fails, and reset to False when a later request succeeds
+    """
+    fetcherr = False
+    queryerr = False
+    writeerr = False
+
+errstate = ErrorState()
 
 # Check InfluxDB timezone is valid
 if influxtz is None:
@@ -435,10 +521,20 @@ def sig_exit(signum, frame):
 if args.daemon:
     sys.stdout.flush()
     sys.stderr.write(f"* Configuration Loaded [{os.path.realpath(CONFIGFILE)}]\n")
-    sys.stderr.write(f" + Server - Wait: {WAIT}m, Hist: {HIST}m, Retry: {RETRY}s, Log: {LOG}, Debug: {DEBUG}, Test: {TEST}\n")
+    sys.stderr.write(f" + Server - Wait: {WAIT}m, Hist: {HIST}m, Retry: {RETRY}s, Timeout: {TIMEOUT}s, Log: {LOG}, Debug: {DEBUG}, Test: {TEST}")
+    if BACKUPWAIT != WAIT:
+        sys.stderr.write(f", Backup Wait: {BACKUPWAIT}m")
+    if RESERVEWAIT != WAIT:
+        sys.stderr.write(f", Reserve Wait: {RESERVEWAIT}m")
+    if HEALTHPORT:
+        sys.stderr.write(f", Health Port: {HEALTHPORT}")
+    sys.stderr.write("\n")
     sys.stderr.write(f" + Tesla - User: {TUSER}, Auth: [{os.path.realpath(TAUTH)}]")
     if TDELAY != 1:
         sys.stderr.write(f", Delay: {TDELAY}s")
+    sys.stderr.write(f", Workers: {TWORKERS}, Rate: {f'{TRATE}/s' if TRATE > 0 else 'no limit'}")
+    if TCACHE != "":
+        sys.stderr.write(f", Cache: [{os.path.realpath(TCACHE)}]")
     if RESERVE is not None:
         sys.stderr.write(f", Reserve: {RESERVE}")
     if SITE is not None:
@@ -649,6 +745,145 @@ def tesla_login(email):
 
     return sitelist
 
+class ReplaySite(object):
+    """
+    Stand-in for a Tesla Energy site (Battery or SolarPanel) that serves calendar history recorded with --record
+        * responses are read from 'path' by kind, period and end date, after an optional delay (seconds)
+          to simulate Tesla cloud latency
+    """
+    def __init__(self, path, siteid, latency=0):
+        self['energy_site_id'] = siteid
+        self.path = path
+        self.latency = latency
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def get_calendar_history_data(self, kind, end_date, period='day'):
+        with self.lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+        folder = os.path.join(self.path, record_folder(kind, period))
+        data = read_cache(os.path.join(folder, f"{end_date[:10]}.json.gz"))
+        if data is None and period == 'lifetime':
+            # Lifetime history is requested up to the current date, so use the latest recording
+            try:
+                data = read_cache(os.path.join(folder, sorted(os.listdir(folder))[-1]))
+            except (FileNotFoundError, IndexError):
+                pass
+        if data is None and args.debug:
+            print(f"No recorded {kind} history for {end_date}")
+        return data or {}
+
+class ReplayBattery(ReplaySite, Battery):
+    pass
+
+class ReplaySolarPanel(ReplaySite, SolarPanel):
+    pass
+
+def record_folder(kind, period='day'):
+    """
+    Returns recording folder name for calendar history of kind and period
+    """
+    return kind if period == 'day' else f"{kind}-{period}"
+
+def record_site(siteinfo, path):
+    """
+    Save site details and record calendar history responses of the site to 'path' (for use with --replay)
+    """
+    site = siteinfo['site']
+    info = {key: siteinfo[key] for key in ('type', 'name', 'timezone')}
+    info['energy_site_id'] = lookup(site, ['energy_site_id'])
+    info['battery'] = isinstance(site, Battery)
+    for key in ('instdate', 'time'):
+        info[key] = siteinfo[key].isoformat() if isinstance(siteinfo[key], datetime) else siteinfo[key]
+    try:
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, "site.json"), 'w') as f:
+            json.dump(info, f, indent=2)
+    except Exception as err:
+        sys_exit(f"ERROR: Failed to save recording to '{path}' - {repr(err)}")
+
+    get_calendar_history_data = site.get_calendar_history_data
+
+    def recorder(kind, end_date, period='day'):
+        data = get_calendar_history_data(kind=kind, end_date=end_date, period=period)
+        if data:
+            write_cache(os.path.join(path, record_folder(kind, period), f"{end_date[:10]}.json.gz"), data)
+        return data
+
+    site.get_calendar_history_data = recorder
+
+def load_replay(path, latency=0):
+    """
+    Load site details saved with --record and create a replay site serving the recorded history
+
+    Returns a list of Tesla Energy sites (single site)
+    """
+    try:
+        with open(os.path.join(path, "site.json"), 'r') as f:
+            info = json.load(f)
+    except Exception as err:
+        sys_exit(f"ERROR: Failed to load recording from '{path}' - {repr(err)}")
+
+    siteid = info['energy_site_id']
+    sitecls = ReplayBattery if info['battery'] else ReplaySolarPanel
+    siteinfo = {}
+    siteinfo['site'] = sitecls(path, siteid, latency)
+    siteinfo['type'] = info['type']
+    siteinfo['name'] = info['name']
+    siteinfo['timezone'] = info['timezone']
+    siteinfo['instdate'] = isoparse(info['instdate']) if info['instdate'] else datetime.fromtimestamp(0, tz=utctz)
+    siteinfo['time'] = isoparse(info['time']) if isinstance(info['time'], str) and info['time'][:1].isdigit() else info['time']
+
+    print("-" * 40)
+    print(f"Replaying recorded history: {path}")
+    print("-" * 40)
+    print(f"      Site ID: {siteid}")
+    print(f"    Site type: {siteinfo['type']}")
+    print(f"    Site name: {siteinfo['name']}")
+    print(f"     Timezone: {siteinfo['timezone']}")
+    print(f"    Installed: {siteinfo['instdate']}")
+    print(f"  System time: {siteinfo['time']}")
+    if latency:
+        print(f"      Latency: {latency}s per request")
+    print("-" * 40)
+
+    return {siteid: siteinfo}
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter shared by the history fetch workers
+
+    Args:
+        rate    = tokens (requests) added per second (0 for no limit)
+        burst   = maximum tokens available at once
+    """
+    def __init__(self, rate, burst):
+        self.rate = max(rate, 0)
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Wait until a token is available and consume it
+        """
+        if self.rate == 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
 def get_timezone(data):
     """
     Get timezone from response data based on a timezone name or offset
@@ -677,9 +912,15 @@ def get_power_history(start, end):
     """
     Retrieve power history data between start and end date/time
 
-    Adds data points to 'powerdata' in InfluxDB Line Protocol format with tag source='cloud'
+    Saves data points in InfluxDB Line Protocol format with tag source='cloud' (see save_points())
     """
-    global fetcherr, sitetz, tzname, tzoffset, dayloaded, power, soe
+    global sitetz, tzname, tzoffset, dayloaded, power, soe
+
+    if sitetz is None and cachedir is not None and not args.no_cache:
+        # Start with the site timezone found on a previous run (history data is still checked for changes)
+        data = read_cache(os.path.join(cachedir, "timezone.json.gz"))
+        if data:
+            sitetz, tzname, tzoffset = get_timezone(data)
 
     if sitetz is None:
         try:
@@ -713,6 +954,10 @@ def get_power_history(start, end):
                 if sitetz is None:
                     sys_exit(f"ERROR: Invalid timezone for history data - {tzname}")
 
+                if cachedir is not None:
+                    write_cache(os.path.join(cachedir, "timezone.json.gz"),
+                        {key: data[key] for key in ('installation_time_zone', 'time_zone_offset') if key in data})
+
         except Exception as err:
             sys_exit(f"ERROR: Failed to retrieve timezone from history data - {repr(err)}")
 
@@ -723,130 +968,339 @@ def get_power_history(start, end):
     day = start.astimezone(sitetz).replace(hour=23, minute=59, second=59, tzinfo=None)
     endday = end.astimezone(sitetz).replace(hour=23, minute=59, second=59, tzinfo=None)
 
-    # Loop through each day to retrieve daily 'power' and 'soe' history data
+    # Retrieve daily 'power' and 'soe' history data concurrently and process each day in order
+    # (limited to WORKERS * 2 days ahead of the day being processed)
     nextstart = start
     while day <= endday:
-        # Get this day's history if not already loaded
-        if day != dayloaded:
-            if VERBOSE:
-                print(f"* Loading daily history: [{day.strftime('%Y-%m-%d')}] ({tzname})")
-            time.sleep(TDELAY)
-            try:
-                # Retrieve current day 'power' history ('power' data returned in 5 minute intervals)
-                power = site.get_calendar_history_data(kind='power', end_date=day.replace(tzinfo=sitetz).isoformat())
-                if args.debug:
-                    print(power)
-                """ Example 'time_series' response:
-                {
-                    "timestamp": "2022-04-18T12:10:00+10:00",
-                    "solar_power": 7522,
-                    "battery_power": -4750,
-                    "grid_power": -1675.8333333333333,
-                    "grid_services_power": 0,
-                    "generator_power": 0
-                }
-                """
-                # Check history data for timezone changes
-                if power:
-                    # Get timezone name or offset from history data
-                    histtz, tzdata, tzoffset = get_timezone(power)
-
-                    if histtz is None:
-                        sys_exit(f"ERROR: Invalid timezone for history data - {tzdata}")
-
-                    if sitetz != histtz:
-                        # Update site timezone if mismatch found and re-run from next start day
-                        sitetz = histtz
-                        tzname = tzdata
-                        day = nextstart.astimezone(sitetz).replace(hour=23, minute=59, second=59, tzinfo=None)
-                        endday = end.astimezone(sitetz).replace(hour=23, minute=59, second=59, tzinfo=None)
-                        continue
-
-                if isinstance(site, Battery):
-                    # Retrieve current day 'soe' history ('soe' data returned in 15 minute intervals)
-                    soe = site.get_calendar_history_data(kind='soe', end_date=day.replace(tzinfo=sitetz).isoformat())
-                    if args.debug:
-                        print(soe)
-                    """ Example 'time_series' response:
-                    {
-                        "timestamp": "2022-04-18T12:00:00+10:00",
-                        "soe": 67
-                    }
-                    """
-                if args.daemon and fetcherr:
-                    fetcherr = False
-                    sys.stdout.flush()
-                    sys.stderr.write(" + Retrieve history data succeeded\n")
-                    sys.stderr.flush()
-            except Exception as err:
-                sys_exit(f"ERROR: Failed to retrieve history data - {repr(err)}", halt=False)
-                if args.daemon:
-                    fetcherr = True
-                    sys.stderr.write(f" ! Retrieve history data failed, retrying in {RETRY} seconds\n")
-                    sys.stderr.flush()
-                return
+        days = [day + timedelta(days=i) for i in range((endday - day).days + 1)]
+        with ThreadPoolExecutor(max_workers=TWORKERS) as executor:
+            futures = {}
+            submitted = 0
+            for i, d in enumerate(days):
+                # Get upcoming days' history if not already loaded
+                while submitted < min(len(days), i + TWORKERS * 2):
+                    if days[submitted] != dayloaded:
+                        futures[days[submitted]] = executor.submit(get_day_history, days[submitted], sitetz)
+                    submitted += 1
+
+                if d in futures:
+                    try:
+                        power, soe, cached = futures.pop(d).result()
+                        if VERBOSE:
+                            print(f"* Loading daily history: [{d.strftime('%Y-%m-%d')}] ({tzname}){' (cached)' if cached else ''}")
+                        if args.debug:
+                            print(power)
+                            if soe is not None:
+                                print(soe)
+
+                        # Check history data for timezone changes
+                        if power:
+                            # Get timezone name or offset from history data
+                            histtz, tzdata, tzoffset = get_timezone(power)
+
+                            if histtz is None:
+                                sys_exit(f"ERROR: Invalid timezone for history data - {tzdata}")
+
+                            if sitetz != histtz:
+                                # Update site timezone if mismatch found and re-run from next start day
+                                for f in futures.values():
+                                    f.cancel()
+                                sitetz = histtz
+                                tzname = tzdata
+                                day = nextstart.astimezone(sitetz).replace(hour=23, minute=59, second=59, tzinfo=None)
+                                endday = end.astimezone(sitetz).replace(hour=23, minute=59, second=59, tzinfo=None)
+                                break
+
+                        if args.daemon and errstate.fetcherr:
+                            errstate.fetcherr = False
+                            sys.stdout.flush()
+                            sys.stderr.write(" + Retrieve history data succeeded\n")
+                            sys.stderr.flush()
+                    except Exception as err:
+                        for f in futures.values():
+                            f.cancel()
+                        sys_exit(f"ERROR: Failed to retrieve history data - {repr(err)}", halt=False)
+                        if args.daemon:
+                            errstate.fetcherr = repr(err)
+                            sys.stderr.write(" ! Retrieve history data failed\n")
+                            sys.stderr.flush()
+                        return
+
+                    dayloaded = d
+
+                points = []
+                nextstart = add_power_history(start, end, nextstart, points)
+                save_points('power', points, min(end, d.replace(tzinfo=sitetz).astimezone(utctz)))
+            else:
+                # All days processed
+                day = endday + timedelta(days=1)
+
+def get_day_history(day, daytz):
+    """
+    Retrieve 'power' and 'soe' calendar history for a single day (called from worker threads)
+
+    Returns tuple of 'power' and 'soe' response data ('soe' is None for solar only sites),
+    and True if all data was read from the cache
+    """
+    # Retrieve day 'power' history ('power' data returned in 5 minute intervals)
+    power, cached = get_calendar_history('power', day, daytz)
+    """ Example 'time_series' response:
+    {
+        "timestamp": "2022-04-18T12:10:00+10:00",
+        "solar_power": 7522,
+        "battery_power": -4750,
+        "grid_power": -1675.8333333333333,
+        "grid_services_power": 0,
+        "generator_power": 0
+    }
+    """
+    soe = None
+    if isinstance(site, Battery):
+        # Retrieve day 'soe' history ('soe' data returned in 15 minute intervals)
+        soe, soecached = get_calendar_history('soe', day, daytz)
+        cached = cached and soecached
+        """ Example 'time_series' response:
+        {
+            "timestamp": "2022-04-18T12:00:00+10:00",
+            "soe": 67
+        }
+        """
+    return power, soe, cached
+
+def get_calendar_history(kind, day, daytz):
+    """
+    Retrieve calendar history of kind for the day ending at 'day' in timezone 'daytz'
+        * completed days are read from / saved to the cache (per site, kind, date and UTC offset)
+        * requests are limited by the shared token bucket (RATE requests per second)
+        * failed requests are retried up to RETRIES times with exponential backoff
+
+    Returns response data, and True if it was read from the cache
+    """
+    enddate = day.replace(tzinfo=daytz)
+    cachefile = None
+    if cachedir is not None:
+        cachefile = os.path.join(cachedir, kind, f"{enddate.strftime('%Y-%m-%d')}{enddate.strftime('%z')}.json.gz")
+        if not args.no_cache:
+            data = read_cache(cachefile)
+            if data:
+                return data, True
+
+    attempt = 0
+    while True:
+        try:
+            ratelimit.acquire()
+            data = site.get_calendar_history_data(kind=kind, end_date=enddate.isoformat())
+            break
+        except Exception as err:
+            if attempt >= TRETRIES:
+                raise
+            attempt += 1
+            if args.debug:
+                print(f"Retrying daily history [{day.strftime('%Y-%m-%d')}] ({attempt}/{TRETRIES}) - {repr(err)}")
+            time.sleep(min(60, TDELAY * 2 ** attempt))
+
+    # Only cache days that ended over a day ago (Tesla cloud data may still be updated for recent days)
+    if cachefile is not None and data and data.get('time_series') and enddate < datetime.now(tz=utctz) - timedelta(days=1):
+        write_cache(cachefile, data)
+    return data, False
+
+def read_cache(filename):
+    """
+    Read compressed JSON data from cache file
+
+    Returns data, or None if not found or invalid
+    """
+    try:
+        with gzip.open(filename, 'rt', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as err:
+        if args.debug:
+            print(f"Ignoring invalid cache file '{filename}' - {repr(err)}")
+        return None
+
+def write_cache(filename, data):
+    """
+    Save data to cache file as compressed JSON (written to a temporary file and renamed)
+    """
+    try:
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        tmpfile = f"{filename}.{threading.get_ident()}.tmp"
+        with gzip.open(tmpfile, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(tmpfile, filename)
+    except Exception as err:
+        if args.debug:
+            print(f"Failed to save cache file '{filename}' - {repr(err)}")
+
+def add_power_history(start, end, nextstart, points):
+    """
+    Add loaded 'power' and 'soe' history data points between start and end date/time to 'points'
+
+    Returns next expected start date/time after the last 'power' data point
+    """
+    solaronly = isinstance(site, SolarPanel)
+    laststart = transform_history(power, soe, start, end, points, solaronly=solaronly, offset=solaronly and tzoffset)
+    return nextstart if laststart is None else laststart
+
+def transform_history(power, soe, start, end, points, solaronly=False, offset=False):
+    """
+    Convert a day of 'power' and 'soe' history data to Line Protocol format data points
+        * time series values are converted to columns (epoch seconds, solar/battery/grid power)
+          and month/year tags are only recalculated when the month changes
+
+    Args:
+        power/soe   = 'power' and 'soe' calendar history response data
+        start/end   = add data points between start and end date/time only
+        points      = list to add data points to
+        solaronly   = solar only site (home is set to zero if no grid power values returned)
+        offset      = history timezone is an offset (solar only sites), use InfluxDB timezone instead
 
-            dayloaded = day
-
-        if power:
-            # Check if solar only site returns grid power values
-            if isinstance(site, SolarPanel):
-                gridpower = False
-                for d in power['time_series']:
-                    if d['grid_power'] != 0:
-                        gridpower = True
-                        break
-
-            for d in power['time_series']:
-                timestamp = isoparse(d['timestamp']).astimezone(utctz)
-                nextstart = timestamp + timedelta(minutes=5)
-
-                # Check if solar only site timezone is using an offset and replace with InfluxDB timezone
-                if isinstance(site, SolarPanel) and tzoffset:
-                    timestamp = isoparse(d['timestamp']).replace(tzinfo=influxtz).astimezone(utctz)
-
-                # Save data point when within start/end range only
-                if timestamp >= start and timestamp <= end:
-                    # Calculate power usage values
-                    home = d['solar_power'] + d['battery_power'] + d['grid_power']
-                    solar = d['solar_power']
-                    from_pw = d['battery_power'] if d['battery_power'] > 0 else 0
-                    to_pw = -d['battery_power'] if d['battery_power'] < 0 else 0
-                    from_grid = d['grid_power'] if d['grid_power'] > 0 else 0
-                    to_grid = -d['grid_power'] if d['grid_power'] < 0 else 0
-
-                    if isinstance(site, SolarPanel) and not gridpower:
-                        # Set home to zero when grid power not available for solar only sites
-                        home = 0
-
-                    # Save data point values
-                    point = f"http,source=cloud,month={timestamp.astimezone(influxtz).strftime('%b')},year={timestamp.astimezone(influxtz).year} home={home},solar={solar},from_pw={from_pw},to_pw={to_pw},from_grid={from_grid},to_grid={to_grid} "
-                    point += str(int(timestamp.timestamp()))
-                    powerdata.append(point)
-
-        if soe:
-            for d in soe['time_series']:
-                timestamp = isoparse(d['timestamp']).astimezone(utctz)
-                # Save data point when within start/end range only
-                if timestamp >= start and timestamp <= end:
-                    # Apply reverse scale to battery percentage for consistency with InfluxDB data
-                    percentage = (d['soe'] + (5 / 0.95)) * 0.95
-
-                    # Save data point values
-                    point = f"http,source=cloud,month={timestamp.astimezone(influxtz).strftime('%b')},year={timestamp.astimezone(influxtz).year} percentage={percentage} "
-                    point += str(int(timestamp.timestamp()))
-                    powerdata.append(point)
-
-        # Increment to next day
-        day += timedelta(days=1)
+    Returns next expected start date/time after the last 'power' data point, or None if no 'power' data
+    """
+    startts = start.timestamp()
+    endts = end.timestamp()
+    laststart = None
+
+    if power and power['time_series']:
+        series = power['time_series']
+        times = [parse_epoch(d['timestamp']) for d in series]
+        laststart = datetime.fromtimestamp(times[-1], tz=utctz) + timedelta(minutes=5)
+        if offset:
+            # Replace timezone offset with InfluxDB timezone
+            times = [parse_epoch(d['timestamp'], influxtz) for d in series]
+
+        solar = [d['solar_power'] for d in series]
+        battery = [d['battery_power'] for d in series]
+        grid = [d['grid_power'] for d in series]
+
+        # Calculate power usage values
+        if solaronly and not any(g != 0 for g in grid):
+            # Set home to zero when grid power not available for solar only sites
+            home = [0] * len(series)
+        else:
+            home = [s + b + g for s, b, g in zip(solar, battery, grid)]
+        from_pw = [b if b > 0 else 0 for b in battery]
+        to_pw = [-b if b < 0 else 0 for b in battery]
+        from_grid = [g if g > 0 else 0 for g in grid]
+        to_grid = [-g if g < 0 else 0 for g in grid]
+
+        # Save data points within start/end range only
+        tags = get_tags(times)
+        points.extend([f"http,source=cloud,{tags[i]} home={home[i]},solar={solar[i]},from_pw={from_pw[i]},to_pw={to_pw[i]},from_grid={from_grid[i]},to_grid={to_grid[i]} {int(t)}"
+            for i, t in enumerate(times) if t >= startts and t <= endts])
+
+    if soe and soe['time_series']:
+        series = soe['time_series']
+        times = [parse_epoch(d['timestamp']) for d in series]
+        tags = get_tags(times)
+
+        # Apply reverse scale to battery percentage for consistency with InfluxDB data
+        points.extend([f"http,source=cloud,{tags[i]} percentage={(series[i]['soe'] + (5 / 0.95)) * 0.95} {int(t)}"
+            for i, t in enumerate(times) if t >= startts and t <= endts])
+
+    return laststart
+
+def parse_epoch(timestamp, tzinfo=None):
+    """
+    Returns epoch seconds for an ISO 8601 timestamp (optionally replacing the timezone with 'tzinfo')
+    """
+    try:
+        dt = datetime.fromisoformat(timestamp)
+    except ValueError:
+        dt = isoparse(timestamp)
+    if tzinfo is not None:
+        dt = dt.replace(tzinfo=tzinfo)
+    return dt.timestamp()
+
+def get_tags(times):
+    """
+    Returns list of month/year tags (InfluxDB timezone) for a sorted list of epoch times
+    """
+    tags = []
+    monthstart = monthend = None
+    for t in times:
+        if monthstart is None or t < monthstart or t >= monthend:
+            # Recalculate tags at the start of each month
+            local = datetime.fromtimestamp(t, tz=influxtz)
+            tag = f"month={local.strftime('%b')},year={local.year}"
+            month = local.replace(day=1, hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+            monthstart = month.replace(tzinfo=influxtz).timestamp()
+            monthend = (month + relativedelta(months=1)).replace(tzinfo=influxtz).timestamp()
+        tags.append(tag)
+    return tags
+
+def benchmark_transform(years=3):
+    """
+    Benchmark power history transform with synthetic history data for a number of years
+        * compares with converting each data point individually (previous method), and
+          checks both methods create the same data points
+    """
+    def reference(power, soe, start, end, points):
+        # Convert each data point individually
+        for d in power['time_series']:
+            timestamp = isoparse(d['timestamp']).astimezone(utctz)
+            if timestamp >= start and timestamp <= end:
+                home = d['solar_power'] + d['battery_power'] + d['grid_power']
+                solar = d['solar_power']
+                from_pw = d['battery_power'] if d['battery_power'] > 0 else 0
+                to_pw = -d['battery_power'] if d['battery_power'] < 0 else 0
+                from_grid = d['grid_power'] if d['grid_power'] > 0 else 0
+                to_grid = -d['grid_power'] if d['grid_power'] < 0 else 0
+                point = f"http,source=cloud,month={timestamp.astimezone(influxtz).strftime('%b')},year={timestamp.astimezone(influxtz).year} home={home},solar={solar},from_pw={from_pw},to_pw={to_pw},from_grid={from_grid},to_grid={to_grid} "
+                point += str(int(timestamp.timestamp()))
+                points.append(point)
+        for d in soe['time_series']:
+            timestamp = isoparse(d['timestamp']).astimezone(utctz)
+            if timestamp >= start and timestamp <= end:
+                percentage = (d['soe'] + (5 / 0.95)) * 0.95
+                point = f"http,source=cloud,month={timestamp.astimezone(influxtz).strftime('%b')},year={timestamp.astimezone(influxtz).year} percentage={percentage} "
+                point += str(int(timestamp.timestamp()))
+                points.append(point)
+
+    # Create synthetic daily history data ('power' in 5 minute and 'soe' in 15 minute intervals)
+    print(f"Creating {years} years of synthetic history data ({ITZ})")
+    firstday = datetime.now(tz=influxtz).replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None) - timedelta(days=365 * years)
+    history = []
+    for n in range(365 * years):
+        day = (firstday + timedelta(days=n)).replace(tzinfo=influxtz)
+        power = {'time_series': []}
+        soe = {'time_series': []}
+        for i in range(288):
+            timestamp = (day + timedelta(minutes=5 * i)).isoformat()
+            solar = max(0, 5000 - abs(i - 144) * 50)
+            battery = (i % 7 - 3) * 1000.5
+            power['time_series'].append({'timestamp': timestamp, 'solar_power': solar, 'battery_power': battery,
+                'grid_power': 1500 - solar - battery / 3, 'grid_services_power': 0, 'generator_power': 0})
+            if i % 3 == 0:
+                soe['time_series'].append({'timestamp': timestamp, 'soe': 50 + i % 50})
+        history.append(power)
+        history.append(soe)
+    start = firstday.replace(tzinfo=influxtz).astimezone(utctz)
+    end = start + timedelta(days=365 * years)
+
+    results = {}
+    for name, method in (("per point", reference), ("columnar", lambda power, soe, start, end, points: transform_history(power, soe, start, end, points))):
+        points = []
+        starttime = time.perf_counter()
+        for n in range(0, len(history), 2):
+            method(history[n], history[n + 1], start, end, points)
+        elapsed = time.perf_counter() - starttime
+        results[name] = (elapsed, points)
+        print(f"* {name}: {len(points)} data points in {elapsed:.2f}s ({len(points) / elapsed:.0f} points/sec)")
+
+    if results["per point"][1] != results["columnar"][1]:
+        sys_exit("ERROR: Benchmark data points do not match")
+    print(f"* Speedup: {results['per point'][0] / results['columnar'][0]:.1f}x (data points match)")
 
 def get_backup_history(start, end):
     """
     Retrieve backup event history between start and end date/time
 
-    Adds data points to 'eventdata' in InfluxDB Line Protocol format with tag source='cloud'
+    Saves data points in InfluxDB Line Protocol format with tag source='cloud' (see save_points())
     """
-    global fetcherr, eventsloaded
+    global eventsloaded
 
     if not eventsloaded:
         startdate = start
@@ -870,16 +1324,16 @@ def get_backup_history(start, end):
                     "duration": 3862580
                 }
                 """
-                if args.daemon and fetcherr:
-                    fetcherr = False
+                if args.daemon and errstate.fetcherr:
+                    errstate.fetcherr = False
                     sys.stdout.flush()
                     sys.stderr.write(" + Retrieve history data succeeded\n")
                     sys.stderr.flush()
             except Exception as err:
                 sys_exit(f"ERROR: Failed to retrieve history data - {repr(err)}", halt=False)
                 if args.daemon:
-                    fetcherr = True
-                    sys.stderr.write(f" ! Retrieve history data failed, retrying in {RETRY} seconds\n")
+                    errstate.fetcherr = repr(err)
+                    sys.stderr.write(" ! Retrieve history data failed\n")
                     sys.stderr.flush()
                 return
 
@@ -894,16 +1348,8 @@ def get_backup_history(start, end):
     if VERBOSE:
         print(f"* Creating grid status data: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(end - start)}s)")
 
-    # Create baseline grid_status=1 points aligned to minute intervals for full start/end range
-    gridstatus = []
-    timestamp = start.replace(second=0)
-    while timestamp <= end:
-        gridpoint = {}
-        gridpoint['time'] = timestamp
-        gridpoint['grid_status'] = 1
-        gridstatus.append(gridpoint)
-        timestamp += timedelta(minutes=1)
-
+    # Get backup event periods within start/end range, aligned to minute intervals
+    events = []
     for backup in backupdata:
         for d in backup['events']:
             # Determine backup event start/end time
@@ -912,37 +1358,41 @@ def get_backup_history(start, end):
             eventend = eventstart + duration
 
             event = f"* Found backup event period: [{eventstart.astimezone(influxtz)}] - [{eventend.astimezone(influxtz)}] ({str(duration)}s)"
-            printed = False
 
             # Align points to minute intervals
             eventstart = eventstart.replace(second=0)
             eventend = eventend.replace(second=0)
 
-            # Set grid_status=0 for points found within backup event period
-            for gridpoint in gridstatus:
-                if gridpoint['time'] >= eventstart and gridpoint['time'] <= eventend:
-                    gridpoint['grid_status'] = 0
-
-                    if not printed:
-                        if VERBOSE:
-                            print(event)
-                        printed = True
-
-    # Create event data for import to InfluxDB
-    for gridpoint in gridstatus:
-        timestamp = gridpoint['time']
-        grid_status = gridpoint['grid_status']
+            if max(eventstart, start.replace(second=0)) <= min(eventend, end):
+                if VERBOSE:
+                    print(event)
+                events.append((eventstart, eventend))
 
-        # Save data point values
-        point = f"http,source=cloud,month={timestamp.astimezone(influxtz).strftime('%b')},year={timestamp.astimezone(influxtz).year} grid_status={grid_status} "
-        point += str(int(timestamp.timestamp()))
-        eventdata.append(point)
+    # Create grid status data points aligned to minute intervals for each day of the start/end range
+    # (grid_status=1, or grid_status=0 for points found within backup event periods)
+    timestamp = start.replace(second=0)
+    while timestamp <= end:
+        dayend = min(end, next_day(timestamp) - timedelta(seconds=1))
+        points = []
+        while timestamp <= dayend:
+            grid_status = 1
+            for eventstart, eventend in events:
+                if timestamp >= eventstart and timestamp <= eventend:
+                    grid_status = 0
+                    break
+
+            # Save data point values
+            point = f"http,source=cloud,month={timestamp.astimezone(influxtz).strftime('%b')},year={timestamp.astimezone(influxtz).year} grid_status={grid_status} "
+            point += str(int(timestamp.timestamp()))
+            points.append(point)
+            timestamp += timedelta(minutes=1)
+        save_points('grid', points, dayend)
 
 def set_reserve_history(start, end):
     """
     Create backup reserve percent history between start and end date/time
 
-    Adds data points to 'reservedata' in InfluxDB Line Protocol format with tag source='cloud'
+    Saves data points in InfluxDB Line Protocol format with tag source='cloud' (see save_points())
     """
     global reserveloaded
 
@@ -954,84 +1404,125 @@ def set_reserve_history(start, end):
     if VERBOSE:
         print(f"* Creating reserve pct data: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(end - start)}s)")
 
-    # Create baseline backup_reserve_percent=RESERVE points aligned to minute intervals for full start/end range
-    reservepct = []
+    # Create backup_reserve_percent=RESERVE data points aligned to minute intervals for each day of the start/end range
+    backup_reserve_percent = float(args.reserve)
     timestamp = start.replace(second=0)
     while timestamp <= end:
-        respoint = {}
-        respoint['time'] = timestamp
-        respoint['backup_reserve_percent'] = float(args.reserve)
-        reservepct.append(respoint)
-        timestamp += timedelta(minutes=1)
-
-    # Create backup reserve percent data for import to InfluxDB
-    for respoint in reservepct:
-        timestamp = respoint['time']
-        backup_reserve_percent = respoint['backup_reserve_percent']
-
-        # Save data point values
-        point = f"http,source=cloud,month={timestamp.astimezone(influxtz).strftime('%b')},year={timestamp.astimezone(influxtz).year} backup_reserve_percent={backup_reserve_percent} "
-        point += str(int(timestamp.timestamp()))
-        reservedata.append(point)
+        dayend = min(end, next_day(timestamp) - timedelta(seconds=1))
+        points = []
+        while timestamp <= dayend:
+            # Save data point values
+            point = f"http,source=cloud,month={timestamp.astimezone(influxtz).strftime('%b')},year={timestamp.astimezone(influxtz).year} backup_reserve_percent={backup_reserve_percent} "
+            point += str(int(timestamp.timestamp()))
+            points.append(point)
+            timestamp += timedelta(minutes=1)
+        save_points('reserve', points, dayend)
+
+def next_day(timestamp):
+    """
+    Returns start of the next day (InfluxDB timezone) after timestamp, in UTC
+    """
+    day = timestamp.astimezone(influxtz).replace(hour=0, minute=0, second=0, tzinfo=None) + timedelta(days=1)
+    return day.replace(tzinfo=influxtz).astimezone(utctz)
 
 # InfluxDB Functions
 def search_influx(start, end, datatype):
     """
     Search InfluxDB for missing data points between start and end date/time
+        * data points are counted per hour (or per 'mingap' interval) by InfluxDB, and point times (epoch)
+          are only retrieved for hours that are partially filled
 
     Returns a list of start/end datetime ranges for the 'datatype' ('power' or 'grid' or 'reserve')
     """
-    global queryerr
-
     if VERBOSE:
         print(f"Searching InfluxDB for data gaps ({datatype})")
 
-    # Create query for the data type specified and set gap detection threshold
+    # Set field to search for the data type specified and set gap detection threshold
     if 'power' in datatype:
-        query = f"SELECT home FROM autogen.http WHERE time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
+        field = "home"
+        measurement = "autogen.http"
         mingap = timedelta(minutes=5)
     elif 'grid' in datatype:
-        query = f"SELECT grid_status FROM grid.http WHERE time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
+        field = "grid_status"
+        measurement = "grid.http"
         mingap = timedelta(minutes=1)
     elif 'reserve' in datatype:
-        query = f"SELECT backup_reserve_percent FROM pod.http WHERE time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
+        field = "backup_reserve_percent"
+        measurement = "pod.http"
         mingap = timedelta(minutes=1)
 
-    try:
-        # Execute query
-        result = client.query(query)
+    startts = int(start.timestamp())
+    endts = int(end.timestamp())
+    bucket = 3600
+    spacing = int(mingap.total_seconds())
+    timestamps = []     # first and last time of each data point or full hour
 
-        if args.daemon and queryerr:
-            queryerr = False
+    # Data logged by the dashboard has a point every minute, so a full hour has 60 points. Power usage
+    # imported from Tesla cloud has a point every 5 minutes, and a count per hour can not tell a complete
+    # hour of 5 minute data from a partially logged hour of 1 minute data, so points are counted per
+    # 'mingap' interval and an hour is full when every interval has a data point
+    interval = bucket if spacing <= 60 else spacing
+    minpoints = bucket // 60 if interval == bucket else 1
+
+    try:
+        query = f"SELECT count({field}) FROM {measurement} WHERE time >= {startts}s AND time <= {endts}s GROUP BY time({interval}s) fill(0)"
+        hours = {}
+        for point in client.query(query, epoch='s').get_points():
+            hours.setdefault(point['time'] - point['time'] % bucket, []).append((point['time'], point['count']))
+
+        # Group partially filled hours (and any empty hours between them) into periods to retrieve
+        periods = []
+        opened = False
+        for ts, counts in sorted(hours.items()):
+            if all(count >= minpoints for _, count in counts):
+                # First and last data points of a full hour
+                timestamps.append((counts[0][0], counts[-1][0] + interval - spacing))
+                opened = False
+            elif any(count > 0 for _, count in counts):
+                if opened:
+                    periods[-1][1] = ts + bucket
+                else:
+                    periods.append([ts, ts + bucket])
+                    opened = True
+        if args.debug:
+            print(f"Hours: {len(hours)}, Partial hour periods: {len(periods)}")
+
+        for periodstart, periodend in periods:
+            # Retrieve data point times for partially filled hours
+            query = f"SELECT {field} FROM {measurement} WHERE time >= {max(periodstart, startts)}s AND time < {min(periodend, endts + 1)}s"
+            timestamps.extend((point['time'], point['time']) for point in client.query(query, epoch='s').get_points())
+        timestamps.sort()
+
+        if args.daemon and errstate.queryerr:
+            errstate.queryerr = False
             sys.stdout.flush()
             sys.stderr.write(" + InfluxDB query succeeded\n")
             sys.stderr.flush()
     except Exception as err:
         sys_exit(f"ERROR: Failed to execute InfluxDB query: {query}; {repr(err)}", halt=False)
         if args.daemon:
-            queryerr = True
-            sys.stderr.write(f" ! InfluxDB query failed, retrying in {RETRY} seconds\n")
+            errstate.queryerr = repr(err)
+            sys.stderr.write(" ! InfluxDB query failed\n")
             sys.stderr.flush()
         return None
 
     datagap = []
     startpoint = start
     startfound = False
+    mingap = spacing
 
-    if result:
+    if timestamps:
         # Measure time difference between each data point
-        for point in result.get_points():
-            timestamp = isoparse(point['time']).astimezone(utctz)
-
-            if timestamp == start:
+        prevts = startts
+        for ts, lastts in timestamps:
+            if ts == startts:
                 startfound = True
 
             # Check if time since previous point exceeds minimum gap
-            duration = timestamp - startpoint
-            if duration > mingap:
-                endpoint = timestamp
+            if ts - prevts > mingap:
+                endpoint = datetime.fromtimestamp(ts, tz=utctz)
                 if VERBOSE:
-                    print(f"* Found data gap: [{startpoint.astimezone(influxtz)}] - [{endpoint.astimezone(influxtz)}] ({str(duration)}s)")
+                    print(f"* Found data gap: [{startpoint.astimezone(influxtz)}] - [{endpoint.astimezone(influxtz)}] ({str(endpoint - startpoint)}s)")
 
                 # Ensure period falls between existing data points
                 if (startfound and startpoint == start) or startpoint > start:
@@ -1043,12 +1534,13 @@ def search_influx(start, end, datatype):
                 period['end'] = endpoint - timedelta(seconds=1)
                 datagap.append(period)
 
-            # Move start point time to current point
-            startpoint = timestamp
+            # Move start point time to current point (last point of a full hour)
+            prevts = lastts
+            startpoint = datetime.fromtimestamp(lastts, tz=utctz)
         else:
             # Check last data point to end date/time
             duration = end - startpoint
-            if duration > mingap:
+            if duration.total_seconds() > mingap:
                 endpoint = end
                 if VERBOSE:
                     print(f"* Found data gap: [{startpoint.astimezone(influxtz)}] - [{endpoint.astimezone(influxtz)}] ({str(duration)}s)")
@@ -1061,7 +1553,7 @@ def search_influx(start, end, datatype):
     else:
         # No points found - entire start/end range is a data gap
         duration = end - start
-        if duration > mingap:
+        if duration.total_seconds() > mingap:
             if VERBOSE:
                 print(f"* Found data gap: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(duration)}s)")
 
@@ -1076,141 +1568,107 @@ def search_influx(start, end, datatype):
 def remove_influx(start, end):
     """
     Remove imported data from InfluxDB (removes data points tagged with source='cloud')
+        * data points are counted with count() before and after delete (points are not retrieved)
     """
-    global queryerr
-
     if not args.daemon:
         print("Removing imported data from InfluxDB")
 
-    # Query definitions (sanity check data points before and after delete)
-    power = f"SELECT * FROM autogen.http WHERE source='cloud' AND time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
-    grid = f"SELECT * FROM grid.http WHERE source='cloud' AND time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
-    reserve = f"SELECT * FROM pod.http WHERE source='cloud' AND time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
-    delete = f"DELETE FROM http WHERE source='cloud' AND time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
+    # Query definitions (count power usage, battery percentage, grid status and backup reserve percent data points before and after delete)
+    # (power usage and battery percentage are separate data points in autogen.http, so each is counted with its own field)
+    where = f"WHERE source='cloud' AND time >= '{start.isoformat()}' AND time <= '{end.isoformat()}'"
+    count = f"SELECT count(home) FROM autogen.http {where}; SELECT count(percentage) FROM autogen.http {where}; SELECT count(*) FROM grid.http {where}; SELECT count(*) FROM pod.http {where}"
+    hours = f"SELECT count(home) FROM autogen.http {where} GROUP BY time(1h) fill(none) tz('{ITZ}')"
+    delete = f"DELETE FROM http {where}"
 
     periods = []
-    startpoint = None
 
     try:
-        # Execute query for power usage data
-        query = power
-        result = client.query(query)
-
-        # Get number of data points returned
-        ptspower = len(list(result.get_points()))
-
-        # Create list of start/end periods for InfluxDB update after delete
-        if ptspower > 0:
-            for point in result.get_points():
-                if args.debug:
-                    print(f"Remove data point: {point}")
-                timestamp = isoparse(point['time']).astimezone(utctz)
-
-                if startpoint is None:
-                    startpoint = endpoint = timestamp
-
-                duration = timestamp - endpoint
-                if duration <= timedelta(minutes=5):
-                    # Extend end time of period
-                    endpoint = timestamp
-                else:
-                    # Add data period to list
-                    period = {}
-                    period['start'] = startpoint
-                    period['end'] = endpoint
-                    periods.append(period)
-
-                    # Move point times to current
-                    startpoint = endpoint = timestamp
-            else:
-                # Add last data point to list
-                period = {}
-                period['start'] = startpoint
-                period['end'] = endpoint
-                periods.append(period)
-
-        # Execute query for grid status data
-        query = grid
-        result = client.query(query)
-
-        # Get number of data points returned
-        ptsgrid = len(list(result.get_points()))
-
-        # Execute query for backup reserve percent data
-        query = reserve
-        result = client.query(query)
-
-        # Get number of data points returned
-        ptsreserve = len(list(result.get_points()))
-
-        # Total number of data points to be removed
-        ptstotal = ptspower + ptsgrid + ptsreserve
+        # Execute query for number of data points to be removed
+        query = count
+        ptstotal = sum(count_points(query))
 
         if ptstotal == 0:
             if not args.daemon:
                 print("* No data points found")
-            return
-
-        for point in result.get_points():
-            if args.debug:
-                print(f"Remove data point: {point}")
-
-        if args.test:
+        elif args.test:
             if not args.daemon:
                 print(f"* {ptstotal} data points to be removed (*** skipped - test mode enabled ***)")
-            return
-
-        # Delete data points where source='cloud'
-        query = delete
-        client.query(query)
-
-        # Execute query after delete for power usage data
-        query = power
-        result = client.query(query)
-
-        # Get number of data points returned
-        ptspowernow = len(list(result.get_points()))
-
-        # Execute query after delete for grid status data
-        query = grid
-        result = client.query(query)
-
-        # Get number of data points returned
-        ptsgridnow = len(list(result.get_points()))
-
-        # Execute query after delete for backup reserve percent data
-        query = reserve
-        result = client.query(query)
+        else:
+            if not args.daemon:
+                # Execute query for hours with power usage data
+                query = hours
+                result = client.query(query, epoch='s')
+
+                # Create list of start/end periods for InfluxDB update after delete
+                for point in result.get_points():
+                    timestamp = datetime.fromtimestamp(point['time'], tz=utctz)
+                    if periods and periods[-1]['end'] + timedelta(seconds=1) == timestamp:
+                        # Extend end time of period
+                        periods[-1]['end'] = timestamp + timedelta(hours=1, seconds=-1)
+                    else:
+                        # Add data period to list
+                        period = {}
+                        period['start'] = timestamp
+                        period['end'] = timestamp + timedelta(hours=1, seconds=-1)
+                        periods.append(period)
+                if args.debug:
+                    for period in periods:
+                        print(f"Remove data period: [{period['start'].astimezone(influxtz)}] - [{period['end'].astimezone(influxtz)}]")
 
-        # Get number of data points returned
-        ptsreservenow = len(list(result.get_points()))
+            # Delete data points where source='cloud'
+            query = delete
+            client.query(query)
 
-        # Total number of data points after delete (should be zero)
-        ptstotalnow = ptspowernow + ptsgridnow + ptsreservenow
-        if not args.daemon:
-            print(f"* {ptstotal - ptstotalnow} of {ptstotal} data points removed")
+            # Execute query for number of data points after delete (should be zero)
+            query = count
+            ptstotalnow = sum(count_points(query))
+            if not args.daemon:
+                print(f"* {ptstotal - ptstotalnow} of {ptstotal} data points removed")
 
-        if periods and not args.daemon:
-            # Update InfluxDB analysis data after delete
-            update_influx(periods=periods)
+            if periods and not args.daemon:
+                # Update InfluxDB analysis data after delete
+                update_influx(periods=periods)
 
-        if args.daemon and queryerr:
-            queryerr = False
+        if args.daemon and errstate.queryerr:
+            errstate.queryerr = False
             sys.stdout.flush()
             sys.stderr.write(" + InfluxDB query succeeded\n")
             sys.stderr.flush()
     except Exception as err:
         sys_exit(f"ERROR: Failed to execute InfluxDB query: {query}; {repr(err)}", halt=False)
         if args.daemon:
-            queryerr = True
-            sys.stderr.write(f" ! InfluxDB query failed, retrying in {RETRY} seconds\n")
+            errstate.queryerr = repr(err)
+            sys.stderr.write(" ! InfluxDB query failed\n")
             sys.stderr.flush()
 
-def write_influx():
+def count_points(query):
+    """
+    Execute count(*) query (one or more statements)
+
+    Returns list of the number of data points for each statement (highest count of any field)
     """
-    Write 'powerdata', 'eventdata' and 'reservedata' Line Protocol format data points to InfluxDB
+    results = client.query(query)
+    if not isinstance(results, list):
+        results = [results]
+
+    counts = []
+    for result in results:
+        points = 0
+        for point in result.get_points():
+            points = max([points] + [value for key, value in point.items() if key.startswith('count') and value is not None])
+        counts.append(points)
+    return counts
+
+def write_influx(data=None):
     """
-    global writeerr
+    Write Line Protocol format data points to InfluxDB
+
+    Args:
+        data    = dict of data points to write by kind ('power', 'grid' or 'reserve')
+                  (default is 'powerdata', 'eventdata' and 'reservedata')
+    """
+    if data is None:
+        data = {'power': powerdata, 'grid': eventdata, 'reserve': reservedata}
 
     if args.test:
         if VERBOSE:
@@ -1220,34 +1678,166 @@ def write_influx():
     if VERBOSE:
         print("Writing to InfluxDB")
     try:
-        client.write_points(powerdata, time_precision='s', batch_size=10000, protocol='line')
-        client.write_points(eventdata, time_precision='s', batch_size=10000, retention_policy='grid', protocol='line')
-        client.write_points(reservedata, time_precision='s', batch_size=10000, retention_policy='pod', protocol='line')
+        for kind, points in data.items():
+            if points:
+                client.write_points(points, time_precision='s', batch_size=10000, retention_policy=RETENTION[kind], protocol='line')
 
-        if args.daemon and writeerr:
-            writeerr = False
+        if args.daemon and errstate.writeerr:
+            errstate.writeerr = False
             sys.stdout.flush()
             sys.stderr.write(" + InfluxDB write succeeded\n")
             sys.stderr.flush()
     except Exception as err:
         sys_exit(f"ERROR: Failed to write to InfluxDB: {repr(err)}", halt=False)
         if args.daemon:
-            writeerr = True
-            sys.stderr.write(f" ! InfluxDB write failed, retrying in {RETRY} seconds\n")
+            errstate.writeerr = repr(err)
+            sys.stderr.write(" ! InfluxDB write failed\n")
             sys.stderr.flush()
 
+def save_points(kind, points, chunkend):
+    """
+    Save a chunk of Line Protocol format data points for 'kind' ('power', 'grid' or 'reserve')
+        * when streaming, the chunk is queued for the InfluxDB writer thread (waits if the queue is full)
+        * otherwise, points are added to 'powerdata', 'eventdata' or 'reservedata' for write_influx()
+
+    Args:
+        chunkend    = date/time the chunk covers data up to (recorded in the checkpoint once written)
+    """
+    if writer is None:
+        {'power': powerdata, 'grid': eventdata, 'reserve': reservedata}[kind].extend(points)
+        return
+
+    if streamerr:
+        sys_exit(f"ERROR: Failed to write to InfluxDB: {streamerr}\nRun the same command again to resume the import")
+    pointcount[kind] += len(points)
+    writequeue.put((kind, points, chunkend))
+
+def start_writer():
+    """
+    Start streaming data points to InfluxDB in chunks from a bounded queue (writer thread)
+    """
+    global writequeue, writer
+
+    if VERBOSE:
+        if args.test:
+            print("Writing to InfluxDB (*** skipped - test mode enabled ***)\n")
+        else:
+            print("Writing to InfluxDB as history data is retrieved\n")
+    writequeue = queue.Queue(maxsize=8)
+    writer = threading.Thread(target=influx_writer, daemon=True)
+    writer.start()
+
+def stop_writer():
+    """
+    Wait for queued data points to be written and stop the writer thread
+    """
+    writequeue.put(None)
+    writer.join()
+    if streamerr:
+        sys_exit(f"ERROR: Failed to write to InfluxDB: {streamerr}\nRun the same command again to resume the import")
+
+def influx_writer():
+    """
+    Write queued chunks of data points to InfluxDB and record each written chunk in the checkpoint
+        * after a write error, remaining chunks are discarded (the import is stopped by save_points())
+    """
+    global streamerr
+
+    while True:
+        chunk = writequeue.get()
+        if chunk is None:
+            break
+        kind, points, chunkend = chunk
+        if args.test or streamerr:
+            continue
+        try:
+            if points:
+                client.write_points(points, time_precision='s', batch_size=10000, retention_policy=RETENTION[kind], protocol='line')
+            checkpoint['written'][kind] = chunkend.isoformat()
+            save_checkpoint()
+        except Exception as err:
+            streamerr = repr(err)
+
+def load_checkpoint(start, end, powergaps):
+    """
+    Load checkpoint of an interrupted import for the same site and start/end range, or create a new checkpoint
+        * start/end is the range requested on the command line (before it is limited to the site current
+          time), so an import up to now can be resumed by running the same command again
+        * power usage periods of a checkpoint for another range are carried over, as data written before
+          that import was interrupted is no longer a gap but its analysis data still needs updating
+
+    Returns True if resuming from an existing checkpoint
+    """
+    global checkpoint
+
+    siteid = lookup(site, ['energy_site_id'])
+    data = None
+    try:
+        with open(CHECKPOINTFILE, 'r') as f:
+            data = json.load(f)
+        if data['site'] == siteid and data['start'] == start.isoformat() and data['end'] == end.isoformat():
+            checkpoint = data
+            checkpoint['update'] = checkpoint.get('update', False) or 'power' in checkpoint['written']
+    except FileNotFoundError:
+        pass
+    except Exception as err:
+        data = None
+        print(f"Ignoring invalid checkpoint '{CHECKPOINTFILE}' - {repr(err)}\n")
+
+    resumed = checkpoint is not None
+    if not resumed:
+        checkpoint = {'site': siteid, 'start': start.isoformat(), 'end': end.isoformat(), 'written': {}, 'periods': [], 'update': False}
+        if data is not None and data['site'] == siteid and (data.get('update') or 'power' in data['written']):
+            # Analysis data of an interrupted import for another range was not updated - carry over its periods
+            print("Including analysis data update of interrupted import from checkpoint\n")
+            checkpoint['periods'] = data['periods']
+            checkpoint['update'] = True
+
+    # Record power usage periods to be imported (used to update analysis data if interrupted)
+    for period in powergaps or []:
+        period = [period['start'].isoformat(), period['end'].isoformat()]
+        if period not in checkpoint['periods']:
+            checkpoint['periods'].append(period)
+    save_checkpoint()
+    return resumed
+
+def save_checkpoint():
+    """
+    Save checkpoint to file (written to a temporary file and renamed)
+    """
+    with open(f"{CHECKPOINTFILE}.tmp", 'w') as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{CHECKPOINTFILE}.tmp", CHECKPOINTFILE)
+
+def resume_periods(periods, kind):
+    """
+    Remove periods (or part of) already written to InfluxDB for 'kind' according to the checkpoint
+
+    Returns list of remaining start/end datetime ranges
+    """
+    if not periods or kind not in checkpoint['written']:
+        return periods
+    written = isoparse(checkpoint['written'][kind])
+    remaining = []
+    for period in periods:
+        if period['end'] <= written:
+            continue
+        if period['start'] <= written:
+            period = {'start': written + timedelta(seconds=1), 'end': period['end']}
+        remaining.append(period)
+    return remaining
+
 def update_influx(start=None, end=None, periods=None):
     """
     Update analysis data retention policies (kwh, daily, monthly) from newly imported data
-        * Queries will be limited to ranges which include new data points only
+        * Queries will be limited to the hours, days and months which include new data points only
+        * Consecutive hours/days/months are updated with a single query of up to MAXRANGE days (or 12 months)
 
     Args:
         start/end   = Single start and end date/time range to run queries for
             or
         periods     = List of start and end date/time ranges to run queries for
     """
-    global queryerr
-
     if args.test:
         if VERBOSE:
             print("Updating InfluxDB (*** skipped - test mode enabled ***)")
@@ -1256,91 +1846,36 @@ def update_influx(start=None, end=None, periods=None):
     if VERBOSE:
         print("Updating InfluxDB")
 
-    # Create list of hourly/daily/monthly time periods to run queries for
-    hourly = []
-    daily = []
-    monthly = []
+    if periods is None:
+        periods = [{'start': start, 'end': end}]
 
-    if periods is not None:
-        # If passed a list of start/end ranges, set start/end to first item
-        start = periods[0]['start']
-        end = periods[0]['end']
-
-    # Set hour/day/month start and end periods aligned to group by time ranges
-    starthour = start.replace(minute=0, second=0)
-    endhour = end.replace(minute=0, second=0) + timedelta(hours=1)
-    startday = start.astimezone(influxtz).replace(hour=0, minute=0, second=0, tzinfo=None)
-    endday = end.astimezone(influxtz).replace(hour=0, minute=0, second=0, tzinfo=None) + timedelta(days=1)
-    startmonth = start.astimezone(influxtz).replace(day=1, hour=0, minute=0, second=0)
-    endmonth = end.astimezone(influxtz) + relativedelta(months=1, day=1, hour=0, minute=0, second=0)
-
-    if periods is not None:
-        for p in periods[1:]:
-            # Get next start and end period time ranges
-            nextstarthour = p['start'].astimezone(utctz).replace(minute=0, second=0)
-            nextendhour = p['end'].astimezone(utctz).replace(minute=0, second=0) + timedelta(hours=1)
-            nextstartday = p['start'].astimezone(influxtz).replace(hour=0, minute=0, second=0, tzinfo=None)
-            nextendday = p['end'].astimezone(influxtz).replace(hour=0, minute=0, second=0, tzinfo=None) + timedelta(days=1)
-            nextstartmonth = p['start'].astimezone(influxtz).replace(day=1, hour=0, minute=0, second=0)
-            nextendmonth = p['end'].astimezone(influxtz) + relativedelta(months=1, day=1, hour=0, minute=0, second=0)
-
-            if nextstarthour <= endhour:
-                # Extend time range to include this period
-                endhour = nextendhour
-            else:
-                # Add period to list
-                period = {}
-                period['start'] = starthour.astimezone(influxtz)
-                period['end'] = endhour.astimezone(influxtz)
-                hourly.append(period)
+    # Find hours (aligned to InfluxDB timezone), days and months which include new data points
+    hours = set()
+    for p in periods:
+        hour = p['start'].astimezone(influxtz).replace(minute=0, second=0, microsecond=0).astimezone(utctz)
+        while hour <= p['end']:
+            hours.add(hour)
+            hour += timedelta(hours=1)
+    days = set(hour.astimezone(influxtz).date() for hour in hours)
+    months = set(day.replace(day=1) for day in days)
 
-                # Skip to next hour
-                starthour = nextstarthour
-                endhour = nextendhour
+    # Create list of hourly/daily/monthly time periods to run queries for
+    hourly = []
+    for first, last in get_runs(sorted(hours), lambda h: h + timedelta(hours=1), IMAXRANGE * 24):
+        hourly.append({'start': first.astimezone(influxtz), 'end': (last + timedelta(hours=1)).astimezone(influxtz)})
 
-            if nextstartday <= endday:
-                # Extend time range to include this period
-                endday = nextendday
-            else:
-                # Add period to list
-                period = {}
-                period['start'] = startday.replace(tzinfo=influxtz)
-                period['end'] = endday.replace(tzinfo=influxtz)
-                daily.append(period)
+    daily = []
+    for first, last in get_runs(sorted(days), lambda d: d + timedelta(days=1), IMAXRANGE):
+        daily.append({'start': datetime.combine(first, datetime.min.time()).replace(tzinfo=influxtz),
+            'end': datetime.combine(last + timedelta(days=1), datetime.min.time()).replace(tzinfo=influxtz)})
 
-                # Skip to next day
-                startday = nextstartday
-                endday = nextendday
+    monthly = []
+    for first, last in get_runs(sorted(months), lambda m: m + relativedelta(months=1), 12):
+        monthly.append({'start': datetime.combine(first, datetime.min.time()).replace(tzinfo=influxtz),
+            'end': datetime.combine(last + relativedelta(months=1), datetime.min.time()).replace(tzinfo=influxtz)})
 
-            if nextstartmonth <= endmonth:
-                # Extend time range to include this period
-                endmonth = nextendmonth
-            else:
-                # Add period to list
-                period = {}
-                period['start'] = startmonth
-                period['end'] = endmonth
-                monthly.append(period)
-
-                # Skip to next month
-                startmonth = nextstartmonth
-                endmonth = nextendmonth
-
-    # Add last period to list
-    period = {}
-    period['start'] = starthour.astimezone(influxtz)
-    period['end'] = endhour.astimezone(influxtz)
-    hourly.append(period)
-
-    period = {}
-    period['start'] = startday.replace(tzinfo=influxtz)
-    period['end'] = endday.replace(tzinfo=influxtz)
-    daily.append(period)
-
-    period = {}
-    period['start'] = startmonth
-    period['end'] = endmonth
-    monthly.append(period)
+    if args.debug:
+        print(f"Updating {len(hours)} hours ({len(hourly)} queries), {len(days)} days ({len(daily)} queries), {len(months)} months ({len(monthly)} queries)")
 
     # Execute queries for each date/time period
     try:
@@ -1365,22 +1900,331 @@ def update_influx(start=None, end=None, periods=None):
             query += f"GROUP BY time(365d), month, year"
             client.query(query)
 
-        if args.daemon and queryerr:
-            queryerr = False
+        if args.daemon and errstate.queryerr:
+            errstate.queryerr = False
             sys.stdout.flush()
             sys.stderr.write(" + InfluxDB query succeeded\n")
             sys.stderr.flush()
     except Exception as err:
         sys_exit(f"ERROR: Failed to execute InfluxDB query: {query}; {repr(err)}", halt=False)
         if args.daemon:
-            queryerr = True
-            sys.stderr.write(f" ! InfluxDB query failed, retrying in {RETRY} seconds\n")
+            errstate.queryerr = repr(err)
+            sys.stderr.write(" ! InfluxDB query failed\n")
             sys.stderr.flush()
 
+def get_runs(buckets, nextbucket, maxlen):
+    """
+    Group sorted list of buckets into runs of consecutive buckets
+
+    Args:
+        buckets     = sorted list of buckets (e.g. hours, days or months)
+        nextbucket  = function returning the bucket following a bucket
+        maxlen      = maximum number of buckets in a run
+
+    Returns list of first and last bucket tuples for each run
+    """
+    runs = []
+    for bucket in buckets:
+        if runs and nextbucket(runs[-1][1]) == bucket and runs[-1][2] < maxlen:
+            runs[-1][1] = bucket
+            runs[-1][2] += 1
+        else:
+            runs.append([bucket, bucket, 1])
+    return [(first, last) for first, last, _ in runs]
+
+# Daemon Functions
+class DaemonKind(object):
+    """
+    Poll schedule, backoff and error state for one kind of history data when running as a daemon
+        * poll requests run in a dedicated worker thread, so a request that hangs only delays its own kind
+        * on errors, the poll is retried after RETRY seconds, doubled for each further error (up to the wait time)
+    """
+    def __init__(self, name, job, wait, data):
+        self.name = name
+        self.job = job
+        self.wait = wait
+        self.data = data
+        self.errors = 0
+        self.lasterror = None
+        self.lastrun = None
+        self.lastsuccess = None
+        self.nextrun = None
+        self.running = False
+        self.jobs = queue.Queue()
+        threading.Thread(target=self.worker, daemon=True).start()
+
+    def worker(self):
+        """
+        Run queued poll requests and return the result (None, or error) to the event loop
+        """
+        while True:
+            loop, future, start, end = self.jobs.get()
+            try:
+                error = self.job(start, end)
+            except Exception as err:
+                sys_exit(f"ERROR: Failed to poll {self.name} history - {repr(err)}", halt=False)
+                error = repr(err)
+            loop.call_soon_threadsafe(future.set_result, error)
+
+    async def poll(self):
+        """
+        Poll for the last HIST minutes of history data every 'wait' minutes
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            self.lastrun = datetime.now(tz=utctz).replace(microsecond=0)
+            end = self.lastrun - timedelta(minutes=2)
+            start = end - timedelta(minutes=HIST)
+            future = loop.create_future()
+            self.running = True
+            self.jobs.put((loop, future, start, end))
+            try:
+                error = await asyncio.wait_for(asyncio.shield(future), TIMEOUT)
+            except asyncio.TimeoutError:
+                # Report the request as failed, and wait for it to return before polling again (other kinds are not affected)
+                self.lasterror = f"No response after {TIMEOUT} seconds"
+                sys.stderr.write(f" ! Poll {self.name} history not responding after {TIMEOUT} seconds\n")
+                sys.stderr.flush()
+                error = await future
+            self.running = False
+
+            if error is None:
+                if self.errors or self.lasterror:
+                    sys.stderr.write(f" + Poll {self.name} history succeeded\n")
+                    sys.stderr.flush()
+                self.errors = 0
+                self.lasterror = None
+                self.lastsuccess = self.lastrun
+                self.nextrun = self.lastrun + timedelta(minutes=self.wait)
+            else:
+                self.errors += 1
+                self.lasterror = error
+                delay = min(RETRY * 2 ** min(self.errors - 1, 16), self.wait * 60)
+                self.nextrun = datetime.now(tz=utctz).replace(microsecond=0) + timedelta(seconds=delay)
+                sys.stderr.write(f" ! Poll {self.name} history failed, retrying in {delay} seconds\n")
+                sys.stderr.flush()
+            sys.stdout.flush()
+
+            await asyncio.sleep(max(0, (self.nextrun - datetime.now(tz=utctz)).total_seconds()))
+
+    def status(self):
+        """
+        Returns poll status for the health check
+        """
+        def isotime(dt):
+            return None if dt is None else dt.astimezone(influxtz).isoformat()
+
+        return {
+            'status': 'ok' if self.lasterror is None else 'error',
+            'running': self.running,
+            'errors': self.errors,
+            'lasterror': self.lasterror,
+            'lastrun': isotime(self.lastrun),
+            'lastsuccess': isotime(self.lastsuccess),
+            'nextrun': isotime(self.nextrun),
+            'points': len(self.data),
+        }
+
+def poll_power(start, end):
+    """
+    Retrieve power history data and write to InfluxDB (daemon poll request)
+        * DELETE removes imported data points of all retention policies, so the grid status and backup
+          reserve percent points last written by the other polls are written again for the same period
+
+    Returns None, or error
+    """
+    global dayloaded
+
+    powerdata.clear()
+    dayloaded = None
+    get_power_history(start, end)
+    if errstate.fetcherr:
+        return errstate.fetcherr
+    if not powerdata:
+        return None
+
+    with influxlock:
+        # Remove previously written data points
+        if VERBOSE:
+            print("Clearing InfluxDB data")
+        remove_influx(start, end)
+        if errstate.queryerr:
+            return errstate.queryerr
+
+        # Write new data points to InfluxDB
+        data = {'power': powerdata}
+        for kind in ('grid', 'reserve'):
+            data[kind] = [p for p in lastpoints[kind] if start.timestamp() <= int(p.rsplit(' ', 1)[1]) <= end.timestamp()]
+        write_influx(data)
+        if errstate.writeerr:
+            return errstate.writeerr
+
+    # Update InfluxDB analysis data
+    update_influx(start, end)
+    return errstate.queryerr or None
+
+def poll_backup(start, end):
+    """
+    Retrieve backup event history and write grid status data to InfluxDB (daemon poll request)
+
+    Returns None, or error
+    """
+    global eventsloaded
+
+    backupdata.clear()
+    eventdata.clear()
+    eventsloaded = False
+    get_backup_history(start, end)
+    if errstate.fetcherr:
+        return errstate.fetcherr
+    return poll_write('grid', eventdata)
+
+def poll_reserve(start, end):
+    """
+    Set backup reserve percent history and write to InfluxDB (daemon poll request)
+
+    Returns None, or error
+    """
+    reservedata.clear()
+    set_reserve_history(start, end)
+    return poll_write('reserve', reservedata)
+
+def poll_write(kind, points):
+    """
+    Write grid status or backup reserve percent data points to InfluxDB and keep a copy for poll_power()
+
+    Returns None, or error
+    """
+    if not points:
+        return None
+
+    with influxlock:
+        write_influx({kind: points})
+        if errstate.writeerr:
+            return errstate.writeerr
+        lastpoints[kind] = list(points)
+    return None
+
+async def health_handler(reader, writer):
+    """
+    Health check request handler - returns poll status for each kind of history data as JSON
+        * status 200 if the last poll of every kind succeeded, otherwise 503
+    """
+    try:
+        request = await asyncio.wait_for(reader.readline(), 10)
+        while (await asyncio.wait_for(reader.readline(), 10)).strip():
+            pass
+        parts = request.decode('latin-1').split()
+        path = parts[1].split('?')[0] if len(parts) > 1 else ""
+
+        if path in ("/", "/health"):
+            kinds = {name: kind.status() for name, kind in daemonkinds.items()}
+            healthy = all(k['status'] == 'ok' for k in kinds.values())
+            status = "200 OK" if healthy else "503 Service Unavailable"
+            body = {'status': 'ok' if healthy else 'error', 'build': BUILD, 'kinds': kinds}
+        else:
+            status = "404 Not Found"
+            body = {'error': 'not found'}
+
+        content = json.dumps(body).encode()
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(content)}\r\nConnection: close\r\n\r\n".encode() + content)
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+async def run_daemon():
+    """
+    Poll each kind of history data on its own schedule, and serve the health check if enabled
+    """
+    daemonkinds['power'] = DaemonKind('power', poll_power, WAIT, powerdata)
+    if isinstance(site, Battery):
+        daemonkinds['backup'] = DaemonKind('backup', poll_backup, BACKUPWAIT, eventdata)
+        if args.reserve is not None:
+            daemonkinds['reserve'] = DaemonKind('reserve', poll_reserve, RESERVEWAIT, reservedata)
+
+    for kind in daemonkinds.values():
+        print(f" + Retrieving {HIST} minutes of {kind.name} history every {kind.wait} minutes")
+
+    if HEALTHPORT:
+        await asyncio.start_server(health_handler, port=HEALTHPORT)
+        print(f" + Health check on port {HEALTHPORT}")
+    sys.stdout.flush()
+
+    await asyncio.gather(*(kind.poll() for kind in daemonkinds.values()))
+
+class InfluxSink(object):
+    """
+    In-process stand-in for InfluxDBClient used by --benchmark with --replay
+        * queries return no data (so the whole start/end range is imported)
+        * written Line Protocol data points are checked for format and counted, then discarded
+    """
+    def __init__(self):
+        self.points = 0
+        self.writes = 0
+        self.queries = 0
+        self.lock = threading.Lock()
+
+    def query(self, query, epoch=None):
+        with self.lock:
+            self.queries += 1
+        return self
+
+    def get_points(self):
+        return iter(())
+
+    def write_points(self, points, time_precision=None, batch_size=None, retention_policy=None, protocol=None):
+        for point in points:
+            fields = point.split(' ')
+            if len(fields) != 3 or not fields[0].startswith('http,') or '=' not in fields[1] or not fields[2].isdigit():
+                raise ValueError(f"Invalid Line Protocol data point: {point}")
+        with self.lock:
+            self.points += len(points)
+            self.writes += 1
+        return True
+
+def benchmark_report(start, end, elapsed):
+    """
+    Print import benchmark results (days of history and data points per second, and peak memory use)
+    """
+    days = (end - start).total_seconds() / 86400
+    points = sum(pointcount.values())
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS, kilobytes on Linux
+        peak = f"{peak / (1024 * 1024 if sys.platform == 'darwin' else 1024):.1f} MB"
+    except ImportError:
+        peak = "n/a"
+
+    print("-" * 51)
+    print("Benchmark Summary - Import using recorded history:")
+    print("-" * 51)
+    print(f"  Elapsed time:     {elapsed:.2f}s")
+    print(f"  History days:     {days:.1f} ({days / elapsed:.1f} days/sec)")
+    print(f"  Data points:      {points} ({points / elapsed:.0f} points/sec)")
+    print(f"  Points written:   {client.points} in {client.writes} writes, {client.queries} queries")
+    print(f"  Replayed calls:   {site.calls} (latency {args.latency}s, {TWORKERS} workers, rate {f'{TRATE}/s' if TRATE > 0 else 'no limit'})")
+    print(f"  Peak RSS:         {peak}")
+
 # MAIN
 
-# Create InfluxDB client instance
-client = InfluxDBClient(host=IHOST, port=IPORT, username=IUSER, password=IPASS, database=IDB)
+# Create Tesla cloud request rate limiter
+ratelimit = TokenBucket(TRATE, TWORKERS)
+
+if args.benchmark and not args.replay:
+    # Run power history transform benchmark (no Tesla cloud or InfluxDB requests)
+    benchmark_transform()
+    sys_exit()
+
+if args.benchmark:
+    # Import recorded history into an in-process InfluxDB stand-in (checkpoint saved to a temporary file)
+    client = InfluxSink()
+    CHECKPOINTFILE = os.path.join(tempfile.gettempdir(), f"{SCRIPTNAME}-benchmark-{os.getpid()}.checkpoint")
+else:
+    # Create InfluxDB client instance
+    client = InfluxDBClient(host=IHOST, port=IPORT, username=IUSER, password=IPASS, database=IDB)
 
 if args.remove and not (args.login or args.setup):
     # Get start/end datetimes from command line arguments
@@ -1464,13 +2308,19 @@ def update_influx(start=None, end=None, periods=None):
         print(f"  Reserve history:      0 (generated locally, no API calls)")
     print(f"  {'-' * 45}")
     print(f"  Total estimated calls: {total_calls}+")
+    if TRATE > 0:
+        print(f"  Estimated fetch time:  {str(timedelta(seconds=int((power_calls + soe_calls) / TRATE)))} (at {TRATE} requests per second)")
     print("\nNote: SOE and backup calls only apply to Powerwall (Battery) sites.")
     print("      Backup call count is a minimum; actual calls depend on event history length.")
     print("\nDone.")
     sys_exit()
 
-# Login and get list of Tesla Energy sites
-sitelist = tesla_login(TUSER)
+if args.replay:
+    # Get Tesla Energy site from recording
+    sitelist = load_replay(args.replay, args.latency)
+else:
+    # Login and get list of Tesla Energy sites
+    sitelist = tesla_login(TUSER)
 
 # Check for energy sites
 if len(sitelist) == 0:
@@ -1520,13 +2370,11 @@ def update_influx(start=None, end=None, periods=None):
 if args.login or args.setup:
     sys_exit()
 
-if args.daemon:
-    # Set initial start/end datetimes when running as a daemon
-    end = datetime.now(tz=influxtz).astimezone(utctz).replace(microsecond=0) - timedelta(minutes=WAIT + 2)
-    start = end - timedelta(minutes=HIST)
-else:
-    # Get start/end datetimes from command line arguments
+if not args.daemon:
+    # Get start/end datetimes from command line arguments (each daemon poll request sets its own start/end)
     start, end = get_start_end()
+    # Requested range identifies the checkpoint of an interrupted import (start/end are limited below)
+    reqstart, reqend = start, end
     print(f"Running for period: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(end - start)}s)\n")
 
 # Get site current time
@@ -1548,96 +2396,67 @@ def update_influx(start=None, end=None, periods=None):
 # Get site info
 site = siteinfo['site']
 
-if args.force:
-    # Retrieve power history data between start and end date/time (skip search for gaps)
-    get_power_history(start, end)
-    print()
+if args.record:
+    # Record history responses from Tesla cloud (cached history is not used, so all days are recorded)
+    args.no_cache = True
+    record_site(siteinfo, args.record)
 
-    if isinstance(site, Battery):
-        # Retrieve backup history data between start and end date/time (skip search for gaps)
-        get_backup_history(start, end)
-        print()
+if TCACHE != "" and not args.benchmark:
+    # Cache daily history per site
+    cachedir = os.path.join(TCACHE, str(lookup(site, ['energy_site_id'])))
 
-        if args.reserve is not None:
-            # Set backup reserve percent history data
-            set_reserve_history(start, end)
-            print()
-elif args.daemon:
+if args.daemon:
     try:
         print("* Server Started")
-        print(f" + Retrieving {HIST} minutes of history every {WAIT} minutes")
-        sys.stdout.flush()
-        while True:
-            currentts = datetime.now(tz=influxtz).astimezone(utctz).replace(microsecond=0) - timedelta(minutes=2)
-            # Check if wait time passed
-            if currentts >= end + timedelta(minutes=WAIT):
-                # Update start/end range to get history data to current time
-                end = currentts
-                start = end - timedelta(minutes=HIST)
-            else:
-                time.sleep(1)
-                continue
-
-            # Re-initialise globals
-            powerdata.clear()
-            backupdata.clear()
-            eventdata.clear()
-            reservedata.clear()
-            dayloaded = None
-            eventsloaded = False
-            reserveloaded = False
-
-            # Retrieve power history data
-            get_power_history(start, end)
-
-            if isinstance(site, Battery):
-                # Retrieve backup history data
-                get_backup_history(start, end)
-
-                if args.reserve is not None:
-                    # Set backup reserve percent history data
-                    set_reserve_history(start, end)
-
-            if powerdata or eventdata or reservedata:
-                if powerdata:
-                    # Remove previously written data points
-                    if VERBOSE:
-                        print("Clearing InfluxDB data")
-                    remove_influx(start, end)
-
-                # Write new data points to InfluxDB
-                write_influx()
-
-                if powerdata:
-                    # Update InfluxDB analysis data
-                    update_influx(start, end)
-
-            if fetcherr or queryerr or writeerr:
-                # If an error occurred, reset the end time to wait for the configured retry delay
-                end = datetime.now(tz=influxtz).astimezone(utctz).replace(microsecond=0) - timedelta(minutes=2) + timedelta(minutes=-WAIT, seconds=RETRY)
-
-            sys.stdout.flush()
+        asyncio.run(run_daemon())
     except (KeyboardInterrupt, SystemExit):
         server_exit()
 else:
-    # Search InfluxDB for power usage data gaps
-    powergaps = search_influx(start, end, 'power usage')
-    print() if powergaps else print("* None found\n")
+    benchstart = time.perf_counter()
 
-    if isinstance(site, Battery):
-        # Search InfluxDB for grid status data gaps
-        gridgaps = search_influx(start, end, 'grid status')
-        print() if gridgaps else print("* None found\n")
-
-        if args.reserve is not None:
-            # Search InfluxDB for backup reserve percent data gaps
-            reservegaps = search_influx(start, end, 'backup reserve percent')
-            print() if reservegaps else print("* None found\n")
+    if args.force:
+        # Import entire start/end range (skip search for gaps)
+        powergaps = [{'start': start, 'end': end}]
+        if isinstance(site, Battery):
+            gridgaps = [{'start': start, 'end': end}]
+            if args.reserve is not None:
+                reservegaps = [{'start': start, 'end': end}]
+    else:
+        # Search InfluxDB for power usage data gaps
+        powergaps = search_influx(start, end, 'power usage')
+        print() if powergaps else print("* None found\n")
 
-    if not (powergaps or gridgaps or reservegaps):
+        if isinstance(site, Battery):
+            # Search InfluxDB for grid status data gaps
+            gridgaps = search_influx(start, end, 'grid status')
+            print() if gridgaps else print("* None found\n")
+
+            if args.reserve is not None:
+                # Search InfluxDB for backup reserve percent data gaps
+                reservegaps = search_influx(start, end, 'backup reserve percent')
+                print() if reservegaps else print("* None found\n")
+
+    resumed = pending = False
+    if not args.test and (powergaps or gridgaps or reservegaps or os.path.exists(CHECKPOINTFILE)):
+        # Skip data already written by an interrupted import for the same date/time range
+        resumed = load_checkpoint(reqstart, reqend, powergaps)
+        # Analysis data still to be updated for power usage data written by an interrupted import
+        pending = checkpoint['update']
+        if resumed:
+            print("Resuming interrupted import from checkpoint\n")
+            powergaps = resume_periods(powergaps, 'power')
+            gridgaps = resume_periods(gridgaps, 'grid')
+            reservegaps = resume_periods(reservegaps, 'reserve')
+
+    if not (powergaps or gridgaps or reservegaps or resumed or pending):
+        if checkpoint is not None:
+            os.remove(CHECKPOINTFILE)
         print("Done.")
         sys_exit()
 
+    # Write data points to InfluxDB in chunks as history data is retrieved
+    start_writer()
+
     if powergaps:
         # Retrieve power history data for each gap period
         for period in powergaps:
@@ -1656,14 +2475,23 @@ def update_influx(start=None, end=None, periods=None):
             set_reserve_history(period['start'], period['end'])
         print()
 
-if not (powerdata or eventdata or reservedata):
-    sys_exit("ERROR: No data returned for this date/time range")
+    stop_writer()
 
-# Write data points to InfluxDB
-write_influx()
+    if not (any(pointcount.values()) or resumed or pending):
+        if checkpoint is not None:
+            os.remove(CHECKPOINTFILE)
+        sys_exit("ERROR: No data returned for this date/time range")
 
-if powerdata:
-    # Update InfluxDB analysis data
-    update_influx(start, end, powergaps)
+    if pointcount['power'] or pending:
+        # Update InfluxDB analysis data (including periods written before the import was interrupted)
+        if checkpoint is not None:
+            powergaps = sorted([{'start': isoparse(p[0]), 'end': isoparse(p[1])} for p in checkpoint['periods']], key=lambda p: p['start'])
+        update_influx(periods=powergaps)
+
+    if checkpoint is not None:
+        os.remove(CHECKPOINTFILE)
+
+    if args.benchmark:
+        benchmark_report(start, end, time.perf_counter() - benchstart)
 
-print("Done.")
+    print("Done.")
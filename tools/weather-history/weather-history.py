@@ -65,6 +65,9 @@
 import requests
 from urllib3 import Retry
 import time
+import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timedelta
 try:
@@ -77,11 +80,12 @@
 except:
     sys.exit("ERROR: Missing python influxdb module. Run 'pip install influxdb'.")
 
-BUILD = "0.1.4"
+BUILD = "0.2.0"
 SCRIPTPATH = Path(sys.argv[0]).resolve().parent
 SCRIPTNAME = os.path.basename(sys.argv[0]).split('.')[0]
 CONFIGNAME = CONFIGFILE = f"{SCRIPTNAME}.conf"
 W411CONFIG = str(SCRIPTPATH / ".." / ".." / "weather" / "weather411.conf")
+POLICIES = ('time', 'daytime', 'largest', 'coarse')
 
 # Parse command line arguments
 parser = argparse.ArgumentParser(description='Import weather history data from OpenWeatherMap One Call API 3.0 into InfluxDB')
@@ -95,6 +99,7 @@
 group.add_argument('--dry-run', action='store_true', help='identify data gaps and show number of API calls required without making any API calls')
 group.add_argument('--force', action='store_true', help='force import for date/time range (skip search for data gaps)')
 group.add_argument('--remove', action='store_true', help='remove imported data from InfluxDB for date/time range')
+group.add_argument('--policy', choices=POLICIES, metavar='POLICY', help='request schedule priority: time, daytime, largest or coarse (default: time, or POLICY in config)')
 group.add_argument('--version', action="store_true", help=argparse.SUPPRESS)
 group = parser.add_argument_group('date/time range options')
 group.add_argument('--start', help='start date and time ("YYYY-MM-DD hh:mm:ss")')
@@ -147,9 +152,16 @@
         OWUNITS = config.get('OpenWeatherMap', 'UNITS')
         OWGAP = config.getint('OpenWeatherMap', 'GAP', fallback=30)
         TIMEOUT = config.getint('OpenWeatherMap', 'TIMEOUT', fallback=10)
+        OWLIMIT = config.getint('OpenWeatherMap', 'LIMIT', fallback=1000)
+        OWWORKERS = config.getint('OpenWeatherMap', 'WORKERS', fallback=4)
+        OWPOLICY = config.get('OpenWeatherMap', 'POLICY', fallback='time').strip().lower()
 
         if OWGAP < 10:
             OWGAP = 10
+        if OWWORKERS < 1:
+            OWWORKERS = 1
+        if OWPOLICY not in POLICIES:
+            raise ValueError(f"Invalid POLICY '{OWPOLICY}' (valid: {', '.join(POLICIES)})")
 
         # Get InfluxDB Settings
         IHOST = config.get('InfluxDB', 'HOST')
@@ -161,6 +173,7 @@
         IDB = config.get('InfluxDB', 'DB')
         IFIELD = config.get('InfluxDB', 'FIELD')
         ITZ = config.get('InfluxDB', 'TZ')
+        IBATCH = max(1, config.getint('InfluxDB', 'BATCH', fallback=100))
         configloaded = True
     except Exception as err:
         sys.exit(f"ERROR: Config file '{CONFIGNAME}' - {err}")
@@ -189,6 +202,9 @@
                 OWUNITS = w411conf.get('OpenWeatherMap', 'UNITS', fallback=None)
                 OWGAP = w411conf.getint('OpenWeatherMap', 'GAP', fallback=None)
                 TIMEOUT = w411conf.getint('OpenWeatherMap', 'TIMEOUT', fallback=10)
+                OWLIMIT = None
+                OWWORKERS = 4
+                OWPOLICY = 'time'
 
                 if OWGAP is not None and OWGAP < 10:
                     OWGAP = 10
@@ -203,6 +219,7 @@
                 IDB = w411conf.get('InfluxDB', 'DB', fallback=None)
                 IFIELD = w411conf.get('InfluxDB', 'FIELD', fallback=None)
                 ITZ = w411conf.get('InfluxDB', 'TZ', fallback=None)
+                IBATCH = 100
 
                 if IHOST is not None and IHOST == "influxdb":
                     IHOST = "localhost"
@@ -304,6 +321,26 @@
             except:
                 print("\nERROR: Invalid number\n")
 
+    while True:
+        if configloaded and OWLIMIT is not None:
+            response = input(f"API calls per day limit (0 for no limit): [{OWLIMIT}] ").strip()
+        else:
+            response = input("API calls per day limit (0 for no limit): [1000] ").strip()
+        if configloaded and OWLIMIT is not None and response == "":
+            break
+        elif response == "":
+            OWLIMIT = 1000
+            break
+        else:
+            try:
+                if int(response) >= 0:
+                    OWLIMIT = int(response)
+                    break
+                else:
+                    print("\nERROR: Invalid number\n")
+            except:
+                print("\nERROR: Invalid number\n")
+
     print("\nInfluxDB Setup")
     print("-" * 14)
 
@@ -406,11 +443,19 @@
     config['OpenWeatherMap']['LON'] = OWLON
     config['OpenWeatherMap']['UNITS'] = OWUNITS
     config['OpenWeatherMap']['GAP'] = str(OWGAP)
+    config['OpenWeatherMap']['LIMIT'] = str(OWLIMIT)
 
     if not configloaded:
         TIMEOUT = 10
-    elif TIMEOUT != 10:
-        config['OpenWeatherMap']['TIMEOUT'] = str(TIMEOUT)
+        OWWORKERS = 4
+        OWPOLICY = 'time'
+    else:
+        if TIMEOUT != 10:
+            config['OpenWeatherMap']['TIMEOUT'] = str(TIMEOUT)
+        if OWWORKERS != 4:
+            config['OpenWeatherMap']['WORKERS'] = str(OWWORKERS)
+        if OWPOLICY != 'time':
+            config['OpenWeatherMap']['POLICY'] = OWPOLICY
 
     config['InfluxDB'] = {}
     config['InfluxDB']['HOST'] = IHOST
@@ -421,6 +466,12 @@
     config['InfluxDB']['FIELD'] = IFIELD
     config['InfluxDB']['TZ'] = ITZ
 
+    if not configloaded:
+        IBATCH = 100
+    else:
+        if IBATCH != 100:
+            config['InfluxDB']['BATCH'] = str(IBATCH)
+
     try:
         # Write config file
         with open(CONFIGFILE, 'w') as configfile:
@@ -447,8 +498,43 @@
 weatherdata = []
 weathergaps = None
 currdata = None
-halted = False
 finished = False
+calls = None
+requested = []
+schedule = None
+totalpoints = 0
+CALLSFILE = str(Path(CONFIGFILE).parent / f"{SCRIPTNAME}.calls")
+SCHEDULEFILE = str(Path(CONFIGFILE).parent / f"{SCRIPTNAME}.schedule")
+
+# Data point fields: (response section, response key, field key, value type) in Line Protocol field order
+FIELDMAP = (
+    ('raw', 'timezone_offset', 'tz', 'int'),
+    ('curr', 'id', 'id', 'int'),
+    ('curr', 'name', 'name', 'str'),
+    ('sys', 'country', 'country', 'str'),
+    ('data', 'dt', 'dt', 'int'),
+    ('data', 'temp', 'temperature', 'float'),
+    ('data', 'feels_like', 'feels_like', 'float'),
+    ('data', 'temp', 'temp_min', 'float'),
+    ('data', 'temp', 'temp_max', 'float'),
+    ('data', 'pressure', 'pressure', 'int'),
+    ('data', 'humidity', 'humidity', 'int'),
+    ('data', 'visibility', 'visibility', 'int'),
+    ('data', 'wind_speed', 'wind_speed', 'float'),
+    ('data', 'wind_deg', 'wind_deg', 'int'),
+    ('data', 'wind_gust', 'wind_gust', 'float'),
+    ('data', 'clouds', 'clouds', 'int'),
+    ('data', 'sunrise', 'sunrise', 'int'),
+    ('data', 'sunset', 'sunset', 'int'),
+    ('weather', 'id', 'weather_id', 'int'),
+    ('weather', 'main', 'weather_main', 'str'),
+    ('weather', 'description', 'weather_description', 'str'),
+    ('weather', 'icon', 'weather_icon', 'str'),
+    ('rain', '1h', 'rain_1h', 'float'),
+    ('rain', '3h', 'rain_3h', 'float'),
+    ('snow', '1h', 'snow_1h', 'float'),
+    ('snow', '3h', 'snow_3h', 'float'),
+)
 
 # Helper Functions
 def check_datetime(dt, name, newtz):
@@ -494,27 +580,23 @@ def lpr(value):
         rv = str(value)
     return rv
 
-def lprmap(data, key, value, valtype=None):
+def compile_fieldmap(fieldmap):
     """
-    Return mapped Line Protocol formatted key/value pair string, if value found in data
+    Precompile field map of (response section, response key, field key, value type) entries into
+    (section, response key, 'key=' prefix, Line Protocol formatter) entries for add_weather_point()
     """
-    if value in data:
-        if valtype == 'float':
-            v = float(data[value])
-        elif valtype == 'int':
-            v = int(data[value])
-        elif valtype == 'str':
-            v = str(data[value])
-        else:
-            v = data[value]
-        return f",{key}={lpr(v)}"
-    return ""
+    formatters = {
+        'int': lambda v: f"{int(v)}i",
+        'float': lambda v: str(float(v)),
+        'str': lambda v: lpr(str(v)),
+    }
+    return tuple((section, value, f"{key}=", formatters[valtype]) for section, value, key, valtype in fieldmap)
 
 def halt_get_weather():
     """
     Show program halted prompt, allowing user to resume, write current data, or abort
     """
-    global halted, finished
+    global finished
 
     if args.non_interactive:
         finished = True
@@ -528,7 +610,6 @@ def halt_get_weather():
             print()
         else:
             if response == "r":
-                halted = True
                 return
             elif response == "q":
                 finished = True
@@ -537,15 +618,19 @@ def halt_get_weather():
                 sys.exit()
 
 # OpenWeatherMap Functions
-def get_weather_history(start, end):
+def get_weather_history(times):
     """
-    Retrieve weather history data between start and end date/time
+    Retrieve weather history data for each date/time in 'times' (request schedule, see plan_requests())
+        * One Call API requests are sent concurrently (up to WORKERS at a time, and WORKERS * 2 queued),
+          and responses are processed in schedule order
+        * requests stop when the calls per day LIMIT is reached (see use_call())
 
-    Adds data points to 'weatherdata' in InfluxDB Line Protocol format with tag source='timemachine'
+    Adds data points to 'weatherdata' in InfluxDB Line Protocol format with tag source='timemachine',
+    and each date/time with a response to 'requested' (written to InfluxDB every BATCH data points)
     """
-    global currdata, halted, finished
+    global currdata, finished
 
-    print(f"Retrieving data for gap: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(end - start)}s)")
+    print(f"Retrieving data for {len(times)} intervals: [{min(times).astimezone(influxtz)}] - [{max(times).astimezone(influxtz)}]")
 
     if not currdata:
         # Retrieve current weather data via standard API call
@@ -562,90 +647,329 @@ def get_weather_history(start, end):
         except Exception as err:
             sys.exit(f"\nERROR: Failed to retrieve history data - {err}")
 
-    # Retrieve weather history data for each gap interval from start to end period
-    interval = timedelta(minutes=OWGAP)
-    halted = False
-    curr = start
-    while curr <= end:
-        print(f"* Loading data for time: [{curr.astimezone(influxtz)}]")
-        try:
-            url = f"{onecall}&dt={int(curr.timestamp())}"
-            response = session.get(url, timeout=TIMEOUT)
-            if response.status_code == 200:
-                raw = response.json()
-                if args.debug:
-                    print(f"Request: {url}")
-                    print(f"Replied: {response.json()}")
-
-                # Create data point field key/value pairs in Line Protocol format
-                fields = ""
-                fields += lprmap(raw, 'tz', 'timezone_offset', 'int')
-                fields += lprmap(currdata, 'id', 'id', 'int')
-                fields += lprmap(currdata, 'name', 'name', 'str')
-                if "sys" in currdata:
-                    fields += lprmap(currdata['sys'], 'country', 'country', 'str')
-                if "data" in raw and len(raw['data']) > 0:
-                    data = raw['data'][0]
-                    fields += lprmap(data, 'dt', 'dt', 'int')
-                    fields += lprmap(data, 'temperature', 'temp', 'float')
-                    fields += lprmap(data, 'feels_like', 'feels_like', 'float')
-                    fields += lprmap(data, 'temp_min', 'temp', 'float')
-                    fields += lprmap(data, 'temp_max', 'temp', 'float')
-                    fields += lprmap(data, 'pressure', 'pressure', 'int')
-                    fields += lprmap(data, 'humidity', 'humidity', 'int')
-                    fields += lprmap(data, 'visibility', 'visibility', 'int')
-                    fields += lprmap(data, 'wind_speed', 'wind_speed', 'float')
-                    fields += lprmap(data, 'wind_deg', 'wind_deg', 'int')
-                    fields += lprmap(data, 'wind_gust', 'wind_gust', 'float')
-                    fields += lprmap(data, 'clouds', 'clouds', 'int')
-                    fields += lprmap(data, 'sunrise', 'sunrise', 'int')
-                    fields += lprmap(data, 'sunset', 'sunset', 'int')
-                    if "weather" in data and len(data['weather']) > 0:
-                        fields += lprmap(data['weather'][0], 'weather_id', 'id', 'int')
-                        fields += lprmap(data['weather'][0], 'weather_main', 'main', 'str')
-                        fields += lprmap(data['weather'][0], 'weather_description', 'description', 'str')
-                        fields += lprmap(data['weather'][0], 'weather_icon', 'icon', 'str')
-                    if "rain" in data:
-                        fields += lprmap(data['rain'], 'rain_1h', '1h', 'float')
-                        fields += lprmap(data['rain'], 'rain_3h', '3h', 'float')
-                    if "snow" in data:
-                        fields += lprmap(data['snow'], 'snow_1h', '1h', 'float')
-                        fields += lprmap(data['snow'], 'snow_3h', '3h', 'float')
-                else:
-                    # No valid data - increment time to next interval and continue
-                    curr += interval
+    # Retrieve weather history data for each interval of the request schedule
+    i = 0
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=OWWORKERS)
+    try:
+        while True:
+            try:
+                # Queue requests ahead of the interval being processed
+                while not finished and i < len(times) and len(pending) < OWWORKERS * 2:
+                    if not use_call():
+                        finished = True
+                        break
+                    pending.append((times[i], executor.submit(get_onecall, times[i])))
+                    i += 1
+
+                if not pending:
+                    return
+                if finished:
+                    # Keep responses of requests already sent, without waiting for queued requests
+                    timestamp, future = pending.popleft()
+                    if future.cancel():
+                        release_call()
+                    else:
+                        try:
+                            response = future.result()
+                            if response.status_code == 200:
+                                store_weather_point(timestamp, response.json())
+                        except Exception:
+                            pass
                     continue
 
-                # Save data point values
-                point = f"{IFIELD},source=timemachine {fields[1:]} {int(curr.timestamp())}"
-                weatherdata.append(point)
-                if args.debug:
-                    print(f"Datapnt: {point}")
-
-            elif response.status_code == 429:
-                print("\nCalls per day limit reached - continue tomorrow or edit your limits at: https://home.openweathermap.org/subscriptions")
-                finished = True
-                return
-            else:
-                print(f"\nERROR: Bad response from OpenWeatherMap for {url} - {response.reason}: {response.text}")
+                timestamp, future = pending[0]
+                print(f"* Loading data for time: [{timestamp.astimezone(influxtz)}]")
+                try:
+                    response = future.result()
+                    if response.status_code == 200:
+                        raw = response.json()
+                        if args.debug:
+                            print(f"Request: {onecall}&dt={int(timestamp.timestamp())}")
+                            print(f"Replied: {raw}")
+                        pending.popleft()
+                        store_weather_point(timestamp, raw)
+                    elif response.status_code == 429:
+                        print("\nCalls per day limit reached - continue tomorrow or edit your limits at: https://home.openweathermap.org/subscriptions")
+                        finished = True
+                        pending.popleft()
+                    else:
+                        print(f"\nERROR: Bad response from OpenWeatherMap for {response.url} - {response.reason}: {response.text}")
+                        retry_interval(pending, executor)
+                except KeyboardInterrupt:
+                    raise
+                except Exception as err:
+                    print(f"\nERROR: Failed to retrieve history data - {err}")
+                    retry_interval(pending, executor)
+            except KeyboardInterrupt:
                 halt_get_weather()
-                if finished:
-                    return
-        except KeyboardInterrupt:
-            halt_get_weather()
-            if finished:
-                return
-        except Exception as err:
-            print(f"\nERROR: Failed to retrieve history data - {err}")
-            halt_get_weather()
-            if finished:
-                return
+    finally:
+        # Cancel queued requests (e.g. if aborted) - requests not sent are not counted
+        for timestamp, future in pending:
+            if future.cancel():
+                release_call()
+        executor.shutdown()
+        save_calls()
+
+def get_onecall(timestamp):
+    """
+    Send One Call API request for weather data at timestamp (called from worker threads)
+
+    Returns response
+    """
+    return session.get(f"{onecall}&dt={int(timestamp.timestamp())}", timeout=TIMEOUT)
+
+def retry_interval(pending, executor):
+    """
+    Show program halted prompt after a failed request, and send the request again if resumed
+    """
+    global finished
+
+    halt_get_weather()
+    if finished:
+        pending.popleft()
+    elif use_call():
+        timestamp = pending.popleft()[0]
+        pending.appendleft((timestamp, executor.submit(get_onecall, timestamp)))
+    else:
+        finished = True
+        pending.popleft()
+
+def use_call():
+    """
+    Count a One Call API request against the calls per day LIMIT (calls are counted per UTC day,
+    and saved by save_calls() so the count includes previous runs on the same day)
+
+    Returns False if the limit has been reached
+    """
+    global calls
+
+    today = datetime.now(tz=utctz).strftime('%Y-%m-%d')
+    if calls is None or calls['date'] != today:
+        calls = load_calls(today)
+    if OWLIMIT > 0 and calls['count'] >= OWLIMIT:
+        print(f"\nCalls per day limit ({OWLIMIT}) reached - continue tomorrow (UTC) or change LIMIT in '{CONFIGNAME}'")
+        return False
+    calls['count'] += 1
+    return True
+
+def release_call():
+    """
+    Remove a One Call API request that was counted but cancelled before it was sent from the calls per day count
+    """
+    calls['count'] -= 1
+
+def save_calls():
+    """
+    Save One Call API requests made today (UTC) to the calls file (after each batch and when requests stop)
+    """
+    if calls is None:
+        return
+    try:
+        with open(CALLSFILE, 'w') as f:
+            json.dump(calls, f)
+    except Exception as err:
+        if args.debug:
+            print(f"Failed to save calls per day count '{CALLSFILE}' - {err}")
+
+def load_calls(today):
+    """
+    Load One Call API requests made today (UTC) from the calls file
+
+    Returns dict of date and count
+    """
+    try:
+        with open(CALLSFILE, 'r') as f:
+            data = json.load(f)
+        if data['date'] == today:
+            return {'date': today, 'count': int(data['count'])}
+    except FileNotFoundError:
+        pass
+    except Exception as err:
+        if args.debug:
+            print(f"Ignoring invalid calls per day count '{CALLSFILE}' - {err}")
+    return {'date': today, 'count': 0}
+
+# Precompiled data point field map for add_weather_point()
+lpfields = compile_fieldmap(FIELDMAP)
 
-        if not halted:
-            # Increment time to next interval
+def add_weather_point(timestamp, raw):
+    """
+    Add data point to 'weatherdata' for One Call API response 'raw' at timestamp (if response has valid data)
+    """
+    if not raw.get('data'):
+        # No valid data
+        return
+    data = raw['data'][0]
+    sections = {
+        'raw': raw,
+        'curr': currdata,
+        'sys': currdata.get('sys') or {},
+        'data': data,
+        'weather': data['weather'][0] if data.get('weather') else {},
+        'rain': data.get('rain') or {},
+        'snow': data.get('snow') or {},
+    }
+
+    # Create data point field key/value pairs in Line Protocol format
+    fields = ",".join(key + fmt(sections[section][value]) for section, value, key, fmt in lpfields if value in sections[section])
+    if not fields:
+        return
+
+    # Save data point values
+    point = f"{IFIELD},source=timemachine {fields} {int(timestamp.timestamp())}"
+    weatherdata.append(point)
+    if args.debug:
+        print(f"Datapnt: {point}")
+
+def store_weather_point(timestamp, raw):
+    """
+    Add data point for One Call API response 'raw' at timestamp, and flush data points to InfluxDB
+    once BATCH data points have been added
+    """
+    add_weather_point(timestamp, raw)
+    requested.append(timestamp)
+    if len(weatherdata) >= IBATCH:
+        flush_influx()
+
+# Request Schedule Functions
+def plan_requests(gaps, policy):
+    """
+    Create request schedule for data gaps, in priority order of policy:
+        * time      = oldest first
+        * daytime   = daytime hours first (06:00 to 18:00 InfluxDB timezone), then night hours, oldest first
+        * largest   = largest gaps first, oldest first within each gap
+        * coarse    = sample every gap at 8x the interval first, then 4x and 2x, then fill remaining intervals
+                      (when calls run out, data gaps are left at a lower resolution rather than unfilled)
+
+    Returns list of date/times to request
+    """
+    interval = timedelta(minutes=OWGAP)
+    gaptimes = []
+    for period in gaps:
+        times = []
+        curr = period['start']
+        while curr <= period['end']:
+            times.append(curr)
             curr += interval
+        gaptimes.append(times)
+
+    if policy == 'largest':
+        gaptimes.sort(key=len, reverse=True)
+    elif policy == 'coarse':
+        plan = []
+        for step in (8, 4, 2, 1):
+            for times in gaptimes:
+                plan.extend(t for i, t in enumerate(times) if i % step == 0 and (step == 8 or i % (step * 2) != 0))
+        return plan
+
+    plan = [t for times in gaptimes for t in times]
+    if policy == 'daytime':
+        plan.sort(key=lambda t: not 6 <= t.astimezone(influxtz).hour < 18)
+    return plan
+
+def find_gaps(start, end):
+    """
+    Search InfluxDB for weather data gaps between start and end date/time (or entire range if --force)
+
+    Returns a list of start/end datetime ranges
+    """
+    if args.force:
+        # Treat the entire range as a single gap (skip search for gaps)
+        print(f"Forced range: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(end - start)}s)\n")
+        return [{'start': start, 'end': end}]
+
+    gaps = search_influx(start, end)
+    print() if gaps else print("* None found\n")
+    return gaps
+
+def get_schedule(start, end, policy):
+    """
+    Load request schedule saved by a previous run for the same start/end range, interval, policy and location,
+    or create a new schedule from the data gaps found in InfluxDB (or entire range if --force)
+        * the saved schedule is matched on the start/end range given on the command line ('reqstart'/'reqend'),
+          as 'end' is limited to the current time less the gap interval
+        * a saved schedule is extended with the data gaps since it was last planned (e.g. --today), and
+          date/times after 'end' are left for a later run
+
+    Returns list of date/times still to request, and schedule
+    """
+    try:
+        with open(SCHEDULEFILE, 'r') as f:
+            data = json.load(f)
+        if (data['start'], data['end'], data['gap'], data['policy'], data['lat'], data['lon']) == (reqstart.isoformat(), reqend.isoformat(), OWGAP, policy, OWLAT, OWLON):
+            done = set(data['done'])
+            print(f"Resuming saved request schedule ({policy} first): {len(done)} of {len(data['requests'])} One Call API calls done\n")
+            until = isoparse(data.get('until', data['end']))
+            if end > until:
+                # Add requests for data gaps after the range planned by the previous run
+                gaps = find_gaps(until, end)
+                scheduled = set(data['requests'])
+                data['requests'].extend(t for t in (int(t.timestamp()) for t in plan_requests(gaps, policy))
+                    if t > int(until.timestamp()) and t not in scheduled)
+                data['gaps'] = data.get('gaps', 0) + len(gaps)
+                data['until'] = end.isoformat()
+            times = [datetime.fromtimestamp(t, tz=utctz) for t in data['requests'] if t not in done and t <= end.timestamp()]
+            return times, data
+    except FileNotFoundError:
+        pass
+    except Exception as err:
+        print(f"Ignoring invalid request schedule '{SCHEDULEFILE}' - {err}\n")
+
+    gaps = find_gaps(start, end)
+    times = plan_requests(gaps, policy)
+    data = {
+        'start': reqstart.isoformat(), 'end': reqend.isoformat(), 'until': end.isoformat(), 'gap': OWGAP, 'policy': policy,
+        'lat': OWLAT, 'lon': OWLON, 'gaps': len(gaps), 'requests': [int(t.timestamp()) for t in times], 'done': [],
+    }
+    return times, data
+
+def save_schedule():
+    """
+    Save request schedule with the date/times written to InfluxDB so far (removed when complete)
+
+    Returns number of calls still to request
+    """
+    schedule['done'].extend(int(t.timestamp()) for t in requested)
+    requested.clear()
+    remaining = len(set(schedule['requests']) - set(schedule['done']))
+    try:
+        if remaining == 0:
+            if os.path.exists(SCHEDULEFILE):
+                os.remove(SCHEDULEFILE)
         else:
-            halted = False
+            tmpfile = f"{SCHEDULEFILE}.tmp"
+            with open(tmpfile, 'w') as f:
+                json.dump(schedule, f)
+            os.replace(tmpfile, SCHEDULEFILE)
+    except Exception as err:
+        print(f"ERROR: Failed to save request schedule '{SCHEDULEFILE}' - {err}")
+    return remaining
+
+def print_schedule(times, policy):
+    """
+    Print request schedule by day, based on the calls per day LIMIT and calls remaining today (UTC)
+    """
+    print(f"Request schedule ({policy} first): {len(times)} One Call API calls")
+    if OWLIMIT <= 0:
+        print("* No calls per day limit - all calls in a single run")
+        return
+
+    today = datetime.now(tz=utctz)
+    available = max(0, OWLIMIT - load_calls(today.strftime('%Y-%m-%d'))['count'])
+    scheduled = 0
+    day = 0
+    while scheduled < len(times):
+        count = min(len(times) - scheduled, available)
+        if count > 0 and day < 10:
+            batch = times[scheduled:scheduled + count]
+            print(f"* Day {day + 1} ({(today + timedelta(days=day)).strftime('%Y-%m-%d')} UTC): {count} calls"
+                f" - [{min(batch).astimezone(influxtz)}] to [{max(batch).astimezone(influxtz)}]")
+        scheduled += count
+        available = OWLIMIT
+        day += 1
+    if day > 10:
+        print(f"* ... {day} days in total")
 
 # InfluxDB Functions
 def search_influx(start, end):
@@ -775,15 +1099,34 @@ def write_influx():
     Write 'weatherdata' Line Protocol format data points to InfluxDB
     """
     if args.test:
-        print("Writing to InfluxDB (*** skipped - test mode enabled ***)")
+        print(f"Writing {len(weatherdata)} data points to InfluxDB (*** skipped - test mode enabled ***)")
         return
 
-    print("Writing to InfluxDB")
+    print(f"Writing {len(weatherdata)} data points to InfluxDB")
     try:
         client.write_points(weatherdata, time_precision='s', batch_size=10000, protocol='line')
     except Exception as err:
         sys.exit(f"ERROR: Failed to write to InfluxDB: {err}")
 
+def flush_influx():
+    """
+    Write and clear 'weatherdata' data points, then save progress of the request schedule
+    (an interrupted run will only need to request the data points not yet written again)
+
+    Returns number of calls still to request (None if test mode enabled)
+    """
+    global totalpoints
+
+    save_calls()
+    if weatherdata:
+        write_influx()
+        totalpoints += len(weatherdata)
+        weatherdata.clear()
+
+    if args.test:
+        return None
+    return save_schedule()
+
 # MAIN
 if args.start and args.end:
     try:
@@ -823,6 +1166,9 @@ def write_influx():
 
 print(f"Running for period: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(end - start)}s)\n")
 
+# Requested range identifies a saved request schedule (end is limited below)
+reqstart, reqend = start, end
+
 # Limit end to current time less gap interval
 currtime = datetime.now(tz=influxtz).astimezone(utctz).replace(microsecond=0)
 if end > currtime - timedelta(minutes=OWGAP):
@@ -842,72 +1188,59 @@ def write_influx():
     print("Done.")
     sys.exit()
 
+policy = args.policy or OWPOLICY
+
 if args.dry_run:
     # Dry-run mode: identify data gaps and count required API calls without making any requests
-    if args.force:
-        # When --force is used, treat the entire range as a single gap
-        weathergaps = [{'start': start, 'end': end}]
-        print(f"Forced range: [{start.astimezone(influxtz)}] - [{end.astimezone(influxtz)}] ({str(end - start)}s)\n")
-    else:
-        # Search InfluxDB for weather data gaps
-        weathergaps = search_influx(start, end)
-        print() if weathergaps else print("* None found\n")
+    times, schedule = get_schedule(start, end, policy)
 
-    if not weathergaps:
+    if not times:
         print("Done.")
         sys.exit()
 
-    # Count the number of API calls that would be required
-    total_calls = 0
-    interval = timedelta(minutes=OWGAP)
-    for period in weathergaps:
-        period_calls = 0
-        curr = period['start']
-        while curr <= period['end']:
-            period_calls += 1
-            curr += interval
-        total_calls += period_calls
-
     print("Standard API calls required: 1")
-    print(f"One Call API calls required: {total_calls}")
-    print(f"Data gaps found: {len(weathergaps)}")
-    if total_calls > 1000:
+    print(f"One Call API calls required: {len(times)}")
+    if 'gaps' in schedule:
+        print(f"Data gaps found: {schedule['gaps']}")
+    if OWLIMIT > 0:
+        today = datetime.now(tz=utctz).strftime('%Y-%m-%d')
+        remaining = max(0, OWLIMIT - load_calls(today)['count'])
+        print(f"Calls per day limit: {OWLIMIT} ({remaining} remaining today, UTC)")
+    if len(times) > 1000:
         print(f"Note: This exceeds the free 'One Call API' tier limit of 1,000 calls/day. "
               f"See https://home.openweathermap.org/subscriptions to manage your limits.")
+    print()
+    print_schedule(times, policy)
     print("\nDone.")
     sys.exit()
 
 # Create session object for http connection re-use
 session = requests.Session()
-adapter = requests.adapters.HTTPAdapter(max_retries=Retry(total=5, status_forcelist=(500, 502, 503, 504), backoff_factor=1))
+adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(10, OWWORKERS), max_retries=Retry(total=5, status_forcelist=(500, 502, 503, 504), backoff_factor=1))
 session.mount('https://', adapter)
 if TIMEOUT < 1:
     TIMEOUT = None
 
-if args.force:
-    # Retrieve history data between start and end date/time (skip search for gaps)
-    get_weather_history(start, end)
-    print()
-else:
-    # Search InfluxDB for weather data gaps
-    weathergaps = search_influx(start, end)
-    print() if weathergaps else print("* None found\n")
+# Get request schedule (saved schedule of a previous run, or data gaps found in InfluxDB)
+times, schedule = get_schedule(start, end, policy)
 
-    if not weathergaps:
-        print("Done.")
-        sys.exit()
+if not times:
+    print("Done.")
+    sys.exit()
 
-    if weathergaps:
-        # Retrieve weather history data for each gap period
-        for period in weathergaps:
-            get_weather_history(period['start'], period['end'])
-            if finished:
-                break
-        print()
+print_schedule(times, policy)
+print()
+
+# Retrieve weather history data in schedule order (written to InfluxDB every BATCH data points)
+get_weather_history(times)
+print()
+
+# Write remaining data points to InfluxDB and save progress of the request schedule
+remaining = flush_influx()
+if remaining:
+    print(f"Request schedule: {remaining} One Call API calls remaining - run the same command again to continue")
 
-if not weatherdata:
+if not totalpoints:
     sys.exit("ERROR: No data returned for this date/time range")
 
-# Write data points to InfluxDB
-write_influx()
 print("Done.")
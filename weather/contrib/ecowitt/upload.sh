@@ -1,5 +1,6 @@
 #!/bin/bash
 CONTAINER="${PWD##*/}"
+# Build context is weather/ to include the shared weathercore.py
 echo "Build and Push jasonacox/${CONTAINER} to DockerHub"
 echo ""
 
@@ -9,12 +10,12 @@ echo "Version: ${VER}"
 
 # Build jasonacox/CONTAINER:x.y.z
 echo "* BUILD jasonacox/${CONTAINER}:${VER}"
-docker buildx build --platform linux/amd64,linux/arm64,linux/arm/v7 --push -t jasonacox/${CONTAINER}:${VER} .
+docker buildx build --platform linux/amd64,linux/arm64,linux/arm/v7 --push -t jasonacox/${CONTAINER}:${VER} -f Dockerfile ../..
 echo ""
 
 # Build jasonacox/CONTAINER:latest
 echo "* BUILD jasonacox/${CONTAINER}:latest"
-docker buildx build --platform linux/amd64,linux/arm64,linux/arm/v7 --push -t jasonacox/${CONTAINER}:latest .
+docker buildx build --platform linux/amd64,linux/arm64,linux/arm/v7 --push -t jasonacox/${CONTAINER}:latest -f Dockerfile ../..
 echo ""
 
 # Verify
@@ -0,0 +1,1613 @@
+#!/usr/bin/env python
+# Weather Server Core - Shared engine for Weather411 and LocalWeather
+# -*- coding: utf-8 -*-
+"""
+ Python module with the shared engine of the weather servers
+
+ Author: Jason A. Cox
+ For more information see https://github.com/jasonacox/Powerwall-Dashboard
+
+ Weather Server Core
+    Weather411 (weather/server.py) and the Ecowitt LocalWeather server
+    (weather/contrib/ecowitt/server.py) are entry points that call run()
+    with their name, version and config file.  This module provides:
+
+        * Provider plugins - OpenWeatherMap and Ecowitt classes that read
+          their config section, build the request URL, parse the payload
+          and define the API routes for their data
+        * One fetch scheduler thread and pooled session for every source
+          (location or station) of all providers
+        * One InfluxDB writer thread with batching, retries and disk spool
+        * One API server with pre-encoded snapshot responses, ETag caching,
+          /history, /stats and /metrics
+
+    A provider is enabled when its section is in the config file, so a
+    config with both [OpenWeatherMap] and [Ecowitt] sections runs both
+    providers in a single process.  The first source of the provider of
+    the entry point is served on the plain paths (e.g. /temp), all other
+    sources by adding their name to the path (e.g. /temp/localweather).
+
+    Config sections shared by all providers:
+
+        [<Server>]          (e.g. [Weather411] or [LocalWeather])
+        DEBUG = no
+
+        [API]
+        ENABLE = yes
+        PORT = 8676
+        WORKERS = 8
+        HISTORY = 288
+
+        [InfluxDB]
+        ENABLE = yes
+        HOST = influxdb
+        PORT = 8086
+        DB = powerwall
+        FIELD = weather
+        USERNAME =
+        PASSWORD =
+        TOKEN =
+        ORG =
+        URL =
+        BATCH = 10
+        FLUSH = 5
+        QUEUE = 1000
+        SPOOL = spool
+        SPOOLSIZE = 10
+
+"""
+# Modules
+from __future__ import print_function
+import threading
+import queue
+import time
+import logging
+import json
+import requests
+from email.utils import formatdate, parsedate_to_datetime
+import resource
+from bisect import bisect_left
+from array import array
+from urllib.parse import urlsplit, parse_qs
+from datetime import datetime, timezone
+import signal
+import sys
+import os
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import configparser
+import re
+from influxdb_client import InfluxDBClient, Point, WritePrecision
+from influxdb_client.client.write_api import SYNCHRONOUS
+
+# Signal handler - Exit on SIGTERM
+def sigTermHandler(signum, frame):
+    raise SystemExit
+
+# Logging
+log = logging.getLogger(__name__)
+
+# Global Stats - counters are updated by the fetch, writer and API worker threads without a lock,
+# so an increment may occasionally be lost under concurrent requests.  That is acceptable for these
+# informational counts (latency histograms for /metrics are kept per thread, see Histogram).
+serverstats = {}
+
+# Global Variables (set by run())
+APPNAME = None
+BUILD = None
+CONFIGFILE = None
+DEBUGMODE = False
+SOURCES = []
+PUSHROUTES = {}
+PUSHMAXSIZE = 16384     # max upload size in bytes (a gateway upload is under a few KB)
+running = True
+fetchwake = threading.Event()
+publishlock = threading.Lock()
+apiserver = None
+snapshot = {}
+upstreamcodes = {}
+influxqueue = None
+influxclient = None
+influxwriteapi = None
+spoolfile = None
+spoolseq = 0
+
+# Helper Functions
+def lookup(source, index, valtype='string'):
+    # check source dict to see if index key exists
+    if index in source:
+        if valtype == 'float':
+            return float(source[index])
+        if valtype == 'int':
+            return int(source[index])
+        return str(source[index])
+    return None
+
+def getvalue(source, index, valtype):
+    # check source dict to see if value key exists under index key
+    if index in source:
+        if "value" in source[index]:
+            return lookup(source[index], "value", valtype)
+    return None
+
+def halt(message):
+    # display error and wait for exit - container would otherwise restart in a loop
+    sys.stderr.write("%s Server %s\nERROR: %s Fix and restart.\n" % (APPNAME, BUILD, message))
+    sys.stderr.flush()
+    while(True):
+        try:
+            time.sleep(3600)
+        except (KeyboardInterrupt, SystemExit):
+            sys.exit()
+
+# Providers
+class Provider(object):
+    """
+    Weather data provider plugin
+
+    Subclasses read their config section and define the weather fields, the
+    numeric fields kept for /history and the API routes for their data.
+    Each provider has one or more sources (dicts with name, url, wait,
+    timeout, measurement, tag and info) that are fetched by the scheduler.
+    """
+    name = None
+    FIELDS = {}
+    HISTORY = []
+    # learn the upstream update cadence from 'dt' (see fetchSource())
+    adaptive = False
+
+    def __init__(self, config, primary, ifield):
+        self.config = config
+        self.primary = primary
+        self.ifield = ifield
+
+    def measurement(self, default):
+        # measurement of the entry point provider is [InfluxDB] FIELD
+        return self.config.get(self.name, 'FIELD', fallback=self.ifield if self.primary else default)
+
+    def clear(self):
+        # return empty weather data
+        return dict(self.FIELDS)
+
+    def requesturl(self, source):
+        # URL to fetch, including credentials (source "url" is safe to display)
+        return source["url"]
+
+    def parse(self, raw):
+        # return weather data from a payload
+        raise NotImplementedError
+
+    def decode(self, fields):
+        # return weather data from pushed form fields (push providers only)
+        raise NotImplementedError
+
+    def routes(self, data):
+        # return list of (paths, result) API responses for weather data
+        raise NotImplementedError
+
+    def describe(self):
+        # return startup summary lines
+        return []
+
+class OpenWeatherMap(Provider):
+    """
+    OpenWeatherMap current weather - https://openweathermap.org/current
+
+        [OpenWeatherMap]
+        APIKEY = xxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+        LAT = xx.xxxx
+        LON = xx.xxxx
+        WAIT = 10
+        TIMEOUT = 10
+        UNITS = metric
+
+        # Optional - Additional locations, one section per location
+        [Location:beach]
+        LAT = xx.xxxx
+        LON = xx.xxxx
+    """
+    name = "OpenWeatherMap"
+    URL = "https://api.openweathermap.org/data/2.5/weather"
+    FIELDS = {
+        # header
+        "dt": 0, "name": None, "country": None, "id": None,
+        # basics
+        "temperature": None, "humidity": None, "pressure": None,
+        "temp_min": None, "temp_max": None, "feels_like": None,
+        "clouds": None, "visibility": None,
+        # wind
+        "wind_speed": None, "wind_deg": None, "wind_gust": None,
+        # conditions
+        "weather_id": None, "weather_main": None,
+        "weather_description": None, "weather_icon": None,
+        # precipitation
+        "rain_1h": 0.0, "rain_3h": 0.0, "snow_1h": 0.0, "snow_3h": 0.0,
+        # time
+        "sunrise": None, "sunset": None, "tz": None,
+        }
+    HISTORY = ["temperature", "feels_like", "temp_min", "temp_max", "humidity",
+        "pressure", "clouds", "visibility", "wind_speed", "wind_deg", "wind_gust",
+        "rain_1h", "rain_3h", "snow_1h", "snow_3h"]
+    adaptive = True
+
+    def __init__(self, config, primary, ifield):
+        Provider.__init__(self, config, primary, ifield)
+        self.key = config["OpenWeatherMap"]["APIKEY"]
+        self.wait = int(config["OpenWeatherMap"]["WAIT"])
+        self.units = config["OpenWeatherMap"]["UNITS"]
+        self.lat = config.get('OpenWeatherMap', 'LAT', fallback="")
+        self.lon = config.get('OpenWeatherMap', 'LON', fallback="")
+        self.timeout = int(config["OpenWeatherMap"]["TIMEOUT"])
+        self.field = self.measurement("weather")
+
+    def sources(self):
+        # [OpenWeatherMap] location is the default, plus [Location:<name>] sections
+        locations = []
+        if self.lat != "" and self.lon != "":
+            locations.append({"name": "default", "lat": self.lat, "lon": self.lon,
+                "units": self.units, "tag": False})
+        for section in self.config.sections():
+            if section.startswith("Location:"):
+                name = section.split(":", 1)[1].strip()
+                if not re.match(r'^[A-Za-z0-9_.-]+$', name) or name in [l["name"] for l in locations]:
+                    sys.stderr.write("ERROR: Invalid or duplicate location name [%s] - skipped\n" % section)
+                    continue
+                locations.append({"name": name, "lat": self.config.get(section, 'LAT'),
+                    "lon": self.config.get(section, 'LON'),
+                    "units": self.config.get(section, 'UNITS', fallback=self.units), "tag": True})
+        for loc in locations:
+            loc["info"] = {"name": loc["name"], "lat": loc["lat"], "lon": loc["lon"], "units": loc["units"]}
+            loc["url"] = self.URL + "?lat=" + loc["lat"] + "&lon=" + loc["lon"] + "&units=" + loc["units"]
+            loc["wait"] = self.wait
+            loc["timeout"] = self.timeout
+            loc["measurement"] = self.field
+        return locations
+
+    def requesturl(self, source):
+        return source["url"] + "&appid=" + self.key
+
+    def parse(self, raw):
+        weather = self.clear()
+        try:
+            weather["dt"] = raw['dt']
+            if "main" in raw:
+                data = raw["main"]
+                weather["temperature"] = lookup(data, 'temp', 'float')
+                weather["feels_like"] = lookup(data, 'feels_like', 'float')
+                weather["temp_min"] = lookup(data, 'temp_min', 'float')
+                weather["temp_max"] = lookup(data, 'temp_max', 'float')
+                weather["pressure"] = lookup(data, 'pressure', 'int')
+                weather["humidity"] = lookup(data, 'humidity', 'int')
+            weather["visibility"] = lookup(raw, 'visibility', 'int')
+            if "wind" in raw:
+                data = raw["wind"]
+                weather["wind_speed"] = lookup(data, 'speed', 'float')
+                weather["wind_deg"] = lookup(data, 'deg', 'int')
+                weather["wind_gust"] = lookup(data, 'gust', 'float')
+            if "clouds" in raw:
+                weather["clouds"] = lookup(raw["clouds"], 'all', 'int')
+            if "sys" in raw:
+                data = raw["sys"]
+                weather["country"] = lookup(data, 'country')
+                weather["sunrise"] = lookup(data, 'sunrise', 'int')
+                weather["sunset"] = lookup(data, 'sunset', 'int')
+            if "weather" in raw and len(raw["weather"]) > 0:
+                weather["weather_id"] = lookup(raw["weather"][0], 'id', 'int')
+                weather["weather_main"] = lookup(raw["weather"][0], 'main')
+                weather["weather_description"] = lookup(raw["weather"][0], 'description')
+                weather["weather_icon"] = lookup(raw["weather"][0], 'icon')
+            weather["tz"] = lookup(raw, 'timezone', 'int')
+            weather["id"] = lookup(raw, 'id', 'int')
+            weather["name"] = lookup(raw, 'name')
+            if "rain" in raw:
+                weather["rain_1h"] = lookup(raw['rain'], '1h', 'float')
+                weather["rain_3h"] = lookup(raw['rain'], '3h', 'float')
+            if "snow" in raw:
+                weather["snow_1h"] = lookup(raw['snow'], '1h', 'float')
+                weather["snow_3h"] = lookup(raw['snow'], '3h', 'float')
+        except:
+            log.debug("Data error in payload from OpenWeatherMap")
+            pass
+        return weather
+
+    def routes(self, data):
+        routes = [(['/json', '/all'], data), (['/temp'], {"temperature": data["temperature"]})]
+        for i in ["temperature","humidity","pressure","visibility",
+                  "clouds","sunrise","sunset","feels_like"]:
+            routes.append((['/' + i], {i: data[i]}))
+        routes.append((['/wind'], {"wind_speed": data['wind_speed'], "wind_deg": data['wind_deg'],
+            "wind_gust": data['wind_gust']}))
+        routes.append((['/rain', '/snow', '/precipitation'], {"rain_1h": data['rain_1h'],
+            "rain_3h": data['rain_3h'], "snow_1h": data['snow_1h'], "snow_3h": data['snow_3h']}))
+        routes.append((['/conditions', '/weather'], {"conditions": data['weather_main'],
+            "weather_description": data['weather_description'], "weather_icon": data['weather_icon']}))
+        return routes
+
+    def describe(self):
+        return [" + OpenWeatherMap - Key: %s, Wait: %s, Units: %s, Timeout: %s, Field: %s\n"
+            % (self.key, self.wait, self.units, self.timeout, self.field)]
+
+class Ecowitt(Provider):
+    """
+    Ecowitt API real time weather station data - http://doc.ecowitt.net/web/#/apiv3en?page_id=17
+
+        [Ecowitt]
+        APIKEY = xxxxxxxxxxxxxxxxxxxxxxxxxxxxx
+        APPLICATION_KEY = xxxxxxxxxxxxxxxxxxxxxxxxxxxx
+        MAC = xx:xx:xx:xx:xx:xx
+        WAIT = 1
+        TIMEOUT = 10
+        UNITS = metric
+        # Optional - Source name when not the entry point provider (default localweather)
+        NAME = localweather
+        # Optional - poll the Ecowitt API or receive uploads from the gateway (push)
+        MODE = poll
+        # Optional - push mode path and PASSKEY (or Wunderground ID) to accept
+        PATH = /data/report
+        PASSKEY =
+
+    In push mode the gateway "Customized" upload (Weather Services in the
+    WS View app) is pointed at the API port and PATH.  The Ecowitt protocol
+    POSTs form fields and the Wunderground protocol sends them as a GET
+    query string.  Uploads are always in imperial units and are converted
+    when UNITS is metric.
+    """
+    name = "Ecowitt"
+    URL = "https://api.ecowitt.net/api/v3/device/real_time"
+    FIELDS = {
+        # header
+        "dt": 0,
+        # basics
+        "temperature": None, "feels_like": None, "app_temp": None, "dew_point": None, "humidity": None,
+        # indoor
+        "inside_temp": None, "inside_humidity": None,
+        # solar_and_uvi
+        "solar": 0.0, "uvi": 0,
+        # precipitation
+        "rain_1h": 0.0, "rain_24h": 0.0,
+        # wind
+        "wind_speed": None, "wind_deg": None, "wind_gust": None,
+        # pressure
+        "pressure": None,
+        # AQI
+        "co2": None, "pm25": None, "pm25aqi": None, "pm10": None, "pm10aqi": None,
+        }
+    # Push upload fields - weather key, upload keys (Ecowitt, Wunderground), conversion
+    PUSHFIELDS = [
+        ("temperature", ["tempf"], "temp"),
+        ("feels_like", ["feelslikef"], "temp"),
+        ("dew_point", ["dewptf"], "temp"),
+        ("humidity", ["humidity"], "float"),
+        ("inside_temp", ["tempinf", "indoortempf"], "temp"),
+        ("inside_humidity", ["humidityin", "indoorhumidity"], "float"),
+        ("solar", ["solarradiation"], "float"),
+        ("uvi", ["uv", "UV"], "int"),
+        ("rain_1h", ["hourlyrainin", "rainin"], "rain"),
+        ("rain_24h", ["dailyrainin"], "rain"),
+        ("wind_speed", ["windspeedmph"], "speed"),
+        ("wind_deg", ["winddir"], "int"),
+        ("wind_gust", ["windgustmph"], "speed"),
+        ("pressure", ["baromabsin", "absbaromin", "baromin"], "pressure"),
+        ("co2", ["co2"], "int"),
+        ("pm25", ["pm25_co2", "pm25_ch1", "AqPM2.5"], "int"),
+        ("pm10", ["pm10_co2", "AqPM10"], "int"),
+        ]
+    # Imperial to metric conversions (units of the Ecowitt API metric request)
+    METRIC = {
+        "temp": lambda f: round((f - 32) * 5 / 9, 1),
+        "rain": lambda inch: round(inch * 25.4, 1),
+        "speed": lambda mph: round(mph * 1.609344, 1),
+        "pressure": lambda inhg: round(inhg * 33.8639, 1),
+        }
+    HISTORY = ["temperature", "feels_like", "app_temp", "dew_point", "humidity",
+        "inside_temp", "inside_humidity", "solar", "uvi", "rain_1h", "rain_24h",
+        "wind_speed", "wind_deg", "wind_gust", "pressure", "co2", "pm25", "pm10"]
+
+    def __init__(self, config, primary, ifield):
+        Provider.__init__(self, config, primary, ifield)
+        # API keys and MAC are only needed to poll the Ecowitt API
+        self.key = config.get('Ecowitt', 'APIKEY', fallback="")
+        self.app = config.get('Ecowitt', 'APPLICATION_KEY', fallback="")
+        self.wait = config.getint('Ecowitt', 'WAIT', fallback=1)
+        self.units = config.get('Ecowitt', 'UNITS', fallback="metric")
+        self.mac = config.get('Ecowitt', 'MAC', fallback="")
+        self.timeout = config.getint('Ecowitt', 'TIMEOUT', fallback=10)
+        self.sourcename = config.get('Ecowitt', 'NAME', fallback="localweather")
+        self.field = self.measurement("localweather")
+        self.push = config.get('Ecowitt', 'MODE', fallback="poll").lower() == "push"
+        self.path = "/" + config.get('Ecowitt', 'PATH', fallback="/data/report").strip("/")
+        self.passkey = config.get('Ecowitt', 'PASSKEY', fallback="")
+
+    def sources(self):
+        if self.push:
+            return [{"name": self.sourcename, "url": "push " + self.path, "wait": self.wait,
+                "timeout": self.timeout, "measurement": self.field, "tag": False, "push": True,
+                "info": {"name": self.sourcename, "mode": "push", "path": self.path, "units": self.units}}]
+        url = self.URL + "?mac=" + self.mac
+        if self.units == 'metric':
+            url = url + "&temp_unitid=1&pressure_unitid=3&wind_speed_unitid=7&rainfall_unitid=12&solar_irradiance_unitid=16"
+        elif self.units == 'imperial':
+            url = url + "&temp_unitid=2&pressure_unitid=4&wind_speed_unitid=9&rainfall_unitid=13&solar_irradiance_unitid=16"
+        return [{"name": self.sourcename, "url": url, "wait": self.wait, "timeout": self.timeout,
+            "measurement": self.field, "tag": False,
+            "info": {"name": self.sourcename, "mac": self.mac, "units": self.units}}]
+
+    def requesturl(self, source):
+        return source["url"] + "&application_key=" + self.app + "&api_key=" + self.key
+
+    def parse(self, raw):
+        if str(raw.get('code', 0)) != "0":
+            raise ValueError("Ecowitt API error %s: %s" % (raw.get('code'), raw.get('msg')))
+        weather = self.clear()
+        try:
+            weather["dt"] = int(raw['time'])
+            datapayload = raw['data']
+            if "outdoor" in datapayload:
+                data = datapayload["outdoor"]
+                weather["temperature"] = getvalue(data, 'temperature', 'float')
+                weather["feels_like"] = getvalue(data, 'feels_like', 'float')
+                weather["app_temp"] = getvalue(data, 'app_temp', 'float')
+                weather["dew_point"] = getvalue(data, 'dew_point', 'float')
+                weather["humidity"] = getvalue(data, 'humidity', 'float')
+            if "indoor" in datapayload:
+                data = datapayload["indoor"]
+                weather["inside_temp"] = getvalue(data, 'temperature', 'float')
+                weather["inside_humidity"] = getvalue(data, 'humidity', 'float')
+            if "solar_and_uvi" in datapayload:
+                data = datapayload["solar_and_uvi"]
+                weather["solar"] = getvalue(data, 'solar', 'float')
+                weather["uvi"] = getvalue(data, 'uvi', 'int')
+            if "rainfall" in datapayload:
+                data = datapayload["rainfall"]
+                weather["rain_1h"] = getvalue(data, 'hourly', 'float')
+                weather["rain_24h"] = getvalue(data, 'daily', 'float')
+            if "wind" in datapayload:
+                data = datapayload["wind"]
+                weather["wind_speed"] = getvalue(data, 'wind_speed', 'float')
+                weather["wind_deg"] = getvalue(data, 'wind_direction', 'int')
+                weather["wind_gust"] = getvalue(data, 'wind_gust', 'float')
+            if "pressure" in datapayload:
+                data = datapayload["pressure"]
+                weather["pressure"] = getvalue(data, 'absolute', 'float')
+            if "co2_aqi_combo" in datapayload:
+                data = datapayload["co2_aqi_combo"]
+                weather["co2"] = getvalue(data, 'co2', 'int')
+            if "pm25_aqi_combo" in datapayload:
+                data = datapayload["pm25_aqi_combo"]
+                weather["pm25"] = getvalue(data, 'pm25', 'int')
+                weather["pm25aqi"] = getvalue(data, 'real_time_aqi', 'int')
+            if "pm10_aqi_combo" in datapayload:
+                data = datapayload["pm10_aqi_combo"]
+                weather["pm10"] = getvalue(data, 'pm10', 'int')
+                weather["pm10aqi"] = getvalue(data, 'real_time_aqi', 'int')
+        except:
+            log.debug("Data error in payload from Ecowitt")
+            pass
+        return weather
+
+    def decode(self, fields):
+        if self.passkey != "" and self.passkey not in [fields.get("PASSKEY"), fields.get("ID")]:
+            raise ValueError("Unknown PASSKEY or ID")
+        weather = self.clear()
+        # dateutc is "YYYY-MM-DD HH:MM:SS" in UTC or "now"
+        try:
+            weather["dt"] = int(datetime.strptime(fields["dateutc"], "%Y-%m-%d %H:%M:%S")
+                .replace(tzinfo=timezone.utc).timestamp())
+        except (KeyError, ValueError):
+            weather["dt"] = int(time.time())
+        for key, names, kind in self.PUSHFIELDS:
+            for name in names:
+                if fields.get(name, "") not in ["", "-"]:
+                    try:
+                        value = float(fields[name])
+                    except ValueError:
+                        log.debug("Data error in push field %s" % name)
+                        break
+                    if kind == "int":
+                        weather[key] = int(value)
+                    elif kind == "float" or self.units != "metric":
+                        weather[key] = value
+                    else:
+                        weather[key] = self.METRIC[kind](value)
+                    break
+        return weather
+
+    def routes(self, data):
+        routes = [(['/json', '/all'], data), (['/temp'], {"temperature": data["temperature"]})]
+        for i in ["temperature","humidity","pressure","feels_like","app_temp","dew_point"]:
+            routes.append((['/' + i], {i: data[i]}))
+        routes.append((['/wind'], {"wind_speed": data['wind_speed'], "wind_deg": data['wind_deg'],
+            "wind_gust": data['wind_gust']}))
+        routes.append((['/solar'], {"solar": data['solar']}))
+        routes.append((['/uvi'], {"uvi": data['uvi']}))
+        routes.append((['/indoor'], {"inside_temp": data["inside_temp"],
+            "inside_humidity": data["inside_humidity"]}))
+        routes.append((['/aqi'], {"pm25": data['pm25'], "pm25aqi": data['pm25aqi'],
+            "pm10": data['pm10'], "pm10aqi": data['pm10aqi'], "co2": data['co2']}))
+        routes.append((['/rain', '/precipitation'], {"rain_1h": data['rain_1h'],
+            "rain_24h": data['rain_24h']}))
+        return routes
+
+    def describe(self):
+        if self.push:
+            return [" + Ecowitt - Mode: push, Path: %s, Passkey: %s, Units: %s, Field: %s\n"
+                % (self.path, "*" * len(self.passkey) if self.passkey != "" else "Any", self.units, self.field)]
+        return [" + Ecowitt - Key: %s, Wait: %s, Units: %s, Field: %s\n + Ecowitt - App: %s, Timeout: %s\n"
+            % (self.key, self.wait, self.units, self.field, self.app, self.timeout)]
+
+PROVIDERS = {"OpenWeatherMap": OpenWeatherMap, "Ecowitt": Ecowitt}
+
+# InfluxDB Functions
+def queueInflux(point):
+    # queue point for the influxWriter thread - drop oldest point if full
+    while True:
+        try:
+            influxqueue.put_nowait(point)
+            return
+        except queue.Full:
+            try:
+                influxqueue.get_nowait()
+                serverstats['influxdbdropped'] += 1
+                log.debug("InfluxDB queue full - dropped oldest point")
+            except queue.Empty:
+                pass
+
+def influxConnect():
+    # create InfluxDB client - the client keeps a pool of keep-alive connections
+    if ITOKEN == "":
+        # Influx 1.8
+        return InfluxDBClient(
+            url="http://%s:%s" % (IHOST,IPORT),
+            token="%s:%s" % (IUSER,IPASS),
+            org='-',
+            database=IDB)
+    # Influx 2.x
+    return InfluxDBClient(
+        url=IURL,
+        token=ITOKEN,
+        username=IUSER,
+        password=IPASS,
+        org=IORG)
+
+def influxWrite(lines):
+    # write line protocol points to InfluxDB using the shared client
+    global influxclient, influxwriteapi
+    starttime = time.perf_counter()
+    try:
+        if influxclient is None:
+            influxclient = influxConnect()
+            influxwriteapi = influxclient.write_api(write_options=SYNCHRONOUS)
+        influxwriteapi.write(IDB, IORG, lines, write_precision=WritePrecision.S)
+    except:
+        influxlatency.observe(time.perf_counter() - starttime, "error")
+        raise
+    influxlatency.observe(time.perf_counter() - starttime, "ok")
+
+def spoolSegments():
+    # list spool segment files - oldest first
+    try:
+        return sorted(os.path.join(SPOOLDIR, f) for f in os.listdir(SPOOLDIR) if f.endswith(".lp"))
+    except OSError:
+        return []
+
+def spoolCount(segment):
+    # number of points in a spool segment
+    try:
+        with open(segment, "r") as f:
+            return sum(1 for line in f if line.strip())
+    except OSError:
+        return 0
+
+def spoolAppend(lines):
+    """
+    Append line protocol points to the active spool segment
+
+    The segment is fsync'd once per call. Segments are rotated at a tenth of
+    SPOOLSIZE and the oldest segments are removed when over SPOOLSIZE.
+    Returns True if the points were spooled.
+    """
+    global spoolfile, spoolseq
+    try:
+        if spoolfile is not None and spoolfile.tell() >= SPOOLSIZE * 1024 * 1024 // 10:
+            spoolfile.close()
+            spoolfile = None
+        if spoolfile is None:
+            os.makedirs(SPOOLDIR, exist_ok=True)
+            spoolseq += 1
+            spoolfile = open(os.path.join(SPOOLDIR, "%d-%06d.lp" % (time.time(), spoolseq)), "a")
+        spoolfile.write("\n".join(lines) + "\n")
+        spoolfile.flush()
+        os.fsync(spoolfile.fileno())
+        serverstats['spoolpoints'] += len(lines)
+        log.debug("Spooled %d points" % len(lines))
+
+        # Enforce size cap - drop oldest segments (never the active one)
+        segments = spoolSegments()
+        total = sum(os.path.getsize(f) for f in segments)
+        for segment in segments[:-1]:
+            if total <= SPOOLSIZE * 1024 * 1024:
+                break
+            dropped = spoolCount(segment)
+            total -= os.path.getsize(segment)
+            os.remove(segment)
+            serverstats['spoolpoints'] -= dropped
+            serverstats['spooldropped'] += dropped
+            sys.stderr.write("! Spool full - dropped %d points\n" % dropped)
+        return True
+    except OSError:
+        log.debug("Error writing to spool")
+        sys.stderr.write("! Error writing to spool %s\n" % SPOOLDIR)
+        serverstats['spoolerrors'] += 1
+        return False
+
+def spoolReplay():
+    """
+    Write all spooled points to InfluxDB in timestamp order and remove the segments
+
+    Raises on write errors and leaves the segments in place. Rewriting points
+    already sent by an earlier partial replay is harmless as InfluxDB replaces
+    points with the same series and timestamp.
+    """
+    global spoolfile
+    if spoolfile is not None:
+        spoolfile.close()
+        spoolfile = None
+    segments = spoolSegments()
+    lines = []
+    for segment in segments:
+        with open(segment, "r") as f:
+            lines.extend(line.rstrip("\n") for line in f if line.strip())
+
+    def timestamp(line):
+        try:
+            return int(line.rsplit(" ", 1)[1])
+        except (IndexError, ValueError):
+            return 0
+    lines.sort(key=timestamp)
+
+    log.debug("Replaying %d spooled points to InfluxDB" % len(lines))
+    for i in range(0, len(lines), 5000):
+        influxWrite(lines[i:i + 5000])
+    for segment in segments:
+        os.remove(segment)
+    serverstats['influxdb'] += len(lines)
+    serverstats['spoolreplayed'] += len(lines)
+    serverstats['spoolpoints'] = 0
+    if lines:
+        sys.stderr.write("* Replayed %d spooled points to InfluxDB\n" % len(lines))
+
+# Metrics and History
+class Histogram(object):
+    """
+    Latency histogram for /metrics
+
+    Each thread records into its own bucket counts so observe() needs no lock;
+    the shards are only summed when /metrics is requested.
+    """
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self.local = threading.local()
+        self.shards = []
+
+    def observe(self, value, labelvalue):
+        shard = getattr(self.local, 'shard', None)
+        if shard is None:
+            shard = self.local.shard = {}
+            self.shards.append(shard)
+        counts = shard.get(labelvalue)
+        if counts is None:
+            # bucket counts, +Inf count, sum
+            counts = shard[labelvalue] = [0] * (len(self.buckets) + 2)
+        counts[bisect_left(self.buckets, value)] += 1
+        counts[-1] += value
+
+    def exposition(self):
+        # render histogram in Prometheus text format
+        totals = {}
+        for shard in list(self.shards):
+            for labelvalue, counts in list(shard.items()):
+                total = totals.setdefault(labelvalue, [0] * len(counts))
+                for i, count in enumerate(list(counts)):
+                    total[i] += count
+        lines = ["# HELP %s %s" % (self.name, self.help), "# TYPE %s histogram" % self.name]
+        for labelvalue in sorted(totals):
+            total = totals[labelvalue]
+            label = '%s="%s"' % (self.label, labelvalue)
+            cumulative = 0
+            for i, le in enumerate(self.buckets):
+                cumulative += total[i]
+                lines.append('%s_bucket{%s,le="%s"} %d' % (self.name, label, le, cumulative))
+            cumulative += total[-2]
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (self.name, label, cumulative))
+            lines.append('%s_sum{%s} %s' % (self.name, label, total[-1]))
+            lines.append('%s_count{%s} %d' % (self.name, label, cumulative))
+        return lines
+
+def metrics():
+    # render /metrics payload in Prometheus text format
+    snap = snapshot
+    currentts = time.time()
+    lines = ["# HELP %s_build_info %s version." % (METRICS, APPNAME),
+        "# TYPE %s_build_info gauge" % METRICS,
+        '%s_build_info{version="%s"} 1' % (METRICS, BUILD)]
+    lines += ["# HELP %s_data_age_seconds Seconds since the current observation (weather dt)." % METRICS,
+        "# TYPE %s_data_age_seconds gauge" % METRICS]
+    for locsnap in snap["locations"]:
+        lines.append('%s_data_age_seconds{location="%s"} %s' % (METRICS, locsnap["name"],
+            currentts - locsnap["dt"] if locsnap["loaded"] else -1))
+    lines += ["# HELP %s_upstream_cadence_seconds Learned upstream update interval." % METRICS,
+        "# TYPE %s_upstream_cadence_seconds gauge" % METRICS]
+    for name, cadence in sorted(list(serverstats['cadence'].items())):
+        lines.append('%s_upstream_cadence_seconds{location="%s"} %s' % (METRICS, name, cadence))
+    for name, help, value in [
+            ("influxdb_queue_depth", "Points waiting to be written to InfluxDB.",
+                influxqueue.qsize()),
+            ("spool_points", "Points buffered in the on-disk spool.",
+                serverstats['spoolpoints'])]:
+        name = "%s_%s" % (METRICS, name)
+        lines += ["# HELP %s %s" % (name, help), "# TYPE %s gauge" % name,
+            "%s %s" % (name, value)]
+    for name, help, key in [
+            ("http_requests_total", "API requests.", 'gets'),
+            ("http_errors_total", "API requests for unsupported paths.", 'errors'),
+            ("http_not_modified_total", "API requests answered with 304.", 'notmodified'),
+            ("http_rejected_total", "API connections refused with 503 (too many waiting).", 'rejected'),
+            ("influxdb_points_total", "Points written to InfluxDB.", 'influxdb'),
+            ("influxdb_errors_total", "InfluxDB write errors.", 'influxdberrors'),
+            ("influxdb_dropped_total", "Points dropped before reaching InfluxDB.", 'influxdbdropped'),
+            ("spool_replayed_total", "Spooled points replayed to InfluxDB.", 'spoolreplayed'),
+            ("push_total", "Weather station uploads received.", 'pushes'),
+            ("push_errors_total", "Weather station uploads rejected.", 'pusherrors')]:
+        name = "%s_%s" % (METRICS, name)
+        lines += ["# HELP %s %s" % (name, help), "# TYPE %s counter" % name,
+            "%s %d" % (name, serverstats[key])]
+    lines += ["# HELP %s_upstream_responses_total Upstream responses by status." % METRICS,
+        "# TYPE %s_upstream_responses_total counter" % METRICS]
+    for code, count in sorted(list(upstreamcodes.items())):
+        lines.append('%s_upstream_responses_total{code="%s"} %d' % (METRICS, code, count))
+    for histogram in [httplatency, upstreamlatency, influxlatency]:
+        lines += histogram.exposition()
+    return "\n".join(lines) + "\n"
+
+class History(object):
+    """
+    Ring buffer of the most recent observations for /history
+
+    Values are kept in fixed-size numeric arrays (one per field, NaN when
+    missing) rather than a list of dicts.
+    """
+    def __init__(self, size, fields):
+        self.size = size
+        self.FIELDS = fields
+        self.dt = array('q', [0]) * size
+        self.columns = {}
+        for field in self.FIELDS:
+            self.columns[field] = array('d', [float('nan')]) * size
+        self.next = 0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def append(self, weather):
+        # add an observation - overwrites the oldest when full
+        with self.lock:
+            i = self.next
+            self.dt[i] = weather["dt"]
+            for field in self.FIELDS:
+                value = weather.get(field)
+                self.columns[field][i] = float('nan') if value is None else value
+            self.next = (i + 1) % self.size
+            self.count = min(self.count + 1, self.size)
+
+    def query(self, since=0, fields=None):
+        # observations newer than since (oldest first) with min/max/mean
+        fields = fields or self.FIELDS
+        with self.lock:
+            order = [(self.next - self.count + i) % self.size for i in range(self.count)]
+            rows = [i for i in order if self.dt[i] > since]
+            result = {"since": since, "count": len(rows), "dt": [self.dt[i] for i in rows],
+                "fields": {}, "aggregates": {}}
+            for field in fields:
+                column = self.columns[field]
+                values = [column[i] for i in rows]
+                present = [v for v in values if v == v]
+                result["fields"][field] = [v if v == v else None for v in values]
+                result["aggregates"][field] = {
+                    "min": min(present) if present else None,
+                    "max": max(present) if present else None,
+                    "mean": sum(present) / len(present) if present else None}
+        return result
+
+def history(path):
+    # /history[/<location>]?since=<epoch or -seconds>&fields=<a,b,..>
+    url = urlsplit(path)
+    name = url.path[len('/history/'):] if url.path.startswith('/history/') else SOURCES[0]["name"]
+    loc = [l for l in SOURCES if l["name"] == name]
+    if not loc or "history" not in loc[0]:
+        return "Error: Unknown location or history disabled"
+    params = parse_qs(url.query)
+    try:
+        since = int(params.get("since", ["0"])[0])
+    except ValueError:
+        return "Error: Invalid since"
+    if since < 0:
+        since = int(time.time()) + since
+    fields = None
+    available = loc[0]["history"].FIELDS
+    if "fields" in params:
+        fields = [f for f in ",".join(params["fields"]).split(",") if f != ""]
+        if [f for f in fields if f not in available]:
+            return "Error: Unsupported field - available: %s" % ",".join(available)
+    result = loc[0]["history"].query(since, fields)
+    result["location"] = name
+    return json.dumps(result)
+
+def publishSnapshot(loc, expires=0):
+    """
+    Publish an immutable snapshot of the current weather data for a source
+    with every API response pre-encoded, so requests only need a dict lookup
+    and a write. Snapshots are replaced (never modified) by the fetch thread.
+    """
+    global snapshot
+    data = dict(loc["weather"])
+    bodies = {}
+
+    def add(paths, result):
+        body = bytes(json.dumps(result), "utf8")
+        for path in paths:
+            bodies[path] = body
+
+    add(['/raw'], loc["raw"])
+    for paths, result in loc["provider"].routes(data):
+        add(paths, result)
+
+    # Human friendly display - only the page refresh time is added per request
+    html = ['<html>\n<head><meta http-equiv="refresh" content="5" />\n',
+        '<style>p, td, th { font-family: Helvetica, Arial, sans-serif; font-size: 10px;}</style>\n',
+        '<style>h1 { font-family: Helvetica, Arial, sans-serif; font-size: 20px;}</style>\n',
+        '</head>\n<body>\n<h1>%s Server v%s</h1>\n\n' % (APPNAME, BUILD)]
+    if not loc["loaded"]:
+        html.append("<p>Error: No weather data available</p>")
+    else:
+        html.append('<table>\n<tr><th align ="right">Current</th><th align ="right">Value</th></tr>')
+        for i in data:
+            html.append('<tr><td align ="right">%s</td><td align ="right">%s</td></tr>\n' % (i, data[i]))
+        html.append("</table>\n")
+    html.append('<p>Last data update: %s<br><font size=-2>From URL: %s</font></p>' % (
+        str(datetime.fromtimestamp(data['dt'])), loc["url"]))
+
+    loc["snapshot"] = {
+        "name": loc["name"],
+        "loaded": loc["loaded"],
+        "weather": data,
+        "bodies": bodies,
+        "html": "".join(html),
+        "etag": '"%x-%x"' % (data['dt'], int(time.time())),
+        "dt": data['dt'],
+        "modified": formatdate(data['dt'], usegmt=True),
+        "expires": expires,
+    }
+
+    # Route table - first source is served without a location suffix
+    routes = {}
+    locations = [l["snapshot"] for l in SOURCES if "snapshot" in l]
+    for i, locsnap in enumerate(locations):
+        for path, body in locsnap["bodies"].items():
+            if i == 0:
+                routes[path] = (locsnap, body)
+            routes[path + "/" + locsnap["name"]] = (locsnap, body)
+    routes['/locations'] = (locations[0], bytes(json.dumps([l["info"] for l in SOURCES]), "utf8"))
+    snapshot = {"routes": routes, "primary": locations[0], "locations": locations}
+
+# Threads
+def fetchSchedule(lastfetch, dt, cadence, wait):
+    # next fetch - WAIT minutes after the last one or just after the next expected refresh
+    nextupdate = lastfetch + (60 * wait)
+    if cadence is not None and dt + cadence + 30 > nextupdate:
+        nextupdate = min(dt + cadence + 30, lastfetch + 3 * 3600)
+    return nextupdate
+
+def fetchBackoff(errors, wait, response=None):
+    # seconds to wait after consecutive errors - honors Retry-After on 429
+    if response is not None and response.status_code == 429:
+        try:
+            return max(60, int(response.headers.get('Retry-After')))
+        except (TypeError, ValueError):
+            pass
+    return min(max(3600, 60 * wait), 60 * wait * 2 ** (errors - 1))
+
+def fetchSource(session, loc, currentts):
+    """
+    Fetch current weather conditions for a source and schedule its next fetch
+
+    For adaptive providers the upstream update cadence is learned from
+    successive 'dt' values and the next fetch is scheduled just after the
+    expected refresh (never sooner than WAIT minutes). Unchanged data is
+    re-checked with an increasing delay and errors back off exponentially.
+    """
+    provider = loc["provider"]
+    lastdt = loc["weather"]["dt"]
+    wait = loc["wait"]
+    loc["nextupdate"] = currentts + (60 * wait)
+    response = None
+    try:
+        serverstats['fetches'] += 1
+        starttime = time.perf_counter()
+        try:
+            response = session.get(provider.requesturl(loc), timeout=loc["timeout"])
+        except:
+            upstreamlatency.observe(time.perf_counter() - starttime, "error")
+            upstreamcodes["error"] = upstreamcodes.get("error", 0) + 1
+            raise
+        code = str(response.status_code)
+        upstreamlatency.observe(time.perf_counter() - starttime, code)
+        upstreamcodes[code] = upstreamcodes.get(code, 0) + 1
+        if response.status_code == 200:
+            raw = response.json()
+            weather = provider.parse(raw)
+            if not weather["dt"] or lastdt == weather["dt"]:
+                # Data didn't update - check again shortly
+                log.debug("No new data from %s [%s]" % (provider.name, loc["name"]))
+                serverstats['fetchstale'] += 1
+                loc["errors"] = 0
+                loc["stale"] += 1
+                if loc["cadence"] is not None:
+                    # Refresh is late - retry with increasing delay up to the cadence
+                    loc["nextupdate"] = currentts + min(60 * 2 ** (loc["stale"] - 1),
+                        max(60 * wait, loc["cadence"]))
+                return
+            loc["stale"] = 0
+            loc["errors"] = 0
+
+            # Learn update cadence from the median of recent observation intervals
+            if provider.adaptive and lastdt and 0 < weather["dt"] - lastdt <= 3 * 3600:
+                loc["deltas"] = (loc["deltas"] + [weather["dt"] - lastdt])[-5:]
+                loc["cadence"] = sorted(loc["deltas"])[len(loc["deltas"]) // 2]
+                serverstats['cadence'][loc["name"]] = loc["cadence"]
+            loc["nextupdate"] = fetchSchedule(currentts, weather["dt"], loc["cadence"], wait)
+
+            loc["raw"] = raw
+            loc["weather"] = weather
+            log.debug("Weather data loaded [%s]" % loc["name"])
+            updateSource(loc, weather, loc["nextupdate"])
+        else:
+            # showing the error message
+            log.debug("Bad response from %s" % provider.name)
+            sys.stderr.write("! Bad response from %s (%s) [%s]\n" % (provider.name, response.status_code, loc["name"]))
+            serverstats['fetcherrors'] += 1
+            loc["errors"] += 1
+            loc["nextupdate"] = currentts + fetchBackoff(loc["errors"], wait, response)
+    except:
+        log.debug("Error fetching %s" % provider.name)
+        sys.stderr.write("! Error fetching %s [%s]\n" % (provider.name, loc["name"]))
+        serverstats['fetcherrors'] += 1
+        loc["errors"] += 1
+        loc["nextupdate"] = currentts + fetchBackoff(loc["errors"], wait)
+        pass
+
+def updateSource(loc, weather, expires=0):
+    # publish new weather data for a source to the API, history and InfluxDB
+    loc["loaded"] = True
+    if "history" in loc:
+        loc["history"].append(weather)
+    # fetch and push (API worker) threads both publish - serialize route table updates
+    with publishlock:
+        publishSnapshot(loc, expires)
+
+    if INFLUX:
+        log.debug("Queueing InfluxDB write")
+        output = {}
+        output["measurement"] = loc["measurement"]
+        output["time"] = weather["dt"]
+        if loc["tag"]:
+            output["tags"] = {"location": loc["name"]}
+        output["fields"] = {}
+        for i in weather:
+            output["fields"][i] = weather[i]
+        # Queue as line protocol so it can be spooled to disk as is
+        queueInflux(Point.from_dict(output, write_precision=WritePrecision.S).to_line_protocol())
+
+def pushSource(loc, fields):
+    """
+    Update a push source with weather data uploaded by the station
+
+    Returns an error message or None. Uploads with an observation time that
+    is not newer than the current data (e.g. retries) are accepted but
+    ignored.
+    """
+    provider = loc["provider"]
+    try:
+        weather = provider.decode(fields)
+    except ValueError as err:
+        log.debug("Rejected upload for %s: %s" % (loc["name"], err))
+        sys.stderr.write("! Rejected upload from %s [%s]\n" % (provider.name, loc["name"]))
+        serverstats['pusherrors'] += 1
+        return "Error: %s" % err
+    serverstats['pushes'] += 1
+    # Hold the source lock from the time check until published, so a
+    # concurrent older upload can not replace newer data
+    with loc["lock"]:
+        if weather["dt"] <= loc["weather"]["dt"]:
+            serverstats['fetchstale'] += 1
+            return None
+        # Keep credentials out of /raw
+        loc["raw"] = dict((k, v) for k, v in fields.items() if k not in ["PASSKEY", "ID", "PASSWORD"])
+        loc["weather"] = weather
+        log.debug("Weather data received [%s]" % loc["name"])
+        updateSource(loc, weather)
+    return None
+
+def fetchWeather():
+    """
+    Thread to poll for current weather conditions
+
+    A single scheduler and pooled session serves all sources - the source
+    with the earliest next update is fetched and the thread then sleeps until
+    the next one is due.
+    """
+    polled = [l for l in SOURCES if not l.get("push")]
+    sys.stderr.write(" + fetchWeather thread - %d source(s)\n" % len(polled))
+    session = requests.Session()
+    for loc in polled:
+        loc["nextupdate"] = time.time()
+        loc["deltas"] = []
+        loc["cadence"] = None
+        loc["stale"] = 0
+        loc["errors"] = 0
+
+    # Time Loop to update current weather data
+    while(running):
+        if not polled:
+            # Push sources only - nothing to fetch
+            fetchwake.wait()
+            continue
+        loc = min(polled, key=lambda l: l["nextupdate"])
+        currentts = time.time()
+        # Sleep until it is time for the next update (or shutdown)
+        if currentts < loc["nextupdate"]:
+            fetchwake.wait(loc["nextupdate"] - currentts)
+            continue
+        fetchSource(session, loc, currentts)
+        serverstats['nextfetch'][loc["name"]] = int(loc["nextupdate"])
+    session.close()
+    sys.stderr.write('\r ! fetchWeather Exit\n')
+
+def influxWriter():
+    """
+    Thread to write queued weather data to InfluxDB
+
+    A single client and write_api is kept for the life of the server and points
+    are written in batches of BATCH or every FLUSH seconds.  If InfluxDB is not
+    available, batches are spooled to disk (SPOOL) and replayed once a retry
+    with exponential backoff succeeds.  Without a spool the failed batch is held
+    and retried while new points wait in the bounded queue.
+    """
+    sys.stderr.write(" + influxWriter thread\n")
+    batch = []
+    batchts = 0
+    retries = 0
+    retryts = 0
+
+    # Pick up points spooled by a previous run
+    if SPOOLDIR != "":
+        serverstats['spoolpoints'] = sum(spoolCount(f) for f in spoolSegments())
+
+    while True:
+        # Collect queued points up to the batch size
+        try:
+            while len(batch) < IBATCH:
+                point = influxqueue.get(timeout=1 if running and not batch else 0.1)
+                if not batch:
+                    batchts = time.time()
+                batch.append(point)
+        except queue.Empty:
+            pass
+        serverstats['influxdbqueue'] = influxqueue.qsize() + len(batch)
+        currentts = time.time()
+        ready = batch and (len(batch) >= IBATCH or currentts >= batchts + IFLUSH)
+        spooled = SPOOLDIR != "" and serverstats['spoolpoints'] > 0
+
+        if not running:
+            # Write what is left (or spool it for the next run) and exit
+            if batch:
+                try:
+                    if spooled:
+                        raise IOError("InfluxDB unavailable")
+                    influxWrite(batch)
+                    serverstats['influxdb'] += len(batch)
+                except:
+                    if SPOOLDIR == "" or not spoolAppend(batch):
+                        serverstats['influxdbdropped'] += len(batch)
+            break
+
+        if currentts < retryts:
+            # InfluxDB unavailable - move batches to the spool while backing off
+            if ready and SPOOLDIR != "":
+                if not spoolAppend(batch):
+                    serverstats['influxdbdropped'] += len(batch)
+                batch = []
+            elif len(batch) >= IBATCH:
+                time.sleep(1)
+            continue
+        if not ready and not spooled:
+            continue
+
+        try:
+            if spooled:
+                # Append current batch to the spool and replay it all in order
+                if batch:
+                    if not spoolAppend(batch):
+                        serverstats['influxdbdropped'] += len(batch)
+                    batch = []
+                spoolReplay()
+            else:
+                log.debug("Writing %d points to InfluxDB" % len(batch))
+                influxWrite(batch)
+                serverstats['influxdb'] += len(batch)
+                batch = []
+            serverstats['influxdbbatches'] += 1
+            retries = 0
+            retryts = 0
+        except:
+            log.debug("Error writing to InfluxDB")
+            sys.stderr.write("! Error writing to InfluxDB\n")
+            serverstats['influxdberrors'] += 1
+            if batch and SPOOLDIR != "":
+                if not spoolAppend(batch):
+                    serverstats['influxdbdropped'] += len(batch)
+                batch = []
+            # Back off before retrying (max 5 minutes)
+            serverstats['influxdbretries'] += 1
+            retryts = currentts + min(300, 2 ** retries)
+            retries += 1
+            pass
+
+    if spoolfile is not None:
+        spoolfile.close()
+    if influxclient is not None:
+        influxclient.close()
+    sys.stderr.write('\r ! influxWriter Exit\n')
+
+class PooledHTTPServer(HTTPServer):
+    """
+    HTTP server that hands each connection to a bounded pool of worker threads
+
+    A keep-alive connection holds its worker while the client keeps sending
+    requests, so when connections are waiting for a worker the active ones are
+    closed after their current response (see handler.end_headers()).  New
+    connections are refused with 503 when more than 'backlog' are waiting.
+    """
+    def __init__(self, server_address, handlerclass, workers, backlog=None):
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.workers = workers
+        self.backlog = workers * 4 if backlog is None else backlog
+        self.connections = 0
+        self.lock = threading.Lock()
+        HTTPServer.__init__(self, server_address, handlerclass)
+
+    def busy(self):
+        # connections are waiting for a worker
+        return self.connections > self.workers
+
+    def process_request_thread(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            with self.lock:
+                self.connections -= 1
+
+    def process_request(self, request, client_address):
+        with self.lock:
+            full = self.connections >= self.workers + self.backlog
+            if not full:
+                self.connections += 1
+        if full:
+            serverstats['rejected'] += 1
+            try:
+                request.sendall(b"HTTP/1.1 503 Service Unavailable\r\nContent-Length: 0\r\n"
+                    b"Retry-After: 1\r\nConnection: close\r\n\r\n")
+            except OSError:
+                pass
+            self.shutdown_request(request)
+            return
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.pool.shutdown(wait=False)
+
+class handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keep-alive - idle connections are closed after timeout seconds
+    # so they do not hold on to pool workers
+    protocol_version = "HTTP/1.1"
+    timeout = 5
+    # Headers and body are separate writes - avoid Nagle/delayed ACK stalls
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        if DEBUGMODE:
+            sys.stderr.write("%s - - [%s] %s\n" %
+                         (self.address_string(),
+                          self.log_date_time_string(),
+                          format%args))
+        else:
+            pass
+
+    def address_string(self):
+        # replace function to avoid lookup delays
+        host, hostport = self.client_address[:2]
+        return host
+
+    def end_headers(self):
+        # give the worker up after this response if other connections are waiting
+        if not self.close_connection and self.server.busy():
+            self.send_header('Connection', 'close')
+        BaseHTTPRequestHandler.end_headers(self)
+
+    def notModified(self, snap):
+        # check conditional request headers against the snapshot
+        etag = self.headers.get('If-None-Match')
+        if etag is not None:
+            return etag.strip() == '*' or snap["etag"] in [e.strip() for e in etag.split(',')]
+        since = self.headers.get('If-Modified-Since')
+        if since is not None:
+            try:
+                return int(parsedate_to_datetime(since).timestamp()) >= snap["dt"]
+            except (TypeError, ValueError):
+                pass
+        return False
+
+    def routePath(self):
+        # path of the request for stats and metrics - query strings and history sub-paths are not
+        # included, so the number of paths counted stays bounded
+        if self.path in snapshot["routes"] or self.path in ["/", "/stats", "/time", "/metrics"]:
+            return self.path
+        elif self.path.split("?")[0] == '/history' or self.path.startswith('/history/'):
+            return "/history"
+        return "other"
+
+    def do_POST(self):
+        starttime = time.perf_counter()
+        # Check upload size before reading the body
+        try:
+            length = int(self.headers.get('Content-Length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0 or length > PUSHMAXSIZE:
+            serverstats['pusherrors'] += 1
+            if length < 0:
+                self.send_error(400, "Invalid Content-Length")
+            else:
+                self.send_error(413, "Upload too large")
+            httplatency.observe(time.perf_counter() - starttime, "other")
+            return
+        body = self.rfile.read(length).decode("utf8", "replace") if length > 0 else ""
+        loc = PUSHROUTES.get(urlsplit(self.path).path.rstrip("/"))
+        if loc is not None:
+            self.receive(loc, body)
+            path = "/push"
+        else:
+            self.reply("Error: Unsupported Request")
+            serverstats['errors'] = serverstats['errors'] + 1
+            path = "other"
+        httplatency.observe(time.perf_counter() - starttime, path)
+
+    def receive(self, loc, query):
+        # station upload - Ecowitt POST body or Wunderground GET query string
+        fields = dict((k, v[0]) for k, v in parse_qs(query, keep_blank_values=True).items())
+        message = pushSource(loc, fields)
+        self.reply(message or "success", 'text/plain')
+
+    def reply(self, message, contenttype='application/json'):
+        # send a 200 response with a text payload
+        payload = bytes(message, "utf8")
+        self.send_response(200)
+        self.send_header('Content-type', contenttype)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        starttime = time.perf_counter()
+        url = urlsplit(self.path)
+        if url.query and url.path.rstrip("/") in PUSHROUTES:
+            self.receive(PUSHROUTES[url.path.rstrip("/")], url.query)
+            httplatency.observe(time.perf_counter() - starttime, "/push")
+            return
+        self.respond()
+        httplatency.observe(time.perf_counter() - starttime, self.routePath())
+
+    def respond(self):
+        snap = snapshot
+        route = snap["routes"].get(self.path)
+        if route is not None:
+            locsnap, body = route
+            # Pre-encoded response from the current snapshot
+            path = self.routePath()
+            if path in serverstats["uri"]:
+                serverstats["uri"][path] += 1
+            else:
+                serverstats["uri"][path] = 1
+            serverstats['gets'] = serverstats['gets'] + 1
+            notmodified = self.notModified(locsnap)
+            if notmodified:
+                serverstats['notmodified'] += 1
+                self.send_response(304)
+            else:
+                self.send_response(200)
+                self.send_header('Content-type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+            self.send_header('ETag', locsnap["etag"])
+            self.send_header('Last-Modified', locsnap["modified"])
+            self.send_header('Cache-Control', 'max-age=%d' % max(0, locsnap["expires"] - time.time()))
+            self.end_headers()
+            if not notmodified:
+                self.wfile.write(body)
+            return
+
+        message = "Error"
+        contenttype = 'application/json'
+        result = {}  # placeholder
+        if self.path == '/':
+            # Display friendly intro
+            contenttype = 'text/html'
+            message = snap["primary"]["html"] + '\n<p>Page refresh: %s</p>\n</body>\n</html>' % (
+                str(datetime.fromtimestamp(time.time())))
+        elif self.path == '/stats':
+            # Give Internal Stats
+            serverstats['ts'] = int(time.time())
+            serverstats['mem'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            message = json.dumps(serverstats)
+        elif self.path == '/metrics':
+            # Prometheus metrics
+            contenttype = 'text/plain; version=0.0.4; charset=utf-8'
+            message = metrics()
+        elif self.path.split("?")[0] == '/history' or self.path.startswith('/history/'):
+            # Recent observations and aggregates
+            message = history(self.path)
+        elif self.path == '/time':
+            ts = time.time()
+            result["local_time"] = str(datetime.fromtimestamp(ts))
+            result["ts"] = ts
+            result["utc"] = str(datetime.fromtimestamp(ts, tz=timezone.utc).replace(tzinfo=None))
+            if "tz" in snap["primary"]["weather"]:
+                result["tz"] = snap["primary"]["weather"]["tz"]
+            message = json.dumps(result)
+        else:
+            # Error
+            message = "Error: Unsupported Request"
+
+        # Counts
+        if "Error" in message:
+            serverstats['errors'] = serverstats['errors'] + 1
+        else:
+            path = self.routePath()
+            if path in serverstats["uri"]:
+                serverstats["uri"][path] += 1
+            else:
+                serverstats["uri"][path] = 1
+        serverstats['gets'] = serverstats['gets'] + 1
+
+        # Send headers and payload
+        self.reply(message, contenttype)
+
+def api(port):
+    """
+    API Server - Thread to listen for commands on port
+    """
+    global apiserver
+    sys.stderr.write(" + apiServer thread - Listening on http://localhost:%d (%d workers)\n"
+        % (port, APIWORKERS))
+
+    with PooledHTTPServer(('', port), handler, APIWORKERS) as server:
+        apiserver = server
+        try:
+            # Runs until shutdown() is called from the main thread
+            server.serve_forever()
+        except:
+            print(' CANCEL \n')
+    sys.stderr.write('\r ! apiServer Exit\n')
+
+def loadConfig(provider, spool):
+    """
+    Load the config file into module settings and create the sources of every
+    provider with a section in the config (entry point provider first)
+    """
+    global DEBUGMODE, API, APIPORT, APIWORKERS, APIHISTORY, SOURCES
+    global INFLUX, IHOST, IPORT, IUSER, IPASS, IDB, IFIELD, ITOKEN, IORG, IURL
+    global IBATCH, IFLUSH, IQUEUE, SPOOLDIR, SPOOLSIZE, PROVIDERLIST, PUSHROUTES
+
+    config = configparser.ConfigParser(allow_no_value=True)
+    config.read(CONFIGFILE)
+    DEBUGMODE = config[APPNAME]["DEBUG"].lower() == "yes"
+
+    # API
+    API = config["API"]["ENABLE"].lower() == "yes"
+    APIPORT = int(config["API"]["PORT"])
+    APIWORKERS = max(1, config.getint('API', 'WORKERS', fallback=8))
+    APIHISTORY = max(0, config.getint('API', 'HISTORY', fallback=288))
+
+    # InfluxDB
+    INFLUX = config["InfluxDB"]["ENABLE"].lower() == "yes"
+    IHOST = config["InfluxDB"]["HOST"]
+    IPORT = int(config["InfluxDB"]["PORT"])
+    IUSER = config["InfluxDB"]["USERNAME"]
+    IPASS = config["InfluxDB"]["PASSWORD"]
+    IDB = config["InfluxDB"]["DB"]
+    IFIELD = config["InfluxDB"]["FIELD"]
+    # Check for InfluxDB 2.x settings
+    ITOKEN = config.get('InfluxDB', 'TOKEN', fallback="")
+    IORG = config.get('InfluxDB', 'ORG', fallback="")
+    IURL = config.get('InfluxDB', 'URL', fallback="")
+
+    if ITOKEN != "" and IURL == "":
+        IURL = "http://%s:%s" % (IHOST, IPORT)
+
+    # InfluxDB writer settings
+    IBATCH = max(1, config.getint('InfluxDB', 'BATCH', fallback=10))
+    IFLUSH = max(1, config.getint('InfluxDB', 'FLUSH', fallback=5))
+    IQUEUE = max(1, config.getint('InfluxDB', 'QUEUE', fallback=1000))
+
+    # InfluxDB spool settings - relative path is based on config file location
+    SPOOLDIR = config.get('InfluxDB', 'SPOOL', fallback=spool)
+    SPOOLSIZE = max(1, config.getint('InfluxDB', 'SPOOLSIZE', fallback=10))
+    if SPOOLDIR != "" and not os.path.isabs(SPOOLDIR):
+        SPOOLDIR = os.path.join(os.path.dirname(os.path.abspath(CONFIGFILE)), SPOOLDIR)
+
+    # Providers - entry point provider first, then any other provider with a config section
+    PROVIDERLIST = []
+    SOURCES = []
+    PUSHROUTES = {}
+    for name in [provider] + sorted(p for p in PROVIDERS if p != provider):
+        if name != provider and not config.has_section(name):
+            continue
+        plugin = PROVIDERS[name](config, name == provider, IFIELD)
+        PROVIDERLIST.append(plugin)
+        for source in plugin.sources():
+            if source["name"] in [s["name"] for s in SOURCES]:
+                sys.stderr.write("ERROR: Duplicate source name [%s] - skipped\n" % source["name"])
+                continue
+            if source.get("push"):
+                path = source["info"]["path"].rstrip("/")
+                if path in PUSHROUTES:
+                    sys.stderr.write("ERROR: Duplicate push path [%s] - skipped\n" % path)
+                    continue
+                PUSHROUTES[path] = source
+                # uploads may be handled by several API workers at once (see pushSource())
+                source["lock"] = threading.Lock()
+            source["provider"] = plugin
+            SOURCES.append(source)
+
+def run(name, key, build, configfile, provider, spool="spool"):
+    """
+    Run a weather server until SIGTERM or Ctrl-C
+
+    Args:
+        name        = server name and config section with DEBUG (e.g. Weather411)
+        key         = /stats version key and /metrics name prefix (e.g. weather411)
+        build       = server version
+        configfile  = config file path
+        provider    = entry point provider (served on the plain paths)
+        spool       = default SPOOL directory ("" to disable by default)
+    """
+    global APPNAME, BUILD, CONFIGFILE, METRICS, running, influxqueue
+    global httplatency, upstreamlatency, influxlatency
+    APPNAME = name
+    BUILD = build
+    CONFIGFILE = configfile
+    METRICS = key.lower()
+    signal.signal(signal.SIGTERM, sigTermHandler)
+
+    # Load Configuration File
+    if not os.path.exists(CONFIGFILE):
+        # No config file - Display Error
+        halt("No config file.")
+    loadConfig(provider, spool)
+    if not SOURCES:
+        halt("No weather source (e.g. LAT/LON) configured.")
+
+    # Logging
+    if DEBUGMODE:
+        logging.basicConfig(format='%(levelname)s:%(message)s',level=logging.DEBUG)
+        log.setLevel(logging.DEBUG)
+        log.debug("%s [%s]\n" % (APPNAME, BUILD))
+
+    # Global Stats
+    serverstats[key] = BUILD
+    serverstats['gets'] = 0
+    serverstats['notmodified'] = 0
+    serverstats['errors'] = 0
+    serverstats['timeout'] = 0
+    serverstats['rejected'] = 0
+    serverstats['uri'] = {}
+    serverstats['ts'] = int(time.time())         # Timestamp for Now
+    serverstats['start'] = int(time.time())      # Timestamp for Start
+    serverstats['clear'] = int(time.time())      # Timestamp of lLast Stats Clear
+    serverstats['fetches'] = 0
+    serverstats['fetchstale'] = 0
+    serverstats['fetcherrors'] = 0
+    serverstats['pushes'] = 0
+    serverstats['pusherrors'] = 0
+    serverstats['cadence'] = {}
+    serverstats['nextfetch'] = {}
+    serverstats['influxdb'] = 0
+    serverstats['influxdberrors'] = 0
+    serverstats['influxdbbatches'] = 0
+    serverstats['influxdbretries'] = 0
+    serverstats['influxdbdropped'] = 0
+    serverstats['influxdbqueue'] = 0
+    serverstats['spoolpoints'] = 0
+    serverstats['spoolreplayed'] = 0
+    serverstats['spooldropped'] = 0
+    serverstats['spoolerrors'] = 0
+
+    influxqueue = queue.Queue(maxsize=IQUEUE)
+    httplatency = Histogram("%s_http_request_duration_seconds" % METRICS,
+        "API request latency by endpoint.", "path",
+        [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1])
+    upstreamlatency = Histogram("%s_upstream_fetch_duration_seconds" % METRICS,
+        "Upstream weather API fetch latency by response status.", "code",
+        [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30])
+    influxlatency = Histogram("%s_influxdb_write_duration_seconds" % METRICS,
+        "InfluxDB write latency by result.", "result",
+        [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10])
+
+    # Initial (empty) weather data
+    for loc in SOURCES:
+        loc["weather"] = loc["provider"].clear()
+        loc["raw"] = {}
+        loc["loaded"] = False
+        if APIHISTORY > 0:
+            loc["history"] = History(APIHISTORY, loc["provider"].HISTORY)
+        publishSnapshot(loc)
+
+    # Create threads
+    thread_fetchWeather = threading.Thread(target=fetchWeather)
+    thread_api = threading.Thread(target=api, args=(APIPORT,))
+    thread_influxWriter = threading.Thread(target=influxWriter)
+
+    # Print header
+    sys.stderr.write("%s Server [%s]\n" % (APPNAME, BUILD))
+    sys.stderr.write("* Configuration Loaded [%s]\n" % CONFIGFILE)
+    sys.stderr.write(" + %s - Debug: %s, Activate API: %s, API Port: %s, API Workers: %s\n"
+        % (APPNAME, DEBUGMODE, API, APIPORT, APIWORKERS))
+    for plugin in PROVIDERLIST:
+        for line in plugin.describe():
+            sys.stderr.write(line)
+    for loc in SOURCES:
+        sys.stderr.write(" + Source - Name: %s, Provider: %s, %s\n" % (loc["name"], loc["provider"].name,
+            ", ".join("%s: %s" % (k.title(), v) for k, v in loc["info"].items() if k != "name")))
+    sys.stderr.write(" + InfluxDB - Enable: %s, Host: %s, Port: %s, DB: %s, Field: %s, User: %s, Pass: %s\n"
+        % (INFLUX, IHOST, IPORT, IDB, IFIELD, IUSER, '*'*len(IPASS)))
+    sys.stderr.write(" + InfluxDB - Batch: %s, Flush: %ss, Queue: %s, Spool: %s (%sMB)\n"
+        % (IBATCH, IFLUSH, IQUEUE, SPOOLDIR if SPOOLDIR != "" else "Disabled", SPOOLSIZE))
+    if ITOKEN != "" or IORG != "":
+        sys.stderr.write(" + InfluxDB - URL: %s, Org: %s, Token: %s\n"
+            % (IURL, IORG, ITOKEN))
+
+    # Start threads
+    sys.stderr.write("* Starting threads\n")
+    thread_fetchWeather.start()
+    thread_api.start()
+    if INFLUX:
+        thread_influxWriter.start()
+    sys.stderr.flush()
+
+    try:
+        while(True):
+            time.sleep(2)
+    except (KeyboardInterrupt, SystemExit):
+        running = False
+        fetchwake.set()
+        # Close down API thread
+        if apiserver is not None:
+            apiserver.shutdown()
+        print("\r", end="")
+
+    sys.stderr.write("* Stopping\n")
+    sys.stderr.flush()